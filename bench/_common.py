@@ -0,0 +1,33 @@
+"""벤치마크 공용: 저장소 루트의 bot.py 또는 예전 커밋의 bot.py 불러오기.
+
+python bench/<스크립트>.py 로 저장소 루트에서 실행 (discord.py 등 requirements.txt 설치 필요, 디스코드·Gemini 접속 없음).
+"""
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+
+def load_bot():
+    import bot
+    return bot
+
+
+def load_revision(rev: str, name: str):
+    """git rev의 bot.py를 임시 폴더에 풀어 별도 모듈 name으로 불러옴 (messages.json이 있던 커밋이면 같이)"""
+    directory = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    for filename in ("bot.py", "messages.json"):
+        try:
+            data = subprocess.check_output(["git", "-C", REPO, "show", f"{rev}:{filename}"], stderr=subprocess.DEVNULL)
+        except subprocess.CalledProcessError:
+            continue
+        with open(os.path.join(directory, filename), "wb") as f:
+            f.write(data)
+    spec = importlib.util.spec_from_file_location(name, os.path.join(directory, "bot.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,61 @@
+"""[user-001] check_study_time 한 번 도는 비용: 활성 세션 수는 고정하고 서버 인원만 늘림.
+
+check_study_time 폴링은 user-002에서 예약 작업으로 바뀌어 지금 트리에는 없으므로,
+c8e534e 직전(guild.members 전체 훑기)과 c8e534e(활성 세션 색인)의 bot.py를 불러와 비교함.
+    python bench/bench_active_index.py [활성 세션 수]
+"""
+import asyncio
+import sys
+import time
+from types import SimpleNamespace as NS
+
+from _common import load_revision
+
+ROUNDS = 20
+
+
+async def _noop(*args, **kwargs):
+    return None
+
+
+def tick_ms(mod, members: int, active: int) -> float:
+    study = mod.CHANNELS["STUDY_UNLIMITED_MUTE"]
+    channel = NS(id=study)
+    people = [NS(id=i, bot=False, voice=None, mention=f"<@{i}>") for i in range(members)]
+    by_id = {m.id: m for m in people}
+    guild = NS(id=1, members=people, get_member=by_id.get)
+    type(mod.bot).guilds = property(lambda self: [guild])
+    mod.maybe_reset_midnight = _noop
+    mod.send_notice = _noop
+    mod.study_state.clear()
+    now = time.time()
+    for m in people[:active]:
+        m.voice = NS(channel=channel)
+        state = mod.get_user_state(m.id)
+        state.update(in_study=True, last_join_at=now, current_channel_id=study)
+        if hasattr(mod, "mark_study_active"):
+            mod.mark_study_active(1, m.id)
+        mod.ai_charged_hour_announced[m.id] = 0
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(mod.check_study_time())
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        loop.run_until_complete(mod.check_study_time())
+    loop.close()
+    return (time.perf_counter() - started) / ROUNDS * 1000
+
+
+def main() -> None:
+    active = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    full_scan = load_revision("c8e534e~1", "bot_full_scan")
+    indexed = load_revision("c8e534e", "bot_active_index")
+    print(f"활성 세션 {active}개, {ROUNDS}회 평균")
+    for members in (1_000, 10_000, 100_000):
+        print(
+            f"{members:>7}명: 전체 훑기 {tick_ms(full_scan, members, active):7.2f} ms/tick   "
+            f"활성 색인 {tick_ms(indexed, members, active):6.2f} ms/tick"
+        )
+
+
+if __name__ == "__main__":
+    main()
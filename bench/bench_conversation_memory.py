@@ -0,0 +1,49 @@
+"""[user-020] AI 채널 대화 기억: 유저 1만 명 × 30턴 기록 후 메모리, 보내는 history 최대 크기, record/history 비용.
+    python bench/bench_conversation_memory.py
+"""
+import json
+import time
+import tracemalloc
+
+from _common import load_bot
+
+bot = load_bot()
+USERS, TURNS = 10_000, 30
+QUESTION = "영어 단어 외울 때 자꾸 까먹는데 어떻게 복습 주기를 잡아야 할까요? 하루에 100개씩 보고 있어요 " * 3
+ANSWER = "에휴 그거 가지고? ① 1일·3일·7일 간격으로 다시 보기 ② 틀린 단어만 따로 모으기 ③ 자기 전 10분 훑기. " * 8
+
+
+def fill(memory) -> None:
+    for turn in range(TURNS):
+        for uid in range(USERS):
+            memory.record(uid, f"{turn} {QUESTION}", ANSWER)
+
+
+def main() -> None:
+    bot.AI_MEMORY_MAX_USERS = USERS
+    # 시간은 tracemalloc 없이 따로 잼 (켜 두면 할당마다 훅이 돌아 record가 몇 배 느려 보임)
+    memory = bot.ConversationMemory()
+    started = time.perf_counter()
+    fill(memory)
+    record_us = (time.perf_counter() - started) / (USERS * TURNS) * 1e6
+    memory = bot.ConversationMemory()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    fill(memory)
+    traced = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    largest = max(
+        len(json.dumps(memory.history(uid), ensure_ascii=False).encode()) for uid in range(0, USERS, 97)
+    )
+    started = time.perf_counter()
+    for uid in range(USERS):
+        memory.history(uid)
+    history_us = (time.perf_counter() - started) / USERS * 1e6
+    stats = memory.stats()
+    print(f"유저 {USERS}명 × {TURNS}턴")
+    print(f"  tracemalloc {traced / 1e6:.1f} MB ({traced / USERS / 1024:.1f} KB/유저), stats() 기준 {stats['bytes'] / 1e6:.1f} MB")
+    print(f"  보내는 history 최대 {largest} B (JSON), record {record_us:.1f} us, history {history_us:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""[user-017] 큰 이미지: 매 요청 base64 inline vs Files API로 한 번 올리고 URI 참조.
+로컬 스텁(같은 프로세스)으로 줄일 수 없는 6MB 이미지를 3번 보냄. 요청 크기·올린 크기·tracemalloc 최고치·maxrss 증가.
+maxrss는 프로세스마다 따로 재야 해서 인자 없이 실행하면 두 방식을 각각 하위 프로세스로 돌림.
+    python bench/bench_gemini_files.py [inline|upload]
+"""
+import asyncio
+import builtins
+import os
+import resource
+import subprocess
+import sys
+import tracemalloc
+
+from aiohttp import web
+
+from _common import load_bot
+
+REQUESTS = 3
+
+
+async def run(mode: str) -> str:
+    bot = load_bot()
+    sizes = {"generate": 0, "upload": 0}
+    upload_url = []
+
+    async def start_upload(request):
+        return web.Response(status=200, headers={"X-Goog-Upload-URL": upload_url[0]})
+
+    async def finish_upload(request):
+        sizes["upload"] += len(await request.read())
+        return web.json_response({"file": {"uri": "https://stub/files/abc", "name": "files/abc"}})
+
+    async def generate(request):
+        sizes["generate"] += len(await request.read())
+        return web.json_response({"candidates": [{"content": {"parts": [{"text": "ok"}]}}]})
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_post("/upload/v1beta/files", start_upload)
+    app.router.add_post("/up", finish_upload)
+    app.router.add_post("/v1beta/models/{model}:generateContent", generate)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    base = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    upload_url.append(f"{base}/up")
+    bot.GEMINI_API_BASE, bot.GEMINI_UPLOAD_BASE = f"{base}/v1beta", f"{base}/upload/v1beta"
+    bot.GEMINI_API_KEY, bot.GEMINI_STREAMING, bot.GEMINI_PROMPT_CACHE = "bench", False, False
+    bot.GEMINI_USE_ONLY_15_FLASH, bot.GEMINI_15_FLASH_MODELS = True, ("m",)
+    if mode == "inline":
+        bot.GEMINI_INLINE_IMAGE_MAX_BYTES = 1 << 30
+    bot.PIL_AVAILABLE = False  # 무작위 바이트라 줄이기 없이 그대로 (줄일 수 없는 큰 사진 대신)
+    image = bot._encode_image(os.urandom(6 * 1024 * 1024), "image/jpeg")
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    for _ in range(REQUESTS):
+        await bot.get_gemini_reply("hi", image)
+    peak = tracemalloc.get_traced_memory()[1]
+    rss_growth = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024
+    await bot.close_http_session()
+    await runner.cleanup()
+    return (
+        f"{mode}: 요청당 {sizes['generate'] // REQUESTS // 1024} KB, 올린 크기 {sizes['upload'] // 1024} KB "
+        f"(업로드 {bot.gemini_files.uploads}번, 재사용 {bot.gemini_files.reused}번), "
+        f"tracemalloc 최고 {peak / 1e6:.1f} MB, maxrss +{rss_growth:.1f} MB"
+    )
+
+
+def main() -> None:
+    if len(sys.argv) > 1:
+        real_print, builtins.print = builtins.print, lambda *a, **k: None
+        line = asyncio.run(run(sys.argv[1]))
+        builtins.print = real_print
+        print(line)
+        return
+    for mode in ("inline", "upload"):
+        subprocess.run([sys.executable, os.path.abspath(__file__), mode], check=True)
+
+
+if __name__ == "__main__":
+    main()
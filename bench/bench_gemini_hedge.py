@@ -0,0 +1,69 @@
+"""[user-012] 헤지 요청 효과: 가짜 전송(모델마다 300ms, 10% 확률로 6초)으로 동시 20개씩 답변을 받아
+get_gemini_reply 전체 지연 p50/p99를 헤지 끔/켬으로 비교.
+    python bench/bench_gemini_hedge.py [묶음 수]   # 기본 40묶음 × 20 = 800개, 헤지 끔 쪽은 몇 분 걸림
+"""
+import asyncio
+import builtins
+import random
+import sys
+
+from _common import load_bot
+
+bot = load_bot()
+SLOW_CHANCE, FAST_SECONDS, SLOW_SECONDS = 0.1, 0.3, 6.0
+
+
+class FakeResponse:
+    status = 200
+    headers: dict = {}
+
+    async def json(self, **kwargs):
+        return {"candidates": [{"content": {"parts": [{"text": "ok"}]}}]}
+
+
+class FakePost:
+    async def __aenter__(self):
+        await asyncio.sleep(SLOW_SECONDS if random.random() < SLOW_CHANCE else FAST_SECONDS)
+        return FakeResponse()
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    closed = False
+
+    def post(self, url, **kwargs):
+        return FakePost()
+
+
+async def run(hedge: bool, batches: int) -> tuple[float, float]:
+    random.seed(1)
+    bot.GEMINI_HEDGE_ENABLED = hedge
+    bot.gemini_health = bot.GeminiModelHealth()
+    bot.gemini_reply_latencies.clear()
+    for _ in range(batches):
+        await asyncio.gather(*(bot.get_gemini_reply("hi") for _ in range(20)))
+    samples = bot.gemini_reply_latencies
+    return bot.latency_percentile(samples, 0.5), bot.latency_percentile(samples, 0.99)
+
+
+async def main() -> None:
+    batches = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    bot._http_session = FakeSession()
+    bot.GEMINI_API_KEY = "bench"
+    bot.GEMINI_PROMPT_CACHE = False
+    bot.gemini_reply_latencies = type(bot.gemini_reply_latencies)(maxlen=batches * 20)
+    real_print, builtins.print = builtins.print, lambda *a, **k: None  # 요청마다 찍는 로그 끄기
+    try:
+        off = await run(False, batches)
+        on = await run(True, batches)
+    finally:
+        builtins.print = real_print
+    print(f"답변 {batches * 20}개 (동시 20개씩)")
+    print(f"  헤지 끔: p50 {off[0]:.2f} s, p99 {off[1]:.2f} s")
+    print(f"  헤지 켬: p50 {on[0]:.2f} s, p99 {on[1]:.2f} s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
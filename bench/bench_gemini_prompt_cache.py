@@ -0,0 +1,95 @@
+"""[user-019] 고정 시스템 프롬프트 전송량: 예전처럼 사용자 말에 붙여 보내기 / systemInstruction / cachedContents.
+로컬 스텁이 cachedContents 생성과 generateContent를 흉내 내고, 캐시 안 된 프롬프트 길이에 비례해 prefill 시간을 씀.
+"예전" 본문은 user-019 전 get_gemini_reply가 만들던 모양([역할 지시] + 말투 + [사용자 말])을 그대로 만듦.
+    python bench/bench_gemini_prompt_cache.py
+"""
+import asyncio
+import builtins
+import json
+import time
+
+from aiohttp import web
+
+from _common import load_bot
+
+bot = load_bot()
+REQUESTS = 60
+QUESTIONS = ("집중 안 될 때 어떻게 해?", "수학 공부법 추천", "영단어 외우는 팁")
+
+
+async def main() -> list[str]:
+    stats = {"bytes": 0, "requests": 0, "prompt_bytes": 0}
+    caches: dict[str, dict] = {}
+
+    async def create_cache(request):
+        body = await request.json()
+        name = f"cachedContents/{len(caches)}"
+        caches[name] = body["systemInstruction"]
+        return web.json_response({"name": name})
+
+    async def generate(request):
+        raw = await request.read()
+        body = json.loads(raw)
+        stats["bytes"] += len(raw)
+        stats["requests"] += 1
+        # 캐시 안 된 입력 = 캐시된 프롬프트를 뺀 나머지 텍스트 전부
+        uncached = sum(len(p.get("text", "").encode()) for c in body["contents"] for p in c["parts"])
+        uncached += sum(len(p["text"].encode()) for p in (body.get("systemInstruction") or {}).get("parts", []))
+        stats["prompt_bytes"] += uncached
+        await asyncio.sleep(0.0002 * uncached / 100)
+        return web.json_response({"candidates": [{"content": {"parts": [{"text": "ok"}]}}]})
+
+    app = web.Application()
+    app.router.add_post("/v1beta/cachedContents", create_cache)
+    app.router.add_post("/v1beta/models/{model}:generateContent", generate)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    bot.GEMINI_API_BASE = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/v1beta"
+    bot.GEMINI_API_KEY, bot.GEMINI_STREAMING = "bench", False
+    bot.GEMINI_USE_ONLY_15_FLASH, bot.GEMINI_15_FLASH_MODELS = True, ("m",)
+
+    results = []
+    for mode in ("inline", "system", "cache"):
+        bot.GEMINI_PROMPT_CACHE = mode == "cache"
+        bot.gemini_prompt_cache = bot.GeminiPromptCache()
+        latencies = []
+        if mode == "inline":
+            session = bot.get_http_session()
+            for i in range(REQUESTS):
+                text = (
+                    f"[역할 지시]\n{bot.AI_CHANNEL_SYSTEM_PROMPT}{bot.GEMINI_TONE_INSTRUCTIONS['lv6']}"
+                    f"\n\n[사용자 말]\n{QUESTIONS[i % 3]}"
+                )
+                body = {"contents": [{"parts": [{"text": text}]}], "generationConfig": {"maxOutputTokens": 1500}}
+                started = time.perf_counter()
+                async with session.post(f"{bot.GEMINI_API_BASE}/models/m:generateContent", json=body) as resp:
+                    await resp.json()
+                latencies.append(time.perf_counter() - started)
+        else:
+            await bot.get_gemini_reply("warmup", study_level=10)  # 캐시 만들기 (백그라운드)
+            await asyncio.sleep(0.05)
+            bot.gemini_reply_latencies.clear()
+            for key in stats:
+                stats[key] = 0
+            for i in range(REQUESTS):
+                await bot.get_gemini_reply(QUESTIONS[i % 3], study_level=10)
+            latencies = list(bot.gemini_reply_latencies)
+        latencies.sort()
+        results.append(
+            f"{mode:>6}: 요청당 {stats['bytes'] / stats['requests']:.0f} B, 캐시 안 된 프롬프트 "
+            f"{stats['prompt_bytes'] / stats['requests']:.0f} B, p50 {latencies[len(latencies) // 2] * 1000:.2f} ms"
+        )
+        for key in stats:
+            stats[key] = 0
+    await bot.close_http_session()
+    await runner.cleanup()
+    return results
+
+
+if __name__ == "__main__":
+    real_print, builtins.print = builtins.print, lambda *a, **k: None
+    lines = asyncio.run(main())
+    builtins.print = real_print
+    print("\n".join(lines))
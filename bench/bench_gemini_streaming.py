@@ -0,0 +1,103 @@
+"""[user-015] 스트리밍 답변: 처음 글자가 보이기까지 시간과 전체 시간, 2000자 넘는 답의 메시지 나눔.
+로컬 aiohttp 스텁이 generateContent(다 만든 뒤 한 번에)와 streamGenerateContent(SSE, 조각마다)를 흉내 냄.
+디스코드 채널은 가짜 객체 (보낸·수정한 내용만 기록).
+    python bench/bench_gemini_streaming.py
+"""
+import asyncio
+import builtins
+import json
+import time
+
+from aiohttp import web
+
+from _common import load_bot
+
+bot = load_bot()
+CHUNK_CHARS = 40
+CHUNK_GAP_SECONDS = 0.1
+
+
+def _payload(text: str) -> dict:
+    return {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+
+
+class FakeMessage:
+    def __init__(self, channel, content: str) -> None:
+        self.channel, self.content = channel, content
+
+    async def edit(self, content: str) -> None:
+        self.content = content
+
+    async def delete(self) -> None:
+        self.channel.sent.remove(self)
+
+
+class FakeChannel:
+    def __init__(self) -> None:
+        self.sent: list[FakeMessage] = []
+
+    async def send(self, content: str) -> FakeMessage:
+        self.sent.append(FakeMessage(self, content))
+        return self.sent[-1]
+
+
+async def run_case(chunks: int, lines: list[str]) -> None:
+    async def whole(request):
+        await asyncio.sleep(chunks * CHUNK_GAP_SECONDS)
+        return web.json_response(_payload("가" * CHUNK_CHARS * chunks))
+
+    async def stream(request):
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        for _ in range(chunks):
+            await asyncio.sleep(CHUNK_GAP_SECONDS)
+            await resp.write(("data: " + json.dumps(_payload("가" * CHUNK_CHARS)) + "\r\n\r\n").encode())
+        await resp.write_eof()
+        return resp
+
+    app = web.Application()
+    app.router.add_post("/v1beta/models/{model}:generateContent", whole)
+    app.router.add_post("/v1beta/models/{model}:streamGenerateContent", stream)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    bot.GEMINI_API_BASE = f"http://127.0.0.1:{port}/v1beta"
+    for streaming in (False, True):
+        bot.GEMINI_STREAMING = streaming
+        bot.gemini_health = bot.GeminiModelHealth()
+        channel = FakeChannel()
+        reply = bot.StreamingReply(channel)
+        started = time.monotonic()
+        text, _ = await bot.get_gemini_reply("hi", on_text=reply.update)
+        if reply.messages:
+            await reply.finish(text)
+        else:
+            for chunk in bot.split_notice_lines(text.split("\n")):
+                await channel.send(chunk)
+        first = (reply.first_visible_at or time.monotonic()) - started
+        total = time.monotonic() - started
+        lines.append(
+            f"  {len(text)}자 {'스트리밍' if streaming else '한 번에'}: 처음 보임 {first * 1000:5.0f} ms, "
+            f"전체 {total * 1000:5.0f} ms, 메시지 {[len(m.content) for m in channel.sent]}"
+        )
+    await runner.cleanup()
+
+
+async def main() -> None:
+    bot.GEMINI_API_KEY = "bench"
+    bot.GEMINI_PROMPT_CACHE = False
+    lines: list[str] = []
+    real_print, builtins.print = builtins.print, lambda *a, **k: None
+    try:
+        await run_case(30, lines)   # 1200자, 30조각, 3초
+        await run_case(60, lines)   # 2400자 → 2000 + 400
+    finally:
+        builtins.print = real_print
+        await bot.close_http_session()
+    print("\n".join(lines))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""[user-010] 요청마다 새 ClientSession vs get_http_session() 공유 세션: 로컬 HTTPS 스텁에 순서대로 POST.
+자체 서명 인증서는 openssl로 임시 폴더에 만듦 (openssl 필요).
+    python bench/bench_http_session.py [요청 수]
+"""
+import asyncio
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+from _common import load_bot
+
+
+def self_signed_context() -> ssl.SSLContext:
+    directory = tempfile.mkdtemp(prefix="bench-tls-")
+    cert, key = os.path.join(directory, "c.pem"), os.path.join(directory, "k.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-keyout", key, "-out", cert],
+        check=True, capture_output=True,
+    )
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+async def main() -> None:
+    bot = load_bot()
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    async def handler(request):
+        return web.json_response({"candidates": [{"content": {"parts": [{"text": "hi"}]}}]})
+
+    app = web.Application()
+    app.router.add_post("/x", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0, ssl_context=self_signed_context())
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"https://localhost:{port}/x"
+
+    async def fresh():
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url, json={}, ssl=False) as resp:
+                await resp.json()
+
+    async def pooled():
+        async with bot.get_http_session().post(url, json={}, ssl=False) as resp:
+            await resp.json()
+
+    for name, call in (("요청마다 새 세션", fresh), ("공유 세션", pooled)):
+        samples = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            await call()
+            samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        print(f"{name}: p50 {samples[requests // 2]:.2f} ms, p95 {samples[int(requests * 0.95)]:.2f} ms")
+    await bot.close_http_session()
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
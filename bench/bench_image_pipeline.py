@@ -0,0 +1,75 @@
+"""[user-016] AI 채널 이미지 처리 중 이벤트 루프 지연: 예전 방식(한 번에 read + 루프에서 base64)과
+prepare_image(조금씩 받기 + 스레드 풀에서 줄이기·인코딩)를 12MP JPEG 4장 동시로 비교. Pillow 필요.
+예전 방식은 user-016 전 get_gemini_reply의 처리(resp.read() → base64.b64encode)를 그대로 흉내 냄.
+    python bench/bench_image_pipeline.py
+"""
+import asyncio
+import base64
+import io
+import os
+import time
+
+from aiohttp import web
+from PIL import Image
+
+from _common import load_bot
+
+bot = load_bot()
+WIDTH, HEIGHT = 4000, 3000
+
+
+class FakeAttachment:
+    def __init__(self, url: str, size: int) -> None:
+        self.url, self.proxy_url = url, None
+        self.width, self.height, self.size = WIDTH, HEIGHT, size
+        self.content_type = "image/jpeg"
+
+
+async def main() -> None:
+    # 잡음 사진이라 JPEG으로도 잘 안 줄어듦 (폰 사진 크기 비슷하게)
+    photo = io.BytesIO()
+    Image.frombytes("RGB", (WIDTH, HEIGHT), os.urandom(WIDTH * HEIGHT * 3)).save(photo, "JPEG", quality=92)
+    raw = photo.getvalue()
+
+    async def handler(request):
+        return web.Response(body=raw, content_type="image/jpeg")
+
+    app = web.Application()
+    app.router.add_get("/img", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/img"
+    bot.IMAGE_MAX_DOWNLOAD_BYTES = 64 * 1024 * 1024
+    bot.LOOP_LAG_INTERVAL_SECONDS = 0.005
+
+    async def old_way():
+        async with bot.get_http_session().get(url) as resp:
+            data = await resp.read()
+        return base64.b64encode(data).decode()
+
+    async def new_way():
+        return await bot.prepare_image(FakeAttachment(url, len(raw)))
+
+    for name, call in (("예전 (read + 루프에서 base64)", old_way), ("지금 (조금씩 받기 + 스레드 풀)", new_way)):
+        bot.loop_lag_samples.clear()
+        monitor = asyncio.create_task(bot.monitor_loop_lag())
+        started = time.perf_counter()
+        results = await asyncio.gather(*(call() for _ in range(4)))
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(0.05)
+        monitor.cancel()
+        lags = sorted(bot.loop_lag_samples)
+        first = results[0]
+        size_kb = (len(first) if isinstance(first, str) else len(first.b64 or first.data)) // 1024
+        print(
+            f"{name}: 4 × {len(raw) // 1024} KB, {elapsed * 1000:.0f} ms, 루프 지연 p99 "
+            f"{lags[int(len(lags) * 0.99)] * 1000:.1f} ms / 최대 {lags[-1] * 1000:.1f} ms, 보낼 크기 {size_kb} KB/장"
+        )
+    await bot.close_http_session()
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+"""[user-025] 재시작 후 음성 상태 맞추기: 가짜 서버(음성 채널·멤버)와 저장된 진행 중 공부 세션 2000개로 reconcile_voice_sessions 시간 재기.
+예전 방식(저장된 세션마다 서버 전체에서 get_member)과 전체 멤버 훑기도 같이 잼.
+    python bench/bench_reconcile.py
+"""
+import random
+import time
+from types import SimpleNamespace as NS
+
+from _common import load_bot
+
+bot = load_bot()
+SIZES = ((5_000, 100_000), (20_000, 200_000))  # (음성 채널에 있는 인원, 서버 멤버 수)
+PERSISTED = 2000
+
+
+def build_guild(in_voice: int, members: int):
+    rng = random.Random(1)
+    study_ids = [c for c in bot.CHANNELS.values() if bot.is_study_channel(c)]
+    channel_ids = study_ids + [bot.CHANNELS["REST"], bot.STUDY_PLEDGE_VOICE_CHANNEL_ID, 111, 222, 333]
+    channels = {c: NS(id=c, members=[]) for c in channel_ids}
+    everyone = [NS(id=10_000 + i, bot=False, voice=None) for i in range(members)]
+    for member in rng.sample(everyone, in_voice):
+        channel = channels[rng.choice(channel_ids)]
+        channel.members.append(member)
+        member.voice = NS(channel=channel)
+    by_id = {m.id: m for m in everyone}
+    guild = NS(id=1, voice_channels=list(channels.values()), get_member=by_id.get)
+    return guild, everyone, study_ids[0]
+
+
+def restore_sessions(everyone, study_channel: int) -> None:
+    """저장된 진행 중 공부 세션 (음성에 남은 사람과 나간 사람이 섞임)"""
+    bot.clear_day_state()
+    for member in random.Random(2).sample(everyone, PERSISTED):
+        state = bot.get_user_state(member.id)
+        state.in_study = True
+        state.current_channel_id = study_channel
+        state.last_join_at = time.time() - 600
+    bot.state_store.saved_at = time.time() - 30
+
+
+def old_lookup() -> None:
+    """user-025 전: 저장된 세션마다 모든 서버에서 get_member (음성에 없는 사람은 서버를 다 훑음)"""
+    for user_id in [u for u, d in bot.user_days.items() if d.in_study]:
+        for guild in bot.bot.guilds:
+            member = guild.get_member(user_id)
+            if member and member.voice and member.voice.channel:
+                break
+
+
+def timed(fn) -> float:
+    started = time.perf_counter()
+    fn()
+    return (time.perf_counter() - started) * 1000
+
+
+def main() -> None:
+    bot.state_store.record_event = lambda *a, **k: None
+    bot.state_store.mark_dirty = lambda *a, **k: None
+    bot.arm_rest_timers = lambda *a: None
+    for in_voice, members in SIZES:
+        guild, everyone, study_channel = build_guild(in_voice, members)
+        type(bot.bot).guilds = property(lambda self: [guild])
+        bot.deadline_scheduler = bot.DeadlineScheduler()
+        print(f"음성 {in_voice}명 / 멤버 {members}명, 저장된 세션 {PERSISTED}개")
+        restore_sessions(everyone, study_channel)
+        print(f"  예전 세션별 get_member: {timed(old_lookup):.1f} ms")
+        print(f"  전체 멤버 훑기: {timed(lambda: {m.id: m.voice.channel.id for m in everyone if m.voice}):.1f} ms")
+        restore_sessions(everyone, study_channel)
+        print(f"  reconcile_voice_sessions: {timed(bot.reconcile_voice_sessions):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
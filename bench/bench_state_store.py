@@ -0,0 +1,63 @@
+"""[user-004] write-behind 상태 저장 비용: 이벤트마다 드는 비용, 기록 주기마다 이벤트 루프에서 모으는 비용,
+워커 스레드에서 쓰는 비용(fsync 포함). 임시 폴더에 기록함.
+    python bench/bench_state_store.py            # 지금 트리
+    python bench/bench_state_store.py 405de00    # 그 커밋의 bot.py (SQLite만 쓰던 때)
+"""
+import os
+import sys
+import tempfile
+import time
+import timeit
+
+from _common import load_bot, load_revision
+
+CALLS = 1_000_000
+
+
+def main() -> None:
+    b = load_revision(sys.argv[1], "bot_rev") if len(sys.argv) > 1 else load_bot()
+    directory = tempfile.mkdtemp(prefix="bench-state-")
+    db = os.path.join(directory, "state.sqlite3")
+    takes_log_dir = "log_dir" in b.StateStore.__init__.__code__.co_varnames
+    store = b.StateStore(db, os.path.join(directory, "log")) if takes_log_dir else b.StateStore(db)
+    collect = getattr(store, "_collect", None) or store._collect_log
+    write = getattr(store, "_write", None) or store._write_log
+
+    t = timeit.timeit("mark(12345)", globals={"mark": store.mark_dirty}, number=CALLS)
+    print(f"mark_dirty: {t / CALLS * 1e9:.0f} ns/call")
+    if hasattr(store, "record_event"):
+        t = timeit.timeit("record('join', 12345, to=1)", globals={"record": store.record_event}, number=CALLS)
+        print(f"record_event: {t / CALLS * 1e9:.0f} ns/call")
+        store._pending_events.clear()
+    store._dirty.clear()
+
+    for users in (100, 1_000, 10_000):
+        for uid in range(users):
+            state = b.get_user_state(uid)
+            if isinstance(state, dict):
+                state.update(total_study_sec=1234.5, in_study=True, last_join_at=time.time())
+            else:
+                state.total_study_sec, state.in_study, state.last_join_at = 1234.5, True, time.time()
+            store.mark_dirty(uid)
+        t0 = time.perf_counter()
+        batch = collect()
+        t1 = time.perf_counter()
+        write(batch)
+        t2 = time.perf_counter()
+        print(f"바뀐 유저 {users:>6}명: 루프에서 모으기 {(t1 - t0) * 1000:7.2f} ms, 워커 스레드에서 쓰기 {(t2 - t1) * 1000:7.2f} ms")
+
+    if takes_log_dir:
+        # 바뀐 게 없는 주기: beat 레코드만 (saved_at 전진용)
+        t0 = time.perf_counter()
+        batch = collect()
+        t1 = time.perf_counter()
+        write(batch)
+        t2 = time.perf_counter()
+        print(f"바뀐 것 없음(beat): 루프에서 {(t1 - t0) * 1e6:.0f} us, 워커 스레드에서 {(t2 - t1) * 1000:.2f} ms")
+    store._executor.shutdown(wait=True)
+    if takes_log_dir:
+        store.log.close()
+
+
+if __name__ == "__main__":
+    main()
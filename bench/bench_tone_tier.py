@@ -0,0 +1,49 @@
+"""[user-021] 말투 단계 조회: 매번 정규식 + if 줄(예전 get_tone_tier) vs 닉네임별 캐시.
+    python bench/bench_tone_tier.py
+"""
+import re
+import time
+from types import SimpleNamespace as NS
+
+from _common import load_bot
+
+bot = load_bot()
+LOOKUPS = 200_000
+
+
+def uncached_tier(member, guild) -> str:
+    """user-021 전 get_tone_tier와 같은 일 (정규식 파싱 + 레벨 구간 비교)"""
+    if guild and member.id == guild.owner_id:
+        return "loyal"
+    name = (member.display_name or member.name or "").strip()
+    m = re.search(r"공부\s*레벨\s*(\d+)", name, re.IGNORECASE)
+    level = int(m.group(1)) if m else 0
+    for floor, tier in bot._TONE_TIER_FLOORS:
+        if level >= floor:
+            return tier
+    return "snarky"
+
+
+def main() -> None:
+    guild = NS(id=1, owner_id=999)
+    members = [NS(id=i, guild=guild, display_name=f"유저{i} [공부레벨 {i % 100}]", name="x") for i in range(500)]
+    assert all(uncached_tier(m, guild) == bot.get_tone_tier(m, guild) for m in members)
+    # 위 검증으로 채워진 캐시를 비워야 첫 바퀴 500번이 미스로 잡힘
+    bot._tone_tier_cache.clear()
+    bot.tone_tier_cache_stats.update(hits=0, misses=0)
+    timings = {}
+    for name, lookup in (("정규식 + 구간", uncached_tier), ("캐시", bot.get_tone_tier)):
+        started = time.perf_counter()
+        for i in range(LOOKUPS):
+            lookup(members[i % 500], guild)
+        timings[name] = (time.perf_counter() - started) / LOOKUPS * 1e6
+    stats = bot.tone_tier_cache_stats
+    hit_rate = stats["hits"] / max(1, stats["hits"] + stats["misses"]) * 100
+    print(f"닉네임 500개를 돌아가며 {LOOKUPS}번 조회")
+    for name, us in timings.items():
+        print(f"  {name}: {us:.2f} us/조회")
+    print(f"  캐시 적중률 {hit_rate:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""[user-006] 유저별 하루 상태 메모리: 예전 병렬 dict/set 구조(c47d98e 직전) vs __slots__ UserDay (지금 트리).
+모든 필드를 채운 유저 N명을 만들고 tracemalloc으로 잰 증가량.
+    python bench/bench_user_day_memory.py [유저 수]
+"""
+import sys
+import time
+import tracemalloc
+
+from _common import load_bot, load_revision
+
+
+def fill_old(b, users: int) -> None:
+    now = time.time()
+    for uid in range(users):
+        state = b.get_user_state(uid)
+        state.update(in_study=True, current_channel_id=1466068226315387137, last_join_at=now,
+                     total_study_sec=1234.5, session_study_sec=12.5, session_start_total_sec=100.5)
+        b.rest_entered_at[uid] = now
+        b.completed_quota_today.add(uid)
+        b.message_count_today[uid] = 3
+        b.ai_usage_count_today[uid] = 2
+        b.ai_charged_hour_announced[uid] = 1
+        b.rest_visit_count_today[uid] = 4
+        b.rest_total_seconds_today[uid] = 321
+        b.pledge_target_minutes[uid] = 120
+        b.pledge_completed_minutes[uid] = 30.5
+        b.pledge_room_entered_at[uid] = now
+
+
+def fill_new(b, users: int) -> None:
+    now = time.time()
+    for uid in range(users):
+        state = b.get_user_state(uid)
+        state.in_study, state.current_channel_id, state.last_join_at = True, 1466068226315387137, now
+        state.total_study_sec, state.session_study_sec, state.session_start_total_sec = 1234.5, 12.5, 100.5
+        state.rest_entered_at, state.quota_done, state.message_count, state.ai_used = now, True, 3, 2
+        state.ai_hour_announced, state.rest_visits, state.rest_total_sec = 1, 4, 321
+        state.pledge_target_min, state.pledge_done_min, state.pledge_entered_at = 120, 30.5, now
+
+
+def measure(fill, b, users: int) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    fill(b, users)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / 1e6
+
+
+def main() -> None:
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    old = load_revision("c47d98e~1", "bot_parallel_dicts")
+    new = load_bot()
+    print(f"유저 {users}명, 모든 필드 채움")
+    print(f"  병렬 dict/set (c47d98e~1): {measure(fill_old, old, users):6.1f} MB")
+    print(f"  UserDay __slots__ (지금):  {measure(fill_new, new, users):6.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""[user-023] 유저별 락: 3000명 × 입장/이동/퇴장 6개 이벤트를 섞어서 gather로 동시에 처리.
+핸들러 중간에 0~200ms await를 끼운 경우(앞으로 디스코드 호출이 들어갈 자리)도 같이 재서, 락 없이 순서가 꼬이는 유저 수를 셈.
+    python bench/bench_user_locks.py
+"""
+import asyncio
+import contextlib
+import random
+import time
+from types import SimpleNamespace as NS
+
+from _common import load_bot
+
+bot = load_bot()
+USERS = 3000
+
+
+@contextlib.asynccontextmanager
+async def no_lock(user_id):
+    yield
+
+
+def silence() -> None:
+    """디스코드 호출·저장은 빼고 상태 변경만 돌게"""
+    for name in ("send_notice", "queue_mute", "queue_move", "queue_role"):
+        setattr(bot, name, lambda *a, **k: None)
+    bot.state_store.record_event = lambda *a, **k: None
+    bot.state_store.mark_dirty = lambda *a, **k: None
+
+
+def build_events():
+    guild = NS(id=1, owner_id=0, get_channel=lambda i: None, get_role=lambda i: None)
+    c = bot.CHANNELS
+    path = [c["STUDY_2H"], c["REST"], c["STUDY_3H"], c["FREEDOM"], c["STUDY_2H"], None]
+    users = [
+        NS(id=i, bot=False, guild=guild, mention=f"<@{i}>", display_name=f"u{i} [공부레벨 {i % 90}]",
+           name="u", voice=None, roles=[])
+        for i in range(1, USERS + 1)
+    ]
+    per_user = []
+    for member in users:
+        steps, previous = [], None
+        for channel in path:
+            steps.append((member, NS(channel=NS(id=previous) if previous else None), NS(channel=NS(id=channel) if channel else None)))
+            previous = channel
+        per_user.append(steps)
+    # 유저끼리 번갈아 들어오게 (1번 유저 첫 이벤트, 2번 유저 첫 이벤트, ...)
+    return users, [steps[k] for k in range(len(path)) for steps in per_user]
+
+
+async def run(locked: bool, jitter: bool) -> str:
+    bot.clear_day_state()
+    bot.deadline_scheduler._wakeup = asyncio.Event()
+    real_hold, real_impl = bot.user_locks.hold, bot._on_voice_state_update_impl
+    if not locked:
+        bot.user_locks.hold = no_lock
+    if jitter:
+        async def impl(*args):
+            await asyncio.sleep(random.random() * 0.2)
+            await real_impl(*args)
+        bot._on_voice_state_update_impl = impl
+    users, events = build_events()
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(bot.on_voice_state_update(m, b, a) for m, b, a in events))
+        elapsed = time.perf_counter() - started
+    finally:
+        bot.user_locks.hold, bot._on_voice_state_update_impl = real_hold, real_impl
+    stuck = sum(1 for member in users if bot.user_days[member.id].in_study)
+    label = f"{'락' if locked else '락 없음'}{' + await' if jitter else ''}"
+    return f"  {label}: {len(events) / elapsed / 1e3:.1f}k 이벤트/초, 공부 중으로 남은 유저 {stuck}/{USERS}"
+
+
+def main() -> None:
+    silence()
+    random.seed(1)
+    print(f"{USERS}명 × 6 이벤트")
+    for jitter in (False, True):
+        for locked in (True, False):
+            print(asyncio.run(run(locked, jitter)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""[user-024] 음성 채널 옮겨 다니기 묶기: 100명이 50~300ms 간격으로 12번씩 이동 + 100명은 한 번 입장.
+user-024 전(이벤트마다 바로 음소거·안내)과 지금(VoiceDebouncer)의 음소거 호출·안내 줄 수, 마지막 음소거 상태를 비교.
+    python bench/bench_voice_debounce.py
+"""
+import asyncio
+import random
+from types import SimpleNamespace as NS
+
+from _common import load_bot
+
+bot = load_bot()
+HOPPERS, JOINERS, HOPS = 100, 100, 12
+calls = {"mute": 0, "notice": 0}
+
+
+def fake_mute(member, mute: bool) -> None:
+    calls["mute"] += 1
+    member.voice.mute = mute
+
+
+def fake_notice(guild, content: str) -> None:
+    calls["notice"] += 1
+
+
+def apply_immediately(member, effects) -> None:
+    """user-024 전: 음성 이벤트마다 음소거·안내를 바로 보냄"""
+    if effects.mute is not None:
+        fake_mute(member, effects.mute)
+    for content in effects.notices:
+        fake_notice(member.guild, content)
+
+
+async def hopper(member, rooms) -> None:
+    previous = None
+    for channel in rooms:
+        before = NS(channel=NS(id=previous) if previous else None)
+        member.voice = NS(channel=NS(id=channel), mute=member.voice.mute if member.voice else False)
+        await bot.on_voice_state_update(member, before, NS(channel=NS(id=channel)))
+        previous = channel
+        await asyncio.sleep(random.uniform(0.05, 0.3))
+
+
+async def run(debounced: bool) -> str:
+    calls.update(mute=0, notice=0)
+    random.seed(1)
+    bot.clear_day_state()
+    bot.deadline_scheduler = bot.DeadlineScheduler()
+    bot.voice_debouncer = bot.VoiceDebouncer()
+    if not debounced:
+        bot.voice_debouncer.submit = apply_immediately
+    bot.deadline_scheduler.start()
+    c = bot.CHANNELS
+    rooms = [c["STUDY_2H"], c["REST"], c["FREEDOM"], c["STUDY_3H"], c["STUDY_1H"]]
+    members = {}
+    guild = NS(id=1, owner_id=0, get_channel=lambda i: None, get_role=lambda i: None, get_member=members.get)
+    tasks = []
+    for i in range(1, HOPPERS + JOINERS + 1):
+        member = NS(id=i, bot=False, guild=guild, mention=f"<@{i}>", display_name=f"u{i}", name="u", voice=None, roles=[])
+        members[i] = member
+        path = [random.choice(rooms) for _ in range(HOPS)] if i <= HOPPERS else [c["STUDY_2H"]]
+        tasks.append(hopper(member, path))
+    await asyncio.gather(*tasks)
+    await asyncio.sleep(bot.VOICE_DEBOUNCE_MAX_SECONDS + 0.5)
+    # 휴식방만 음소거 해제, 나머지 방은 음소거가 맞는 상태
+    correct = sum(1 for m in members.values() if m.voice.mute == (m.voice.channel.id != c["REST"]))
+    label = "묶음(지금)" if debounced else "바로 적용(user-024 전)"
+    return f"  {label}: 음소거 {calls['mute']}번, 안내 {calls['notice']}줄, 마지막 음소거 맞음 {correct}/{len(members)}"
+
+
+def main() -> None:
+    bot.queue_mute = fake_mute
+    bot.send_notice = fake_notice
+    bot.queue_move = lambda *a, **k: None
+    bot.queue_role = lambda *a, **k: None
+    bot.state_store.record_event = lambda *a, **k: None
+    bot.state_store.mark_dirty = lambda *a, **k: None
+    print(f"{HOPPERS}명 × {HOPS}번 이동 + {JOINERS}명 한 번 입장")
+    for debounced in (False, True):
+        print(asyncio.run(run(debounced)))
+
+
+if __name__ == "__main__":
+    main()
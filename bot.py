@@ -1,16 +1,27 @@
 import asyncio
+import base64
+import contextlib
+import hashlib
+import heapq
+import io
+import json
 import os
+import sqlite3
 import time
 import random
+import unicodedata
 import datetime
 from datetime import timezone, timedelta
 
 import re
+import string
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 import aiohttp
 from aiohttp import web
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 
 try:
     import google.generativeai as genai
@@ -20,6 +31,14 @@ except Exception as _e:
     GEMINI_AVAILABLE = False
     print(f"[WARN] Gemini 라이브러리 로드 실패: {_e} — pip install google-generativeai 실행 후 봇을 다시 켜 주세요.")
 
+try:
+    from PIL import Image, ImageOps
+    PIL_AVAILABLE = True
+except Exception as _e:
+    Image = ImageOps = None
+    PIL_AVAILABLE = False
+    print(f"[WARN] Pillow 로드 실패: {_e} — AI 채널 이미지는 줄이지 않고 그대로 보냅니다. (pip install Pillow)")
+
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -72,32 +91,79 @@ STUDY_PLEDGE_VOICE_CHANNEL_ID = 1468943967663161418
 # 제미나이 API 키 (Gemini AI 대화용). .env의 GEMINI_API_KEY 사용
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-# 유저별 공부 상태 저장 (메모리)
-# {
-#   user_id: {
-#       "in_study": bool,
-#       "current_channel_id": int | None,
-#       "last_join_at": float | None,  # timestamp (초)
-#       "total_study_sec": float,      # 오늘 누적 (할당량용)
-#       "session_study_sec": float,   # 재방문 시 현재 세션만 (할당량 이미 채운 뒤 다시 공부할 때)
-#       "session_start_total_sec": float,  # 이번 세션 입장 시점의 total_study_sec (퇴장 시 "방금 N분" 계산용)
-#   }
-# }
-study_state = {}
-
-# 체크 주기 (초)
-CHECK_INTERVAL_SECONDS = 30
-
-# 쉼터에 들어온 시각 (user_id -> timestamp)
-rest_entered_at = {}
-# 쉼터 핀잔 이미 보낸 분 (user_id -> {5, 10})
-rest_pinch_sent = {}
-# 오늘 할당량 채운 사람 (해방 입장 허용, 재입장 시 음소거 안 걸림). 다음날 00시 초기화.
-completed_quota_today = set()
+class UserDay:
+    """유저 한 명의 하루 기록 (자정 초기화 대상 전부). 자정에는 user_days를 통째로 새 dict로 바꿔 끼운다."""
+
+    __slots__ = (
+        # 공부방
+        "in_study",                 # 지금 공부방/선언방 세션 진행 중
+        "current_channel_id",       # 세션 진행 중인 공부방
+        "last_join_at",             # 마지막으로 정산한 시각 (timestamp 초)
+        "total_study_sec",          # 오늘 누적 (할당량용)
+        "session_study_sec",        # 재방문 시 현재 세션만 (할당량 이미 채운 뒤 다시 공부할 때)
+        "session_start_total_sec",  # 이번 세션 입장 시점의 total_study_sec (퇴장 시 "방금 N분" 계산용)
+        "quota_done",               # 오늘 할당량 채움 (해방 입장 허용, 재입장 시 음소거 안 걸림)
+        "unlimited_5h_notified",    # 정신과 시간(무제한)방 5시간 "이동 가능" 알림 보냄
+        # 채팅 / AI
+        "message_count",            # 할당량 안 채운 상태에서 오늘 채팅 횟수
+        "ai_used",                  # AI 채널 오늘 사용 횟수. 기회 = 1 + floor(순공시간/3600) - 이 값
+        "ai_hour_announced",        # "1회 충전되었어요" 안내한 마지막 시간 (-1 = 아직 없음)
+        # 쉼터
+        "rest_entered_at",          # 쉼터 들어온 시각 (없으면 None)
+        "rest_visits",              # 오늘 방문 횟수
+        "rest_total_sec",           # 오늘 누적 쉰 시간(초)
+        # 스스로 N시간 공부 선언 (달성 시 초기화)
+        "pledge_target_min",        # 목표 분 (0 = 선언 없음)
+        "pledge_done_min",          # 선언한 시간 중 이미 채운 분 (선언방+다른 공부방 포함, 나갔다 들어와도 유지)
+        "pledge_entered_at",        # 선언 음성방 입장 시각 (없으면 None)
+    )
+
+    def __init__(self) -> None:
+        self.in_study = False
+        self.current_channel_id: int | None = None
+        self.last_join_at: float | None = None
+        self.total_study_sec = 0.0
+        self.session_study_sec = 0.0
+        self.session_start_total_sec = 0.0
+        self.quota_done = False
+        self.unlimited_5h_notified = False
+        self.message_count = 0
+        self.ai_used = 0
+        self.ai_hour_announced = -1
+        self.rest_entered_at: float | None = None
+        self.rest_visits = 0
+        self.rest_total_sec = 0
+        self.pledge_target_min = 0
+        self.pledge_done_min = 0.0
+        self.pledge_entered_at: float | None = None
+
+    def end_study(self) -> None:
+        """공부 세션 종료 표시"""
+        self.in_study = False
+        self.current_channel_id = None
+        self.last_join_at = None
+
+    def clear_pledge(self) -> None:
+        self.pledge_target_min = 0
+        self.pledge_done_min = 0.0
+
+    def to_row(self) -> dict:
+        return {name: getattr(self, name) for name in UserDay.__slots__}
+
+    @classmethod
+    def from_row(cls, row: dict) -> "UserDay":
+        day = cls()
+        for name in UserDay.__slots__:
+            if name in row:
+                setattr(day, name, row[name])
+        return day
+
+
+# 유저별 오늘 기록 (user_id -> UserDay). 다음날 00시 초기화.
+user_days: dict[int, UserDay] = {}
+
 # 마지막으로 00시 초기화한 날 (KST "YYYY-MM-DD")
 last_reset_date = None
-# 할당량 안 채운 사람 오늘 채팅 횟수 (user_id -> int). 다음날 00시 초기화.
-message_count_today = {}
 # 할당량 안 채운 사람 채팅 제한 (이 횟수 초과하면 핀잔 + 역할로 채팅 불가)
 CHAT_LIMIT_FOR_NON_QUOTA = 5
 # 6회 넘긴 사람한테 부여할 역할 ID. 이 역할에 "메시지 보내기" 거부해두면 6회 이후엔 채팅 자체가 안 됨.
@@ -110,62 +176,753 @@ restricted_chat_user_ids = set()
 # !AI횟수추가 명령 사용 가능한 사용자 ID (본인만)
 ADMIN_USER_ID = 764463640811143169
 
-# AI 채널 사용 횟수: 오늘 사용한 횟수 (user_id -> int). 자정 초기화. 기회 = 1 + floor(순공시간/3600) - 이 값
-ai_usage_count_today = {}
-# 1시간 충전 시 "1회 충전되었어요" 안내한 마지막 시간 (user_id -> int). 자정 초기화.
-ai_charged_hour_announced = {}
-# 정신과 시간(무제한)방에서 5시간 됐을 때 "이동 가능하다" 알림 보낸 유저 (자정 초기화)
-unlimited_room_5h_notified_today = set()
-# 쉼터: 오늘 방문 횟수 / 누적 쉬운 시간(초) (자정 초기화)
-rest_visit_count_today = {}
-rest_total_seconds_today = {}
-# 스스로 N시간 공부 선언: 목표 분 / 누적 완료 분 (나갔다 들어와도 유지) / 해당 음성방 입장 시각 (자정·달성 시 초기화)
-pledge_target_minutes: dict[int, int] = {}
-pledge_completed_minutes: dict[int, float] = {}  # 선언한 시간 중 이미 채운 분 (선언방+다른 공부방 포함)
-pledge_room_entered_at: dict[int, float] = {}
-
-
-async def maybe_reset_midnight() -> None:
-    """다음날 00시(KST) 넘기면 모든 시간·쉼터·해방 기록 초기화"""
+# 지금 공부방/선언방에서 세션 진행 중인 유저 (guild_id -> {user_id}). on_voice_state_update가 관리.
+active_study_sessions: dict[int, set[int]] = {}
+
+
+class DeadlineScheduler:
+    """마감 시각 힙 스케줄러. key당 예약 하나만 유지(다시 예약하면 이전 예약은 무효), 마감 시각이 되면 콜백 실행.
+    취소된/교체된 항목은 힙에서 꺼낼 때 버린다(지연 삭제)."""
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[float, int, object]] = []   # (마감 시각, 순번, key)
+        self._entries: dict[object, tuple[float, int, object, tuple]] = {}  # key -> (마감 시각, 순번, 콜백, 인자)
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._running: set[asyncio.Task] = set()
+
+    def schedule(self, key, when: float, callback, *args) -> None:
+        """key의 마감을 when(time.time() 기준)으로 (재)예약. 마감되면 callback(*args) 코루틴 실행."""
+        self._seq += 1
+        self._entries[key] = (when, self._seq, callback, args)
+        heapq.heappush(self._heap, (when, self._seq, key))
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._compact()
+        if self._heap[0][1] == self._seq:
+            # 가장 빠른 마감이 바뀌었으면 대기 중인 루프 깨우기
+            self._wakeup.set()
+
+    def cancel(self, key) -> None:
+        self._entries.pop(key, None)
+
+    def deadline(self, key) -> float | None:
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if not self.is_running():
+            self._task = asyncio.create_task(self._run())
+
+    def _compact(self) -> None:
+        self._heap = [(when, seq, key) for key, (when, seq, _, _) in self._entries.items()]
+        heapq.heapify(self._heap)
+
+    async def _run(self) -> None:
+        heap = self._heap
+        while True:
+            heap = self._heap
+            while heap:
+                when, seq, key = heap[0]
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] == seq:
+                    break
+                heapq.heappop(heap)
+            self._wakeup.clear()
+            if not heap:
+                await self._wakeup.wait()
+                continue
+            delay = heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, key = heapq.heappop(heap)
+            _, _, callback, args = self._entries.pop(key)
+            task = asyncio.create_task(callback(*args))
+            self._running.add(task)
+            task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        self._running.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[WARN] 예약 작업 오류: {task.exception()!r}")
+
+
+# 방 제한·선언 목표·5시간·AI 충전 시각 등 세션별 마감 예약 (30초 폴링 대신 마감 시각에 바로 처리)
+deadline_scheduler = DeadlineScheduler()
+
+
+def mark_study_active(guild_id: int, user_id: int) -> None:
+    """공부 세션 시작 → 활성 세션 인덱스에 등록 + 다음 마감 예약"""
+    active_study_sessions.setdefault(guild_id, set()).add(user_id)
+    schedule_study_deadline(guild_id, user_id)
+
+
+def unmark_study_active(guild_id: int, user_id: int) -> None:
+    """공부 세션 종료 → 활성 세션 인덱스에서 제거 + 마감 예약 취소"""
+    deadline_scheduler.cancel(("study", user_id))
+    users = active_study_sessions.get(guild_id)
+    if users is None:
+        return
+    users.discard(user_id)
+    if not users:
+        del active_study_sessions[guild_id]
+
+
+class UserLocks:
+    """user_id별 asyncio.Lock. 같은 유저의 상태를 바꾸는 처리(음성 이벤트·채팅·마감 타이머)는 들어온 순서대로 하나씩,
+    다른 유저끼리는 그대로 동시에. 잡고 있거나 기다리는 유저만 dict에 남고 다 쓰면 바로 지움.
+    잡은 채로 Gemini 응답 같은 긴 대기를 하지 말 것 (그동안 그 유저의 음성 이벤트가 밀림)."""
+
+    def __init__(self) -> None:
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._refs: dict[int, int] = {}
+        self.acquired = 0
+        self.contended = 0
+        self.wait_max = 0.0
+
+    @contextlib.asynccontextmanager
+    async def hold(self, user_id: int):
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        self._refs[user_id] = self._refs.get(user_id, 0) + 1
+        try:
+            if lock.locked():
+                self.contended += 1
+                started = time.perf_counter()
+                await lock.acquire()
+                self.wait_max = max(self.wait_max, time.perf_counter() - started)
+            else:
+                await lock.acquire()
+            self.acquired += 1
+            try:
+                yield
+            finally:
+                lock.release()
+        finally:
+            refs = self._refs[user_id] - 1
+            if refs:
+                self._refs[user_id] = refs
+            else:
+                del self._refs[user_id]
+                del self._locks[user_id]
+
+    def stats(self) -> dict:
+        return {
+            "held": len(self._locks),
+            "acquired": self.acquired,
+            "contended": self.contended,
+            "wait_max_ms": self.wait_max * 1000,
+        }
+
+
+user_locks = UserLocks()
+
+
+def clear_day_state() -> dict[int, UserDay]:
+    """하루 기록 전부 비우기: 새 dict로 통째로 교체하고 이전 기록을 돌려줌"""
+    global user_days
+    previous = user_days
+    user_days = {}
+    return previous
+
+
+# 자정에 채팅 제한 역할을 한꺼번에 풀 때 동시에 보내는 요청 수
+ROLLOVER_ROLE_CONCURRENCY = 5
+
+
+def kst_today() -> str:
+    """오늘 날짜 (KST "YYYY-MM-DD"). 자정 전환·저장 등에서만 쓰고 이벤트 처리 중에는 부르지 않음."""
+    return datetime.datetime.now(KST).strftime("%Y-%m-%d")
+
+
+def next_kst_midnight(now: float | None = None) -> float:
+    """now(기본 지금) 다음 KST 00시의 timestamp"""
+    current = datetime.datetime.fromtimestamp(time.time() if now is None else now, KST)
+    midnight = (current + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight.timestamp()
+
+
+def schedule_day_rollover() -> None:
+    deadline_scheduler.schedule(("rollover",), next_kst_midnight(), roll_over_day)
+
+
+async def start_day_rollover() -> None:
+    """시작 시 한 번: 저장된 날짜가 어제 이전이면 바로 전환하고, 다음 00시 전환 예약"""
     global last_reset_date
-    today = datetime.datetime.now(KST).strftime("%Y-%m-%d")
-    if last_reset_date is not None and today != last_reset_date:
-        study_state.clear()
-        completed_quota_today.clear()
-        rest_entered_at.clear()
-        rest_pinch_sent.clear()
-        message_count_today.clear()
-        ai_usage_count_today.clear()
-        ai_charged_hour_announced.clear()
-        unlimited_room_5h_notified_today.clear()
-        rest_visit_count_today.clear()
-        rest_total_seconds_today.clear()
-        pledge_target_minutes.clear()
-        pledge_completed_minutes.clear()
-        pledge_room_entered_at.clear()
-        # 채팅 제한 역할 해제
-        if CHAT_RESTRICTED_ROLE_ID is not None:
-            for guild in bot.guilds:
-                role = guild.get_role(CHAT_RESTRICTED_ROLE_ID)
-                if role is None:
-                    continue
-                for uid in list(restricted_chat_user_ids):
-                    member = guild.get_member(uid)
-                    if member and role in member.roles:
-                        try:
-                            await member.remove_roles(role)
-                        except discord.Forbidden:
-                            pass
-        restricted_chat_user_ids.clear()
+    if deadline_scheduler.deadline(("rollover",)) is not None:
+        return
+    if last_reset_date is None:
+        last_reset_date = kst_today()
+        state_store.mark_meta_dirty()
+    elif last_reset_date != kst_today():
+        # 꺼져 있던 동안의 시간은 모름 → 어제 세션은 마지막 저장 시각까지만 정산
+        await roll_over_day(settle_until=state_store.saved_at)
+        return
+    schedule_day_rollover()
+
+
+async def _remove_restricted_roles(user_ids: list[int]) -> tuple[int, int]:
+    """채팅 제한 역할 해제 (세마포어로 동시 요청 수 제한). (해제 성공 수, 실패 수) 반환"""
+    if CHAT_RESTRICTED_ROLE_ID is None or not user_ids:
+        return 0, 0
+    semaphore = asyncio.Semaphore(ROLLOVER_ROLE_CONCURRENCY)
+
+    async def remove(member: discord.Member, role: discord.Role) -> bool:
+        async with semaphore:
+            try:
+                await member.remove_roles(role)
+                return True
+            except discord.HTTPException:
+                return False
+
+    jobs = []
+    for guild in bot.guilds:
+        role = guild.get_role(CHAT_RESTRICTED_ROLE_ID)
+        if role is None:
+            continue
+        for uid in user_ids:
+            member = guild.get_member(uid)
+            if member and role in member.roles:
+                jobs.append(remove(member, role))
+    results = await asyncio.gather(*jobs)
+    removed = sum(results)
+    return removed, len(results) - removed
+
+
+def settle_sessions_until(until: float) -> int:
+    """진행 중인 공부·쉼터 세션을 until 시각까지 정산 (정산은 이벤트·예약 시각에만 하므로 자정 전환 직전에 몰아서).
+    정산한 세션 수 반환"""
+    settled = 0
+    for user_id, state in user_days.items():
+        if state.in_study and state.last_join_at is not None and state.last_join_at < until:
+            update_user_study_time(user_id, until)
+            settled += 1
+        if state.rest_entered_at is not None and state.rest_entered_at < until:
+            state.rest_total_sec += int(until - state.rest_entered_at)
+            state.rest_entered_at = until
+            state_store.mark_dirty(user_id)
+            settled += 1
+    return settled
+
+
+async def roll_over_day(settle_until: float | None = None) -> None:
+    """KST 00시 예약 작업: 어제 세션 정산·저장 → 오늘 상태로 한 번에 교체 → 채팅 제한 역할 동시 해제 → 전환 보고.
+    settle_until: 진행 중 세션을 이 시각까지만 정산 (기본: 어제가 끝난 00시와 지금 중 이른 쪽)"""
+    global last_reset_date
+    today = kst_today()
+    if today == last_reset_date:
+        # 시계 오차로 00시 직전에 깼으면 다시 예약만
+        schedule_day_rollover()
+        return
+    started = time.perf_counter()
+    previous_date = last_reset_date
+    if previous_date is not None:
+        day_end = next_kst_midnight(
+            datetime.datetime.strptime(previous_date, "%Y-%m-%d").replace(hour=12, tzinfo=KST).timestamp()
+        )
+        until = min(day_end, time.time() if settle_until is None else settle_until)
+        settle_sessions_until(until)
+    # 어제 기록은 지우기 전에 어제 날짜로 저장해 둠
+    state_store.checkpoint(snapshot=True)
+    # 여기부터 교체까지 await 없음 → 이벤트 처리 중간에 날짜가 바뀌는 일 없음
+    for users in active_study_sessions.values():
+        for uid in users:
+            deadline_scheduler.cancel(("study", uid))
+    active_study_sessions.clear()
+    ai_conversations.clear()
+    previous = clear_day_state()
+    for uid, day in previous.items():
+        if day.rest_entered_at is not None:
+            cancel_rest_timers(uid)
+    restricted_user_ids = list(restricted_chat_user_ids)
+    restricted_chat_user_ids.clear()
     last_reset_date = today
+    state_store.mark_meta_dirty()
+    schedule_day_rollover()
+    swap_ms = (time.perf_counter() - started) * 1000
+
+    removed, failed = await _remove_restricted_roles(restricted_user_ids)
+    total_ms = (time.perf_counter() - started) * 1000
+
+    studied = [day for day in previous.values() if day.total_study_sec + day.session_study_sec >= 60]
+    study_min = int(sum(day.total_study_sec + day.session_study_sec for day in studied) // 60)
+    quota_count = sum(1 for day in previous.values() if day.quota_done)
+    print(
+        f"[자정 초기화] {previous_date} → {today}: 유저 {len(previous)}명, 교체 {swap_ms:.1f}ms, "
+        f"역할 해제 {removed}명 (실패 {failed}), 전체 {total_ms:.1f}ms"
+    )
+    if previous_date is None:
+        return
+    report = (
+        f"🌙 **{previous_date} 마감** — 공부한 사람 {len(studied)}명, 합계 {format_minutes(study_min)}, "
+        f"할당량 채운 사람 {quota_count}명."
+    )
+    if removed:
+        report += f" 채팅 제한 {removed}명 해제."
+    report += " 오늘 기록은 새로 시작해요."
+    for guild in bot.guilds:
+        send_notice(guild, report)
+
+
+# ======================= 상태 저장 (이벤트 로그 + SQLite 스냅샷) ==========================
+# 재배포·크래시 후에도 오늘 기록이 남도록 저장.
+# - 이벤트 로그: 입장/퇴장/이동/선언/할당량 원본 이벤트 + 바뀐 유저 상태를 세그먼트 파일(JSON lines)에 append만 함
+# - 스냅샷: 주기적으로 유저별 하루 상태를 SQLite(WAL)에 한 번에 기록 (+ 어디까지의 로그가 반영됐는지 seq)
+# 시작 시 스냅샷을 읽고 그 뒤 로그 꼬리만 재생 → 봇이 오래 떠 있어도 복구 시간은 스냅샷 주기만큼으로 제한됨.
+_DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_DB_PATH = os.getenv("STATE_DB_PATH") or os.path.join(_DATA_DIR, "bot_state.sqlite3")
+EVENT_LOG_DIR = os.getenv("EVENT_LOG_DIR") or os.path.join(_DATA_DIR, "voice_log")
+# 로그에 모아서 기록하는 주기 (초). 크래시 시 최대 이만큼 손실
+STATE_FLUSH_INTERVAL_SECONDS = 2.0
+# SQLite 스냅샷 주기 (초). 재시작 시 재생할 로그 꼬리 길이의 상한
+STATE_SNAPSHOT_INTERVAL_SECONDS = 60.0
+# 로그 세그먼트 하나의 최대 크기 (넘으면 새 파일)
+EVENT_LOG_SEGMENT_BYTES = 4 * 1024 * 1024
+# 이 일수보다 오래된 날짜 기록·로그 세그먼트는 시작 시 삭제 (그 안의 날짜는 !일일재계산 가능)
+STATE_KEEP_DAYS = 14
+
+def _dump_user_day(user_id: int) -> dict | None:
+    """유저 한 명의 오늘 상태를 저장용 dict로. 기록이 없으면 None."""
+    day = user_days.get(user_id)
+    return day.to_row() if day is not None else None
+
+
+def _restore_user_day(user_id: int, row: dict | None) -> None:
+    """_dump_user_day로 저장한 dict로 메모리 상태를 덮어씀 (None이면 기록 삭제)"""
+    if row:
+        user_days[user_id] = UserDay.from_row(row)
+    else:
+        user_days.pop(user_id, None)
+
+
+class SegmentedEventLog:
+    """append 전용 JSON lines 로그. segment-<첫 seq>.jsonl 파일로 나눠 쓰고 크기가 차면 새 세그먼트.
+    파일 접근은 StateStore 워커 스레드에서만 함."""
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self._file = None
+        self._file_size = 0
+
+    def _segments(self) -> list[tuple[int, str]]:
+        """(첫 seq, 경로) 목록, seq 순"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        out = []
+        for name in names:
+            if name.startswith("segment-") and name.endswith(".jsonl"):
+                try:
+                    out.append((int(name[8:-6]), os.path.join(self.directory, name)))
+                except ValueError:
+                    continue
+        return sorted(out)
+
+    def append(self, lines: list[str], first_seq: int) -> None:
+        if not lines:
+            return
+        if self._file is None or self._file_size >= EVENT_LOG_SEGMENT_BYTES:
+            self._open_segment(first_seq)
+        data = "".join(lines).encode("utf-8")
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file_size += len(data)
+
+    def _open_segment(self, first_seq: int) -> None:
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(self.directory, exist_ok=True)
+        segments = self._segments()
+        # 재시작 직후엔 마지막 세그먼트에 이어 씀 (크래시로 잘린 줄이 있으면 줄바꿈으로 끊어 둠)
+        if self._file is None and segments and os.path.getsize(segments[-1][1]) < EVENT_LOG_SEGMENT_BYTES:
+            path = segments[-1][1]
+            with open(path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                needs_newline = False
+                if size > 0:
+                    f.seek(size - 1)
+                    needs_newline = f.read(1) != b"\n"
+            self._file = open(path, "ab")
+            if needs_newline:
+                self._file.write(b"\n")
+            self._file_size = self._file.tell()
+            return
+        path = os.path.join(self.directory, f"segment-{first_seq:012d}.jsonl")
+        self._file = open(path, "ab")
+        self._file_size = self._file.tell()
+
+    def read(self, after_seq: int = 0):
+        """seq > after_seq 인 레코드를 순서대로 (깨진 줄은 건너뜀)"""
+        segments = self._segments()
+        for i, (first_seq, path) in enumerate(segments):
+            # 다음 세그먼트가 after_seq 이하에서 시작하면 이 세그먼트는 전부 이미 반영된 것
+            if i + 1 < len(segments) and segments[i + 1][0] <= after_seq + 1:
+                continue
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get("seq", 0) > after_seq:
+                        yield record
+
+    def prune(self, covered_seq: int, older_than: float) -> int:
+        """스냅샷에 이미 반영됐고(covered_seq 이하) older_than보다 오래된 세그먼트 삭제"""
+        segments = self._segments()
+        removed = 0
+        for i, (_, path) in enumerate(segments[:-1]):
+            if segments[i + 1][0] <= covered_seq + 1 and os.path.getmtime(path) < older_than:
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class StateStore:
+    """오늘 상태를 이벤트 로그 + SQLite 스냅샷으로 write-behind 저장.
+    이벤트 처리 중에는 record_event / mark_dirty로 메모리에만 표시하고, 실제 기록은 주기적으로 모아서
+    전용 스레드 하나에서 처리 → 이벤트 루프는 디스크 fsync를 기다리지 않음.
+    바뀐 게 없어도 기록 주기마다 "beat" 레코드를 남겨 saved_at을 앞으로 옮김 (조용히 공부 중인 세션은 이벤트가 없어서,
+    이게 없으면 재시작 때 마지막 스냅샷 이후 시간을 잃음) → 꺼져도 잃는 시간은 STATE_FLUSH_INTERVAL_SECONDS 정도."""
+
+    def __init__(self, path: str, log_dir: str) -> None:
+        self.path = path
+        self.log = SegmentedEventLog(log_dir)
+        self._dirty: set[int] = set()           # 다음 로그 기록 때 상태 레코드를 남길 유저
+        self._snapshot_dirty: set[int] = set()  # 다음 스냅샷에 반영할 유저
+        self._meta_dirty = False
+        self._pending_events: list[dict] = []
+        self._seq = 0
+        self._last_snapshot = time.time()
+        self._conn: sqlite3.Connection | None = None
+        # 쓰기 순서 보장 + sqlite 연결·로그 파일을 한 스레드에서만 쓰도록 워커 1개
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-store")
+        self._task: asyncio.Task | None = None
+        self.saved_at: float | None = None  # 마지막으로 기록한 시각 (시작 시엔 이전 프로세스가 마지막으로 기록한 시각)
+        self.replayed = 0
+        self.log_records_written = 0
+        self.rows_written = 0
+        self.snapshots = 0
+        self.last_flush_ms = 0.0
+
+    def mark_dirty(self, user_id: int) -> None:
+        self._dirty.add(user_id)
+
+    def mark_meta_dirty(self) -> None:
+        self._meta_dirty = True
+
+    def record_event(self, kind: str, user_id: int, ts: float | None = None, **fields) -> None:
+        """원본 이벤트(join/leave/move/pledge/quota) 로그에 추가 (다음 기록 때 파일로)"""
+        self._seq += 1
+        event = {"seq": self._seq, "ts": ts or time.time(), "type": kind, "uid": user_id}
+        event.update(fields)
+        self._pending_events.append(event)
+        self._dirty.add(user_id)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS user_day ("
+                "day TEXT NOT NULL, user_id INTEGER NOT NULL, data TEXT NOT NULL, "
+                "PRIMARY KEY (day, user_id)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    # ---- 읽기 (시작 시 한 번) ----
+    def _read(self) -> tuple[dict, list[tuple[int, str]], list[dict]]:
+        conn = self._connect()
+        meta = {k: json.loads(v) for k, v in conn.execute("SELECT key, value FROM meta")}
+        rows = []
+        if meta.get("day"):
+            rows = conn.execute("SELECT user_id, data FROM user_day WHERE day = ?", (meta["day"],)).fetchall()
+        tail = list(self.log.read(meta.get("log_seq", 0)))
+        cutoff = datetime.datetime.now(KST) - timedelta(days=STATE_KEEP_DAYS)
+        with conn:
+            conn.execute("DELETE FROM user_day WHERE day < ?", (cutoff.strftime("%Y-%m-%d"),))
+        self.log.prune(meta.get("log_seq", 0), cutoff.timestamp())
+        return meta, rows, tail
+
+    async def load(self) -> int:
+        """스냅샷 + 로그 꼬리 재생으로 마지막 상태 복원. 날짜가 바뀌었으면 on_ready의 start_day_rollover에서 평소처럼 초기화."""
+        global last_reset_date
+        loop = asyncio.get_running_loop()
+        try:
+            meta, rows, tail = await loop.run_in_executor(self._executor, self._read)
+        except (sqlite3.Error, OSError) as e:
+            print(f"[WARN] 상태 DB 불러오기 실패: {e}")
+            return 0
+        for user_id, data in rows:
+            _restore_user_day(user_id, json.loads(data))
+        restricted_chat_user_ids.update(meta.get("restricted_chat_user_ids") or [])
+        day = meta.get("day")
+        self.saved_at = meta.get("saved_at")
+        self._seq = meta.get("log_seq", 0)
+        for record in tail:
+            self._seq = max(self._seq, record["seq"])
+            kind = record["type"]
+            if kind == "meta":
+                if day is not None and record["day"] != day:
+                    clear_day_state()
+                day = record["day"]
+                restricted_chat_user_ids.clear()
+                restricted_chat_user_ids.update(record["restricted_chat_user_ids"])
+                self.saved_at = record["ts"]
+            elif kind == "state":
+                if record["day"] == day:
+                    _restore_user_day(record["uid"], record["row"])
+                    self._snapshot_dirty.add(record["uid"])
+                self.saved_at = record["ts"]
+            elif kind == "beat":
+                self.saved_at = record["ts"]
+        if day:
+            last_reset_date = day
+        self.replayed = len(tail)
+        return len(rows)
+
+    # ---- 쓰기 ----
+    def _collect_log(self) -> tuple[list[str], int] | None:
+        """바뀐 유저 상태를 지금 시점 값으로 떠서 로그 레코드로 만듦 (이벤트 루프에서 실행, 디스크 접근 없음)"""
+        now = time.time()
+        if not self._pending_events and not self._dirty and not self._meta_dirty:
+            self._seq += 1
+            return [json.dumps({"seq": self._seq, "ts": now, "type": "beat"}, separators=(",", ":")) + "\n"], self._seq
+        day = last_reset_date or kst_today()
+        records = self._pending_events
+        self._pending_events = []
+        if self._meta_dirty:
+            self._seq += 1
+            records.append({
+                "seq": self._seq, "ts": now, "type": "meta", "day": day,
+                "restricted_chat_user_ids": sorted(restricted_chat_user_ids),
+            })
+            self._meta_dirty = False
+        for user_id in self._dirty:
+            self._seq += 1
+            records.append({
+                "seq": self._seq, "ts": now, "type": "state", "day": day,
+                "uid": user_id, "row": _dump_user_day(user_id),
+            })
+        self._snapshot_dirty |= self._dirty
+        self._dirty.clear()
+        for record in records:
+            record.setdefault("day", day)
+        lines = [json.dumps(r, separators=(",", ":"), ensure_ascii=False) + "\n" for r in records]
+        return lines, records[0]["seq"]
+
+    def _collect_snapshot(self) -> tuple:
+        day = last_reset_date or kst_today()
+        upserts, deletes = [], []
+        for user_id in self._snapshot_dirty:
+            row = _dump_user_day(user_id)
+            if row is None:
+                deletes.append((day, user_id))
+            else:
+                upserts.append((day, user_id, json.dumps(row, separators=(",", ":"))))
+        self._snapshot_dirty.clear()
+        self._last_snapshot = time.time()
+        meta = {
+            "day": day,
+            "restricted_chat_user_ids": sorted(restricted_chat_user_ids),
+            "saved_at": self._last_snapshot,
+            "log_seq": self._seq,
+        }
+        return upserts, deletes, meta
+
+    def _write_log(self, batch: tuple[list[str], int]) -> None:
+        lines, first_seq = batch
+        started = time.perf_counter()
+        self.log.append(lines, first_seq)
+        self.saved_at = time.time()
+        self.log_records_written += len(lines)
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+    def _write_snapshot(self, batch: tuple) -> None:
+        upserts, deletes, meta = batch
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO user_day (day, user_id, data) VALUES (?, ?, ?)", upserts)
+            conn.executemany("DELETE FROM user_day WHERE day = ? AND user_id = ?", deletes)
+            conn.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [(k, json.dumps(v)) for k, v in meta.items()],
+            )
+        self.rows_written += len(upserts) + len(deletes)
+        self.snapshots += 1
+
+    def checkpoint(self, snapshot: bool = False) -> None:
+        """지금까지 바뀐 상태를 기록 큐에 넣음. snapshot=True면 SQLite 스냅샷까지 (자정 초기화 직전 등)"""
+        batch = self._collect_log()
+        if batch is not None:
+            self._executor.submit(self._write_log, batch).add_done_callback(self._on_write_done)
+        if snapshot:
+            self._executor.submit(self._write_snapshot, self._collect_snapshot()).add_done_callback(self._on_write_done)
+
+    @staticmethod
+    def _on_write_done(future) -> None:
+        if future.exception() is not None:
+            print(f"[WARN] 상태 기록 실패: {future.exception()!r}")
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(STATE_FLUSH_INTERVAL_SECONDS)
+            self.checkpoint(snapshot=time.time() - self._last_snapshot >= STATE_SNAPSHOT_INTERVAL_SECONDS)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def read_events(self) -> list[dict]:
+        """지금까지 기록된 로그 전체 (관리자 재계산용). 아직 안 쓴 것도 먼저 기록한 뒤 읽음."""
+        self.checkpoint()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: list(self.log.read(0)))
+
+    def close(self) -> None:
+        """종료 시: 남은 변경 기록 + 스냅샷 후 닫기 (블로킹)"""
+        if self._task is not None:
+            self._task.cancel()
+        self.checkpoint(snapshot=True)
+        self._executor.shutdown(wait=True)
+        self.log.close()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+state_store = StateStore(STATE_DB_PATH, EVENT_LOG_DIR)
+
+
+def recompute_day_totals(events: list[dict], day: str) -> dict[int, dict]:
+    """원본 입장/퇴장/이동(+선언) 이벤트만으로 그날(KST 0시~24시) 유저별 공부·쉼터 시간을 다시 계산.
+    버그 수정 후 하루 합계를 디스코드 데이터 없이 다시 뽑을 때 사용. 반환: user_id -> {study_sec, rest_sec, rest_visits}
+    선언방 시간은 실제 처리처럼 선언이 있을 때만 공부로 셈 (선언한 분만큼 채우면 선언 끝).
+    재시작 때 남긴 퇴장처럼 기록 순서와 시각 순서가 어긋난 이벤트는 그 유저의 앞 이벤트보다 이르면 건너뜀."""
+    day_start = datetime.datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=KST).timestamp()
+    day_end = day_start + 24 * 3600
+    current: dict[int, tuple[int, float]] = {}  # user_id -> (채널, 입장 시각)
+    last_ts: dict[int, float] = {}              # user_id -> 마지막으로 반영한 이벤트 시각
+    pledge_left: dict[int, float] = {}          # user_id -> 선언 중 남은 초
+    totals: dict[int, dict] = {}
+
+    def close(user_id: int, ts: float) -> None:
+        channel_id, since = current.pop(user_id, (None, 0.0))
+        if channel_id is None:
+            return
+        counts_study = is_study_channel(channel_id) or (
+            is_pledge_voice_channel(channel_id) and user_id in pledge_left
+        )
+        if counts_study and user_id in pledge_left:
+            # 선언 중엔 공부방·선언방 시간 모두 선언 목표에 들어감
+            pledge_left[user_id] -= max(0.0, ts - since)
+            if pledge_left[user_id] <= 0:
+                del pledge_left[user_id]
+        start, end = max(since, day_start), min(ts, day_end)
+        if end <= start:
+            return
+        t = totals.setdefault(user_id, {"study_sec": 0.0, "rest_sec": 0.0, "rest_visits": 0})
+        if counts_study:
+            t["study_sec"] += end - start
+        elif is_rest_channel(channel_id):
+            t["rest_sec"] += end - start
+
+    for event in events:
+        kind = event["type"]
+        if kind not in ("join", "leave", "move", "pledge"):
+            continue
+        ts = event["ts"]
+        user_id = event["uid"]
+        if ts >= day_end or ts < last_ts.get(user_id, ts):
+            continue
+        last_ts[user_id] = ts
+        if kind == "pledge":
+            channel_id = current.get(user_id, (None, 0.0))[0]
+            if is_pledge_voice_channel(channel_id):
+                # 선언방 안에서 선언 → 그때부터 셈 (그 전 시간은 선언 전이라 안 셈)
+                close(user_id, ts)
+                current[user_id] = (channel_id, ts)
+            pledge_left[user_id] = event["minutes"] * 60.0
+            continue
+        close(user_id, ts)
+        to_channel = event.get("to")
+        if to_channel is not None:
+            current[user_id] = (to_channel, ts)
+            if is_rest_channel(to_channel) and ts >= day_start:
+                totals.setdefault(user_id, {"study_sec": 0.0, "rest_sec": 0.0, "rest_visits": 0})["rest_visits"] += 1
+    end_cap = min(day_end, time.time())
+    for user_id in list(current):
+        close(user_id, end_cap)
+    return totals
 
 
 # ======================= 공부 레벨 파싱 (경험치봇 닉네임 [공부레벨 N] 활용) ==========================
+_STUDY_LEVEL_RE = re.compile(r"공부\s*레벨\s*(\d+)", re.IGNORECASE)
+# 레벨 하한 → 말투 단계 (높은 것부터). 0~5는 snarky(아주 띠겁게·기존)
+_TONE_TIER_FLOORS = (
+    (91, "t91"), (71, "t71_90"), (51, "t51_70"), (41, "t41_50"), (31, "t31_40"),
+    (21, "t21_30"), (16, "t16_20"), (11, "t11_15"), (6, "t6_10"),
+)
+# (서버 id, 유저 id, display_name) -> (공부 레벨, 말투 단계). 닉네임이 바뀌면 on_member_update에서 지움.
+# 음성 이벤트·핀잔·안내마다 부르므로 정규식·if 줄 대신 dict 한 번.
+TONE_TIER_CACHE_MAX_ENTRIES = 20000
+_tone_tier_cache: dict[tuple[int, int, str], tuple[int, str]] = {}
+tone_tier_cache_stats = {"hits": 0, "misses": 0, "invalidated": 0}
+
+
+def _tone_tier_key(member: discord.Member) -> tuple[int, int, str]:
+    guild = getattr(member, "guild", None)
+    return (guild.id if guild else 0, member.id, member.display_name or member.name or "")
+
+
+def _level_and_tier(member: discord.Member) -> tuple[int, str]:
+    key = _tone_tier_key(member)
+    cached = _tone_tier_cache.get(key)
+    if cached is not None:
+        tone_tier_cache_stats["hits"] += 1
+        return cached
+    tone_tier_cache_stats["misses"] += 1
+    m = _STUDY_LEVEL_RE.search(key[2].strip())
+    level = int(m.group(1)) if m else 0
+    tier = next((name for floor, name in _TONE_TIER_FLOORS if level >= floor), "snarky")
+    if len(_tone_tier_cache) >= TONE_TIER_CACHE_MAX_ENTRIES:
+        del _tone_tier_cache[next(iter(_tone_tier_cache))]  # 가장 먼저 들어온 것부터
+    _tone_tier_cache[key] = (level, tier)
+    return level, tier
+
+
+def invalidate_tone_tier(member: discord.Member) -> None:
+    """이 닉네임으로 캐시된 레벨·말투 지우기 (닉네임 바뀌기 전 member로 호출)"""
+    if _tone_tier_cache.pop(_tone_tier_key(member), None) is not None:
+        tone_tier_cache_stats["invalidated"] += 1
+
+
 def parse_study_level(member: discord.Member) -> int:
     """서버별 닉네임(display_name)에서 [공부레벨 N] 또는 공부레벨 N 형태로 숫자 파싱. 없으면 0."""
-    name = (member.display_name or member.name or "").strip()
-    m = re.search(r"공부\s*레벨\s*(\d+)", name, re.IGNORECASE)
-    return int(m.group(1)) if m else 0
+    return _level_and_tier(member)[0]
 
 
 def get_tone_tier(member: discord.Member, guild: discord.Guild | None) -> str:
@@ -173,514 +930,182 @@ def get_tone_tier(member: discord.Member, guild: discord.Guild | None) -> str:
     1~5: snarky(아주 띠겁게·기존), 6~10~15~20~30~40~50~70~90: 점점 친절, 91~: 완전 친절, 서버주: loyal(신처럼 모시기)."""
     if guild and member.id == guild.owner_id:
         return "loyal"
-    level = parse_study_level(member)
-    if level >= 91:
-        return "t91"
-    if level >= 71:
-        return "t71_90"
-    if level >= 51:
-        return "t51_70"
-    if level >= 41:
-        return "t41_50"
-    if level >= 31:
-        return "t31_40"
-    if level >= 21:
-        return "t21_30"
-    if level >= 16:
-        return "t16_20"
-    if level >= 11:
-        return "t11_15"
-    if level >= 6:
-        return "t6_10"
-    # 0~5: 아주 띠겁게 (기존 활용)
-    return "snarky"
+    return _level_and_tier(member)[1]
 
 
 # ---- 레벨 구간별 말투: snarky(1~5) | t6_10~t91(점점 친절) | loyal(서버주 신처럼) ----
+# 멘트는 messages.json에 (멘트 종류 → 말투 단계 → 문장 목록)으로 있음. 말투 키는 "t71_90,t51_70"처럼 묶을 수 있고
+# 목록에 없는 단계(snarky 포함)는 "default". 읽을 때 (종류, 말투)별 목록으로 펼치고 문장은 {자리} 기준으로 미리 쪼개 둠
+# → 부를 때 dict 한 번 + 이어 붙이기 (한글 문장은 %·format 보다 join이 훨씬 빠름).
+# !멘트리로드 로 봇 재시작 없이 다시 읽음 (공부 기록 등 메모리 상태는 그대로).
+MESSAGES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "messages.json")
+TONE_TIERS = ("loyal", "t91", "t71_90", "t51_70", "t41_50", "t31_40", "t21_30", "t16_20", "t11_15", "t6_10", "snarky")
+# 멘트 종류별로 코드가 넘겨주는 값, render_message에 이 순서로 넘김 (파일 문장에 이 밖의 {이름}이 있으면 읽기 실패)
+MESSAGE_KIND_FIELDS = {
+    "prefix": (),
+    "done": ("mention",),
+    "rest_entry": ("mention", "prefix"),
+    "freedom_taunt": ("mention",),
+    "study_entry_finite": ("used", "remain"),
+    "study_entry_zero_extra": (),
+    "study_unlimited_mute": (),
+    "study_3h_plus": ("used",),
+    "rest_pinch_5min": ("mention",),
+    "rest_pinch_10min": ("mention",),
+    "sunong_time": ("mention", "used"),
+    "chat_limit": ("mention",),
+    "unlimited_can_move": ("mention",),
+    "rest_force_move": ("mention",),
+    "study_reentry": ("mention",),
+    "freedom_quota_done": ("mention",),
+    "pledge_other_room": ("mention", "declared", "remaining"),
+    "pledge_no_declaration": ("mention",),
+    "pledge_commit": ("mention", "duration"),
+}
+_template_formatter = string.Formatter()
+
+
+def _compile_template(kind: str, text: str) -> tuple[tuple[str, ...], tuple[int, ...], str]:
+    """"{mention} 해방 가. {used}" → (("", " 해방 가. ", ""), (0, 1), "{0} 해방 가. {1}"):
+    글자 조각(자리 수 + 1개), 자리마다 넘겨받는 값 순번, 자리 3개 이상일 때 쓰는 순번 서식.
+    모르는 {이름}이나 서식 지정이 있으면 ValueError."""
+    names = MESSAGE_KIND_FIELDS[kind]
+    parts = [""]
+    fields = []
+    for literal, field, spec, conversion in _template_formatter.parse(text):
+        parts[-1] += literal
+        if field is None:
+            continue
+        if field not in names or spec or conversion:
+            raise ValueError(f"{kind}: 쓸 수 없는 자리 {{{field}}} — {text[:40]}")
+        fields.append(names.index(field))
+        parts.append("")
+    positional = "".join(
+        part.replace("{", "{{").replace("}", "}}") + (f"{{{index}}}" if i < len(fields) else "")
+        for i, (part, index) in enumerate(zip(parts, fields + [None]))
+    )
+    return tuple(parts), tuple(fields), positional
+
+
+def load_message_catalog(path: str = MESSAGES_PATH) -> dict[tuple[str, str], tuple]:
+    """messages.json 읽어서 (종류, 말투) -> 미리 쪼갠 문장 튜플. 잘못된 파일이면 ValueError/OSError (기존 목록은 안 건드림)."""
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    catalog: dict[tuple[str, str], tuple] = {}
+    for kind in MESSAGE_KIND_FIELDS:
+        by_tone = raw.get(kind)
+        if not isinstance(by_tone, dict) or not by_tone.get("default"):
+            raise ValueError(f"{kind}: 없거나 default 목록이 비어 있음")
+        default = tuple(_compile_template(kind, text) for text in by_tone["default"])
+        for tone in TONE_TIERS:
+            catalog[(kind, tone)] = default
+        for tones, texts in by_tone.items():
+            if tones == "default":
+                continue
+            if not texts:
+                raise ValueError(f"{kind}/{tones}: 목록이 비어 있음")
+            compiled = tuple(_compile_template(kind, text) for text in texts)
+            for tone in tones.split(","):
+                if tone.strip() not in TONE_TIERS:
+                    raise ValueError(f"{kind}: 모르는 말투 {tone.strip()}")
+                catalog[(kind, tone.strip())] = compiled
+    return catalog
+
+
+message_catalog = load_message_catalog()
+
+
+def render_message(kind: str, tone: str, *values: str) -> str:
+    """(종류, 말투) 목록에서 하나 골라 값 채우기. values는 MESSAGE_KIND_FIELDS[kind] 순서. 모르는 말투는 default(snarky)."""
+    templates = message_catalog.get((kind, tone))
+    if templates is None:
+        templates = message_catalog[(kind, "snarky")]
+    parts, fields, positional = random.choice(templates)
+    if not fields:
+        return parts[0]
+    if len(fields) == 1:
+        return values[fields[0]].join(parts)
+    if len(fields) == 2:
+        return parts[0] + values[fields[0]] + parts[1] + values[fields[1]] + parts[2]
+    return positional.format(*values)
+
+
+def reload_message_catalog() -> tuple[int, int]:
+    """messages.json 다시 읽어서 통째로 교체. 반환: (종류 수, 문장 수). 실패하면 예외, 기존 목록 유지."""
+    global message_catalog
+    catalog = load_message_catalog()
+    message_catalog = catalog
+    return len(MESSAGE_KIND_FIELDS), len({id(t) for templates in catalog.values() for t in templates})
+
+
 def snarky_prefix(tone: str = "snarky") -> str:
     """말투 앞부분. snarky=기존 띠꺼움, t6_10~t91=점점 친절, loyal=서버주 신처럼 모시기."""
-    if tone == "loyal":
-        return random.choice([
-            "감사합니다. ", "네, 알겠습니다. ", "죄송하오나, ", "모시는 바, ",
-            "감히 여쭙건대, ", "어찌 감히, ", "허락하시면, ", "은혜에 감사드리며, ",
-        ])
-    if tone == "t91":
-        return random.choice([
-            "네, ", "좋아요. ", "잘 오셨어요. ", "반가워요. ", "응원할게요. ",
-        ])
-    if tone in ("t71_90", "t51_70"):
-        return random.choice([
-            "와, ", "오, ", "잘 오셨어요. ", "좋아요. ", "힘내요. ", "응원해요. ",
-        ])
-    if tone in ("t41_50", "t31_40"):
-        return random.choice([
-            "오, ", "잘 왔어요. ", "좋아요. ", "알겠어요. ", "괜찮아요. ",
-        ])
-    if tone in ("t21_30", "t16_20"):
-        return random.choice([
-            "어, ", "음, ", "잘 왔어. ", "그래. ", "알겠어. ",
-        ])
-    if tone in ("t11_15", "t6_10"):
-        return random.choice([
-            "어, ", "그래. ", "음. ", "알겠어. ", "좀 더 해.",
-        ])
-    return random.choice([
-        "또 왔네요, ", "아직도 버티는 중이네요, ", "이 정도로 해서 되겠어요, ",
-        "에휴 참… ", "공부하는 척은 아주 열심히네요, ", "와 진짜… ",
-        "어이 어이, ", "자네 또 왔군, ", "참나… ", "킹받게 하지 마라, ",
-    ])
+    return render_message("prefix", tone)
 
 
 def snarky_done_message(member_mention: str, tone: str = "snarky") -> str:
     """시간 다 됐을 때 멘트 (해방 이동 시)."""
-    if tone == "loyal":
-        return random.choice([
-            f"{member_mention} 오늘도 수고 많으셨사옵니다. 해방으로 모시어 드리겠나이다.",
-            f"{member_mention} 허락하신 만큼 채우셨사옵니다. 해방으로 안내해 드리겠나이다.",
-            f"{member_mention} 공부 잘 하셨사옵니다. 이제 해방으로 모시겠나이다.",
-            f"{member_mention} 감사하옵니다. 해방으로 모시어 드리겠사옵니다.",
-        ])
-    if tone == "t91":
-        return random.choice([
-            f"{member_mention} 수고 많으셨어요. 이제 해방 가서 편히 쉬세요. 정말 잘 하셨어요.",
-            f"{member_mention} 할당량 다 채우셨네요. 해방으로 가서 푹 쉬어요. 응원할게요.",
-            f"{member_mention} 오늘도 잘 하셨어요. 해방 가세요. 좋은 하루 되세요.",
-        ])
-    if tone in ("t71_90", "t51_70"):
-        return random.choice([
-            f"{member_mention} 수고했어요. 해방 가서 쉬어요. 잘 했어요.",
-            f"{member_mention} 할당량 채웠네. 해방 가. 힘내.",
-            f"{member_mention} 잘 했어. 이제 해방으로 가.",
-        ])
-    if tone in ("t41_50", "t31_40"):
-        return random.choice([
-            f"{member_mention} 다 했어요. 해방 가세요.",
-            f"{member_mention} 할당량 채웠어요. 해방 가서 쉬어요.",
-        ])
-    if tone in ("t21_30", "t16_20"):
-        return random.choice([
-            f"{member_mention} 다 했네. 해방 가.",
-            f"{member_mention} 할당량 채웠어. 해방 가도 돼.",
-        ])
-    if tone in ("t11_15", "t6_10"):
-        return random.choice([
-            f"{member_mention} 다 했어. 해방 가.",
-            f"{member_mention} 할당량 채웠네. 해방 가.",
-        ])
-    return random.choice([
-        f"{member_mention} 그래서 공부 다 하신 거 맞죠? ㅎ 안 끝났으면… 뭐 알아서 하시구요.",
-        f"{member_mention} 할당량 채웠다고? ㅎ 이제 해방 가서 놀아.",
-        f"{member_mention} 공부 다 했다고? 잘했어~ 이제 해방으로 가.",
-        f"{member_mention} 시간 다 됐다. 공부 끝. 해방 가.",
-        f"{member_mention} ㅋ 그래서 진짜 다 한 거 맞지? ㅎ 해방 가.",
-    ])
+    return render_message("done", tone, member_mention)
 
 
 def rest_entry_message(member_mention: str, tone: str = "snarky") -> str:
     """쉼터 입장 시"""
-    if tone == "loyal":
-        return random.choice([
-            f"{snarky_prefix(tone)}{member_mention} 쉼터 오셨사옵니다. 적당히 쉬시고 다시 공부하러 오시면 감사하겠나이다. 15분 넘기시면 공부방으로 모시어 드리겠나이다.",
-            f"{snarky_prefix(tone)}{member_mention} 휴식 잠깐 하시는 거옵니까. 15분 넘기시면 공부방으로 안내해 드리겠사옵니다.",
-            f"{snarky_prefix(tone)}{member_mention} 쉼터 입장하셨사옵니다. 오래 쉬시면 공부방으로 모시겠나이다.",
-        ])
-    if tone == "t91":
-        return random.choice([
-            f"{snarky_prefix(tone)}{member_mention} 쉬러 오셨네요. 적당히 쉬시고 금방 돌아오세요. 15분 넘기시면 공부방으로 보내 드릴게요.",
-            f"{snarky_prefix(tone)}{member_mention} 휴식이시군요. 15분 넘기시면 공부방으로 안내해 드릴게요. 알겠어요?",
-        ])
-    if tone in ("t71_90", "t51_70"):
-        return random.choice([
-            f"{snarky_prefix(tone)}{member_mention} 쉬러 왔어요. 금방 돌아와요. 15분 넘기면 공부방으로 보낼게요.",
-            f"{snarky_prefix(tone)}{member_mention} 휴식이지? 오래 있으면 공부방으로 보낼 수 있어요.",
-        ])
-    if tone in ("t41_50", "t31_40"):
-        return random.choice([
-            f"{snarky_prefix(tone)}{member_mention} 쉬러 왔어요. 15분 넘기면 공부방으로 보낼게요.",
-            f"{snarky_prefix(tone)}{member_mention} 휴식해. 오래 있으면 공부방으로 보낸다.",
-        ])
-    if tone in ("t21_30", "t16_20"):
-        return random.choice([
-            f"{snarky_prefix(tone)}{member_mention} 쉬러 왔어? 15분 넘기면 공부방으로 끌고 간다.",
-            f"{snarky_prefix(tone)}{member_mention} 휴식이지. 금방 돌아가.",
-        ])
-    if tone in ("t11_15", "t6_10"):
-        return random.choice([
-            f"{snarky_prefix(tone)}{member_mention} 쉬러 왔어? 15분 넘기면 공부방으로 보낸다.",
-            f"{snarky_prefix(tone)}{member_mention} 금방 돌아가. 오래 있으면 끌고 간다.",
-        ])
-    return random.choice([
-        f"{snarky_prefix(tone)}{member_mention} 또 쉬러 왔네요? 이번엔 얼마나 누워있을 건데요.",
-        f"{snarky_prefix(tone)}{member_mention} 쉬러 오셨군요. 금방 돌아가세요.",
-        f"{snarky_prefix(tone)}{member_mention} 휴식 타임이지? 오래 있으면 끌고 간다.",
-        f"{snarky_prefix(tone)}{member_mention} 쉬는 거 15분 넘기면 공부방으로 강제 이동이에요.",
-        f"{snarky_prefix(tone)}{member_mention} 또 놀러 왔네 ㅋㅋ 얼마나 쉴 거야.",
-    ])
+    return render_message("rest_entry", tone, member_mention, snarky_prefix(tone))
 
 
 def freedom_taunt_message(member_mention: str, tone: str = "snarky") -> str:
     """해방에 할당량 안 채우고 들어왔을 때"""
-    if tone == "loyal":
-        return random.choice([
-            f"{member_mention} 감히 아룁니다. 해방은 할당량을 채우신 분만 모실 수 있사옵니다. 공부를 마치시고 오시면 감사하겠나이다.",
-            f"{member_mention} 죄송하오나 해방은 오늘 할당량을 채우신 분만 입장하실 수 있사옵니다. 조금만 더 하시고 오시옵소서.",
-            f"{member_mention} 어찌 감히 해방은 할당량 채우신 분만 모시옵니다. 공부 먼저 하시고 오시면 감사하겠나이다.",
-        ])
-    if tone == "t91":
-        return random.choice([
-            f"{member_mention} 해방은 할당량을 채우신 분만 올 수 있어요. 공부 먼저 하시고 오시면 좋겠어요. 화이팅이에요.",
-            f"{member_mention} 아직 할당량이 안 찼어요. 조금만 더 공부하고 오면 해방 와도 돼요. 기다릴게요.",
-        ])
-    if tone in ("t71_90", "t51_70"):
-        return random.choice([
-            f"{member_mention} 해방은 할당량 채운 사람만 올 수 있어요. 공부 먼저 해 주세요.",
-            f"{member_mention} 아직 할당량이 안 찼어요. 공부하고 오면 해방 와도 돼요.",
-        ])
-    if tone in ("t41_50", "t31_40"):
-        return random.choice([
-            f"{member_mention} 여기는 할당량 채운 사람만 올 수 있어요. 공부 먼저 해 주세요.",
-            f"{member_mention} 할당량 먼저 채우고 와요.",
-        ])
-    if tone in ("t21_30", "t16_20"):
-        return random.choice([
-            f"{member_mention} 여긴 할당량 채운 사람만 오는 데. 공부하고 와.",
-            f"{member_mention} 공부 먼저 해. 그다음에 해방 와.",
-        ])
-    if tone in ("t11_15", "t6_10"):
-        return random.choice([
-            f"{member_mention} 여긴 할당량 채운 사람만 오는 데. 공부하고 와.",
-            f"{member_mention} 공부 먼저 해.",
-        ])
-    return random.choice([
-        f"{member_mention} ㅋㅋㅋㅋ 공부도 다 안 했으면서 벌써 놀려고 하고 있네 ㅋㅋㅋ 넌 글렀다",
-        f"{member_mention} 야 임마 공부 다 하고 와. 여긴 할당량 채운 사람만 오는 데다.",
-        f"{member_mention} ㅋㅋ 넌 아직 해방에 올 자격 없어. 공부부터 해.",
-        f"{member_mention} 공부 안 하고 해방에? ㅋㅋ 넌 글렀다 진짜.",
-        f"{member_mention} 지금 스트레스 좀 받을 거야.근데 이런 스트레스도 필요해. 공부 안 하고 해방 들어온 거 지금은 별거 아닌 것 같지?오늘 자기 전에 생각날 거야",
-    ])
+    return render_message("freedom_taunt", tone, member_mention)
 
 
 def study_room_entry_finite(used_str: str, remain_str: str, tone: str = "snarky") -> str:
     """시간제한 공부방 입장 시 (지금까지 X분, 앞으로 Y분)"""
-    if tone == "loyal":
-        return random.choice([
-            f"지금까지 {used_str} 하셨사옵고, 앞으로 {remain_str} 남으셨나이다. 잘 하시옵소서.",
-            f"누적 {used_str}, 남은 시간 {remain_str}이옵니다. 화이팅이옵소서.",
-            f"허락하신 만큼 {used_str} 하셨사옵고 {remain_str} 남으셨나이다. 수고하옵소서.",
-        ])
-    if tone == "t91":
-        return random.choice([
-            f"지금까지 {used_str} 하셨고 앞으로 {remain_str} 남았어요. 정말 잘 하고 있어요. 힘내세요.",
-            f"누적 {used_str}, 남은 시간 {remain_str}. 잘하고 계세요. 응원할게요.",
-        ])
-    if tone in ("t71_90", "t51_70"):
-        return random.choice([
-            f"지금까지 {used_str}, 앞으로 {remain_str} 남았어요. 힘내요.",
-            f"{remain_str} 남았어요. {used_str} 한 거 잘했어요.",
-        ])
-    if tone in ("t41_50", "t31_40"):
-        return random.choice([
-            f"지금까지 {used_str}, 앞으로 {remain_str} 남았어요. 잘 해요.",
-            f"{remain_str} 남았어요. 화이팅.",
-        ])
-    if tone in ("t21_30", "t16_20"):
-        return random.choice([
-            f"지금까지 {used_str}, 앞으로 {remain_str} 남았어. 잘 해.",
-            f"{remain_str} 남았네. 화이팅.",
-        ])
-    if tone in ("t11_15", "t6_10"):
-        return random.choice([
-            f"지금까지 {used_str}, 앞으로 {remain_str} 남았어. 더 해.",
-            f"{remain_str} 남았네. 잘 해.",
-        ])
-    return random.choice([
-        f"지금까지 {used_str} 공부했네. 앞으로 {remain_str} 남았는데 고작 그거 가지고 공부가 되겠어?",
-        f"누적 {used_str}, 남은 거 {remain_str}. 그거로 뭘 해 ㅋ",
-        f"아직 {remain_str} 남았다. {used_str} 한 거로 만족해?",
-        f"앞으로 {remain_str} 남았어. 지금까지 {used_str}밖에 안 했네. 더 해.",
-        f"{used_str} 썼고 {remain_str} 남음. 고작 그걸로 공부했다고?",
-    ])
+    return render_message("study_entry_finite", tone, used_str, remain_str)
 
 
 def study_room_entry_zero_extra(tone: str = "snarky") -> str:
     """시간제한 공부방인데 남은 시간 0분일 때 추가 멘트"""
-    if tone == "loyal":
-        return random.choice([
-            " 남은 시간이 0분이옵니다. 곧 해방으로 모시어 드리겠나이다.",
-            " 시간이 다 되었사옵니다. 잠시 후 이동해 드리겠나이다.",
-        ])
-    if tone in ("t91", "t71_90", "t51_70"):
-        return random.choice([
-            " 남은 시간이 0분이에요. 곧 해방으로 안내해 드릴게요.",
-            " 시간이 다 됐어요. 잠시 후 이동해 드릴게요.",
-        ])
-    if tone in ("t41_50", "t31_40", "t21_30", "t16_20"):
-        return " 0분 남았어요. 곧 이동시킬게요."
-    if tone in ("t11_15", "t6_10"):
-        return " 0분 남았어. 곧 이동시킬게."
-    return random.choice([
-        " 근데 남은 시간이 0분이네요? 곧 끌려나가도 놀라지 말아요.",
-        " 0분 남았다. 곧 해방(아니면 공부방)으로 끌고 간다.",
-        " 시간 다 됐다. 곧 이동시킨다.",
-        " 남은 거 0분. 빨리 마무리해.",
-    ])
+    return render_message("study_entry_zero_extra", tone)
 
 
 def study_unlimited_mute_message(tone: str = "snarky") -> str:
     """시간무제한 음소거 공부방 입장 시"""
-    if tone == "loyal":
-        return random.choice([
-            "여기서는 시간 제한 없이 공부하실 수 있사옵니다. 편히 하시옵소서.",
-            "시간 무제한 공부방이옵니다. 집중하시면 되옵니다.",
-        ])
-    if tone == "t91":
-        return random.choice([
-            "여기선 시간 제한 없이 공부하실 수 있어요. 편하게 집중하세요. 응원할게요.",
-            "시간 무제한 공부방이에요. 편히 하시면 돼요. 잘 하실 거예요.",
-        ])
-    if tone in ("t71_90", "t51_70", "t41_50", "t31_40"):
-        return random.choice([
-            "여기선 시간 제한 없어요. 집중해서 해요.",
-            "시간 무제한이니까 편하게 공부해요.",
-        ])
-    if tone in ("t21_30", "t16_20", "t11_15", "t6_10"):
-        return random.choice([
-            "여기선 시간 제한 없어. 집중해서 해.",
-            "시간 무제한이니까 편하게 공부해.",
-        ])
-    return random.choice([
-        "와.... 여기까지 올 정도면 어지간히 놀았나 보네요? 이제 진짜 좀 하겠다는 거죠?",
-        "지금 스트레스 좀 받을 거야.근데 공부 많이 된다.?",
-        "여기 오면 놀면 안 된다. 진짜 공부하는 거다.",
-        "이모 여기 시간 무제한으로 서비스 넣어드렸어요~",
-    ])
+    return render_message("study_unlimited_mute", tone)
 
 
 def study_3h_plus_message(used_str: str, tone: str = "snarky") -> str:
     """5시간 입장 시"""
-    if tone == "loyal":
-        return random.choice([
-            f"5시간 공부방이옵니다. 지금까지 {used_str} 하셨사옵고 여기서 더 하시면 되옵니다.",
-            f"지금까지 {used_str} 하셨사옵고, 여기선 5시간까지 가능하옵니다. 화이팅이옵소서.",
-        ])
-    if tone == "t91":
-        return random.choice([
-            f"5시간 공부방이에요. 지금까지 {used_str} 하셨네요. 여기서 더 하시면 돼요. 잘 하실 거예요.",
-            f"지금까지 {used_str} 하셨고 여기선 5시간까지 가능해요. 힘내세요.",
-        ])
-    if tone in ("t71_90", "t51_70", "t41_50", "t31_40"):
-        return random.choice([
-            f"여긴 5시간 방이에요. 지금까지 {used_str} 했네요. 더 할 수 있어요.",
-            f"지금까지 {used_str}. 여기서 5시간까지 해도 돼요.",
-        ])
-    if tone in ("t21_30", "t16_20", "t11_15", "t6_10"):
-        return random.choice([
-            f"여긴 5시간 방이야. 지금까지 {used_str} 했네. 더 할 수 있어.",
-            f"지금까지 {used_str}. 여기서 5시간까지 해도 돼.",
-        ])
-    return random.choice([
-        f"여긴 5시간 공부방인데.... 그 와중에 지금까지 {used_str}밖에 안 했네요? 5시간이 쉬워보여??",
-        f"여긴 공부좀 할려고 하는애들만 오는데인데... {used_str}밖에 안 했어? ㅋ 더 해.",
-        f"지금까지 {used_str}. 여긴 진짜들만 오는데이다.",
-    ])
+    return render_message("study_3h_plus", tone, used_str)
 
 
 def rest_pinch_5min(member_mention: str, tone: str = "snarky") -> str:
     """쉼터 5분 경과"""
-    if tone == "loyal":
-        return random.choice([
-            f"{member_mention} 휴식 5분이 되셨사옵니다. 15분 넘기시면 3시간 공부방으로 모시어 드리겠나이다.",
-            f"{member_mention} 5분 지나셨사옵니다. 오래 쉬시면 공부방으로 모시겠나이다.",
-        ])
-    if tone == "t91":
-        return random.choice([
-            f"{member_mention} 휴식 5분 되셨어요. 15분 넘기시면 3시간 공부방으로 보내 드릴게요. 알겠어요?",
-            f"{member_mention} 5분 지나셨네요. 너무 오래 쉬시면 공부방으로 안내해 드릴게요.",
-        ])
-    if tone in ("t71_90", "t51_70", "t41_50", "t31_40"):
-        return random.choice([
-            f"{member_mention} 5분 됐어요. 15분 넘기면 3시간 방으로 보낼게요.",
-            f"{member_mention} 5분 지났어요. 더 쉬면 공부방으로 보낸다.",
-        ])
-    if tone in ("t21_30", "t16_20", "t11_15", "t6_10"):
-        return random.choice([
-            f"{member_mention} 5분 됐어. 15분 넘기면 3시간 방으로 보낸다.",
-            f"{member_mention} 5분 지났어. 더 쉬면 공부방으로 보낼게.",
-        ])
-    return random.choice([
-        f"{member_mention} 지금 휴식 5분째인데 언제까지 쉴려고…? 그걸 지금 공부라 하는 거야…? 15분 넘기면 3시간 공부방으로 끌고 간다.",
-        f"{member_mention} 5분 됐다. 더 쉬면 3시간 방으로 보낸다. 새낀 더 많이 공부해라.",
-        f"{member_mention} 5분째 쉬는 중이네. 10분 되면 또 말하고 15분 되면 3시간 공부방으로 끌고 간다.",
-    ])
+    return render_message("rest_pinch_5min", tone, member_mention)
 
 
 def rest_pinch_10min(member_mention: str, tone: str = "snarky") -> str:
     """쉼터 10분 경과"""
-    if tone == "loyal":
-        return random.choice([
-            f"{member_mention} 이제 10분이 되셨사옵니다. 5분 더 계시면 3시간 공부방으로 모시어 드리겠나이다.",
-            f"{member_mention} 10분 지나셨사옵니다. 15분 되시면 공부방으로 모시겠나이다.",
-        ])
-    if tone == "t91":
-        return random.choice([
-            f"{member_mention} 이제 10분이에요. 5분 더 계시면 3시간 공부방으로 보내 드릴게요. 알겠어요?",
-            f"{member_mention} 10분 지나셨어요. 15분 되시면 공부방으로 안내해 드릴게요.",
-        ])
-    if tone in ("t71_90", "t51_70", "t41_50", "t31_40"):
-        return random.choice([
-            f"{member_mention} 10분 됐어요. 5분 더 있으면 3시간 방으로 보낼게요.",
-            f"{member_mention} 10분 지났어요. 15분 되면 공부방으로 보낸다.",
-        ])
-    if tone in ("t21_30", "t16_20", "t11_15", "t6_10"):
-        return random.choice([
-            f"{member_mention} 10분 됐어. 5분 더 있으면 3시간 방으로 보낸다.",
-            f"{member_mention} 10분 지났어. 15분 되면 공부방으로 보낼게.",
-        ])
-    return random.choice([
-        f"{member_mention} 지금 휴식 10분째인데 언제까지 쉴려고…? 그걸 지금 공부라 하는 거야…? 5분 더 있으면 3시간 방으로 강제 이동이다.",
-        f"{member_mention} 10분이다. 5분 더 있으면 3시간 공부방으로 보낸다. 길게 공부하란 뜻이다.",
-        f"{member_mention} 10분째 놀고 있네. 이게 공부야? 15분 되면 3시간 공부방으로 끌고 간다. 더 해라.",
-    ])
+    return render_message("rest_pinch_10min", tone, member_mention)
 
 
 def sunong_time_reply(member_mention: str, study_minutes: int, tone: str = "snarky") -> str:
     """!순공시간 명령 시 (오늘 누적 공부 시간 알려주기)"""
-    used_str = format_minutes(study_minutes)
-    if tone == "loyal":
-        return random.choice([
-            f"{member_mention} 오늘 순공 {used_str} 하셨사옵니다. 꾸준히 하시는 모습 감사하옵니다.",
-            f"{member_mention} 지금까지 {used_str} 공부하셨사옵니다. 수고하고 계시옵소서.",
-            f"{member_mention} {used_str} 하셨사옵나이다. 잘 하시옵소서.",
-        ])
-    if tone == "t91":
-        return random.choice([
-            f"{member_mention} 오늘 순공 {used_str} 하셨어요. 정말 잘 하고 있어요. 응원할게요.",
-            f"{member_mention} 지금까지 {used_str} 했어요. 잘하고 계세요. 힘내요.",
-        ])
-    if tone in ("t71_90", "t51_70"):
-        return random.choice([
-            f"{member_mention} 오늘 {used_str} 했어요. 잘 하고 있어요.",
-            f"{member_mention} 지금까지 {used_str}. 힘내요.",
-        ])
-    if tone in ("t41_50", "t31_40"):
-        return random.choice([
-            f"{member_mention} 오늘 {used_str} 했어요. 잘 해요.",
-            f"{member_mention} 지금까지 {used_str}. 화이팅.",
-        ])
-    if tone in ("t21_30", "t16_20"):
-        return random.choice([
-            f"{member_mention} 오늘 {used_str} 했네. 잘 해.",
-            f"{member_mention} 지금까지 {used_str}. 더 하면 좋겠다.",
-        ])
-    if tone in ("t11_15", "t6_10"):
-        return random.choice([
-            f"{member_mention} 오늘 {used_str} 했네. 잘 해.",
-            f"{member_mention} 지금까지 {used_str}. 더 해.",
-        ])
-    return random.choice([
-        f"{member_mention} {used_str} 공부했는데, 그거 고작 공부했다고 지금 물어본 거야?",
-        f"{member_mention} 오늘 {used_str}. 원래 공부 잘하는 애들은 시간 안 물어보던데....",
-        f"{member_mention} {used_str}다. 그걸로 만족해? 더 해라.",
-        f"{member_mention} 지금까지 {used_str}. 시간 세는 거 말고 공부나 더 해.",
-        f"{member_mention} {used_str} 공부했네. 그거 가지고 물어보기나 하네 ㅋ",
-        f"{member_mention} 오늘 순공 {used_str}. 적으면 부끄러우니까 더 하고 물어봐.",
-        f"{member_mention} {used_str}밖에 안 했어. 시간 체크할 시간에 책 펴라.",
-    ])
+    return render_message("sunong_time", tone, member_mention, format_minutes(study_minutes))
 
 
 def chat_limit_pinchan(member_mention: str, tone: str = "snarky") -> str:
     """할당량 안 채운 사람이 채팅 5회 초과 시 핀잔"""
-    if tone == "loyal":
-        return random.choice([
-            f"{member_mention} 할당량을 채우시면 채팅도 자유로우시옵니다. 공부를 먼저 하시옵소서.",
-            f"{member_mention} 아직 할당량이 안 채워져 계시옵니다. 채팅을 줄여 주시면 감사하겠나이다.",
-        ])
-    if tone == "t91":
-        return random.choice([
-            f"{member_mention} 할당량 채우시면 채팅도 자유로우실 거예요. 공부 먼저 해 주세요. 화이팅이에요.",
-            f"{member_mention} 아직 할당량이 안 찼어요. 채팅 줄여 주시면 감사할게요.",
-        ])
-    if tone in ("t71_90", "t51_70", "t41_50", "t31_40"):
-        return random.choice([
-            f"{member_mention} 할당량 채우고 오면 채팅해도 돼요. 지금은 집중해요.",
-            f"{member_mention} 공부 할당량 안 찼으면 채팅 줄여 줘요.",
-        ])
-    if tone in ("t21_30", "t16_20", "t11_15", "t6_10"):
-        return random.choice([
-            f"{member_mention} 할당량 채우고 오면 채팅해도 돼. 지금은 집중해.",
-            f"{member_mention} 공부 할당량 안 찼으면 채팅 줄여 줘.",
-        ])
-    return random.choice([
-        f"{member_mention} 야 공부도 안 한 놈이 집중 안 해? 채팅 그만 해.",
-        f"{member_mention} 공부 할당량 안 채웠으면 채팅부터 줄여. 집중해.",
-        f"{member_mention} 공부도 안 했으면서 채팅만 미친 듯이 치네? 집중 안 해?",
-        f"{member_mention} 야. 공부 안 한 놈이 채팅만 하지 말라.",
-        f"{member_mention} 할당량 채우고 와. 채팅 그만.",
-    ])
+    return render_message("chat_limit", tone, member_mention)
 
 
 def unlimited_room_can_move_message(member_mention: str, tone: str = "snarky") -> str:
     """정신과 시간(무제한)방 5시간 됐을 때 해방 이동 가능 알림"""
-    if tone == "loyal":
-        return random.choice([
-            f"{member_mention} 5시간 채우셨사옵니다. 이제 해방으로 모시거나 여기서 더 하셔도 되옵니다. 수고 많으셨나이다.",
-            f"{member_mention} 할당량 다 채우셨사옵니다. 해방 이동 가능하옵니다. 편하신 대로 하시옵소서.",
-        ])
-    if tone == "t91":
-        return random.choice([
-            f"{member_mention} 5시간 채우셨네요. 이제 해방 가시거나 여기서 더 하셔도 돼요. 정말 수고 많으셨어요.",
-            f"{member_mention} 할당량 다 채우셨어요. 해방 이동 가능해요. 편하신 대로 하세요. 응원할게요.",
-        ])
-    if tone in ("t71_90", "t51_70", "t41_50", "t31_40"):
-        return random.choice([
-            f"{member_mention} 5시간 채웠어요. 해방 가도 되고 여기서 더 해도 돼요.",
-            f"{member_mention} 할당량 다 채웠네요. 이동 가능해요.",
-        ])
-    if tone in ("t21_30", "t16_20", "t11_15", "t6_10"):
-        return random.choice([
-            f"{member_mention} 5시간 채웠어. 해방 가도 되고 여기서 더 해도 돼.",
-            f"{member_mention} 할당량 다 채웠네. 이동 가능해.",
-        ])
-    return random.choice([
-        f"{member_mention} 5시간 채웠다. 이제 해방으로 이동 가능하다. 가고 싶으면 가고, 더 하려면 여기서 쭉 해.",
-        f"{member_mention} 할당량 다 채웠네. 이동 가능해. 해방 가도 되고 여기서 계속 해도 되고.",
-        f"{member_mention} 5시간 됐다. 이동 가능하다. 놀러 가고 싶으면 해방으로, 아니면 그냥 여기서 더 해라.",
-        f"{member_mention} 이제 이동 가능해. 해방 가도 되고 여기서 작업 계속해도 된다.",
-    ])
+    return render_message("unlimited_can_move", tone, member_mention)
 
 
 def rest_force_move_15min(member_mention: str, tone: str = "snarky") -> str:
     """쉼터 15분 → 3시간 공부방 강제 이동 시"""
-    if tone == "loyal":
-        return random.choice([
-            f"{member_mention} 15분이 넘어 3시간 공부방으로 모시어 드리겠나이다. 조금만 더 집중하시옵소서.",
-            f"{member_mention} 휴식 시간이 끝나 3시간 공부방으로 안내해 드리겠나이다. 화이팅이옵소서.",
-        ])
-    if tone == "t91":
-        return random.choice([
-            f"{member_mention} 15분이 넘어서 3시간 공부방으로 보내 드릴게요. 거기서 집중하세요. 화이팅이에요.",
-            f"{member_mention} 쉬는 시간이 끝나서 3시간 공부방으로 안내해 드릴게요. 잘 하실 거예요.",
-        ])
-    if tone in ("t71_90", "t51_70", "t41_50", "t31_40"):
-        return random.choice([
-            f"{member_mention} 15분 넘어서 3시간 방으로 보낼게요. 거기서 집중해서 해요.",
-            f"{member_mention} 쉬는 거 끝이에요. 3시간 공부방 가요.",
-        ])
-    if tone in ("t21_30", "t16_20", "t11_15", "t6_10"):
-        return random.choice([
-            f"{member_mention} 15분 넘어서 3시간 방으로 보낼게. 거기서 집중해.",
-            f"{member_mention} 쉬는 거 끝이야. 3시간 공부방 가.",
-        ])
-    return random.choice([
-        f"{member_mention} 어휴 니놈 공부 안 하니까 내가 강제로라도 시켜야지 원. 3시간 방으로 보낸다. 너 새낀 더 많이 공부해.",
-        f"{member_mention} 15분 넘겼다. 이제 3시간 공부방 가. 강제다. 쉬기만 하면 안 되니까 길게 공부해라.",
-        f"{member_mention} 쉬는 거 끝. 공부하러 가. 3시간 채워라. 더 오래 해.",
-        f"{member_mention} 놀기만 하지 말고 공부해. 3시간 방으로 끌고 간다. 새낀 더 많이 해라.",
-        f"{member_mention} 쉬는 데 15분 넘겼으면 이제 공부하는 데 3시간은 해라. 강제로 보낸다.",
-        f"{member_mention} 넌 더 많이 공부해야지. 3시간 공부방 가. 거기서 제대로 해.",
-        f"{member_mention} 공부 안 하고 쉬기만 하니까 3시간짜리 방으로 보낸다. 길게 해라.",
-        f"{member_mention} 어휴… 쉬기만 하네. 3시간 공부방 가서 제대로 길게 공부해라.",
-    ])
+    return render_message("rest_force_move", tone, member_mention)
 
 
 def is_study_channel(channel_id: int | None) -> bool:
@@ -713,61 +1138,12 @@ def is_study_or_pledge_channel(channel_id: int | None) -> bool:
 
 def study_reentry_message(member_mention: str, tone: str = "snarky") -> str:
     """할당량 이미 채운 뒤 공부방 재방문 시"""
-    if tone == "loyal":
-        return random.choice([
-            f"{member_mention} 할당량 채우시고 또 오셨사옵니다. 대단하시옵니다. 열심히 하시옵소서.",
-            f"{member_mention} 다시 공부하러 오셨사옵니다. 응원하옵나이다.",
-        ])
-    if tone == "t91":
-        return random.choice([
-            f"{member_mention} 할당량 채우고 또 오셨네요. 정말 대단해요. 화이팅이에요.",
-            f"{member_mention} 다시 공부하러 오셨군요. 응원할게요. 잘 하실 거예요.",
-        ])
-    if tone in ("t71_90", "t51_70", "t41_50", "t31_40"):
-        return random.choice([
-            f"{member_mention} 할당량 채우고 또 왔네요. 대단해요. 화이팅.",
-            f"{member_mention} 또 공부하러 왔어? 잘했어요.",
-        ])
-    if tone in ("t21_30", "t16_20", "t11_15", "t6_10"):
-        return random.choice([
-            f"{member_mention} 할당량 채우고 또 왔네. 대단해. 화이팅.",
-            f"{member_mention} 또 공부하러 왔어? 잘했어.",
-        ])
-    return random.choice([
-        f"오.... {member_mention} 다시 공부하게....? 겨우 한 번 하고 끝이 아니었구나. 뭐, 하려면 제대로 해.",
-        f"와 {member_mention} 할당량 채우고 또 왔네? 놀랐다. 그 결심 함 좀 지켜봐.",
-        f"{member_mention} 또 공부하러 왔어? 한 번 하고 끝일 줄 알았는데. 뭐, 해라.",
-        f"오.... {member_mention} 다시 들어왔네. 할당량은 이미 채웠잖아. 그래도 더 한다고? 괜찮은데.",
-    ])
+    return render_message("study_reentry", tone, member_mention)
 
 
 def freedom_quota_done_taunt(member_mention: str, tone: str = "snarky") -> str:
     """할당량 채운 사람이 해방 왔을 때"""
-    if tone == "loyal":
-        return random.choice([
-            f"{member_mention} 오늘 할당량 채우시고 오셨사옵니다. 편히 쉬시옵소서.",
-            f"{member_mention} 수고 많으셨나이다. 해방에서 편히 놀다 가시옵소서.",
-        ])
-    if tone == "t91":
-        return random.choice([
-            f"{member_mention} 할당량 채우시고 오셨네요. 편히 쉬세요. 수고 많으셨어요.",
-            f"{member_mention} 수고하셨어요. 해방에서 편히 놀다 가세요.",
-        ])
-    if tone in ("t71_90", "t51_70", "t41_50", "t31_40"):
-        return random.choice([
-            f"{member_mention} 할당량 채웠네요. 편히 쉬어요.",
-            f"{member_mention} 수고했어요. 해방에서 놀아요.",
-        ])
-    if tone in ("t21_30", "t16_20", "t11_15", "t6_10"):
-        return random.choice([
-            f"{member_mention} 할당량 채웠네. 편히 쉬어.",
-            f"{member_mention} 수고했어. 해방에서 놀아.",
-        ])
-    return random.choice([
-        f"그래... 뭐 {member_mention} 넌 오늘 공부 할당량 했으니까.... 그래도 뭔가 좀 한다 싶어서 놀랐는데 역시나....",
-        f"{member_mention} 할당량은 채웠네. 그래도 해방 오면 역시 놀려는 거지 ㅋ",
-        f"뭐 {member_mention} 넌 오늘 할당량 했으니까 말 안 해. 그래도 여기 와서 논다는 건.... 역시.",
-    ])
+    return render_message("freedom_quota_done", tone, member_mention)
 
 
 def study_leave_log_message(member_mention: str, this_session_min: int, today_total_min: int) -> str:
@@ -779,129 +1155,54 @@ def study_leave_log_message(member_mention: str, this_session_min: int, today_to
 
 def pledge_priority_in_other_room_message(member_mention: str, declared_str: str, remaining_str: str, tone: str = "snarky") -> str:
     """약속했는데 다른 공부방 들어왔을 때: 약속한 시간이 우선이다"""
-    if tone == "loyal":
-        return random.choice([
-            f"{member_mention} 선언하신 {declared_str} 잊지 마시옵소서. 앞으로 {remaining_str} 더 하시면 되옵니다.",
-            f"{member_mention} 여기서 하셔도 선언하신 만큼은 채우셔야 하옵니다. 앞으로 {remaining_str} 남으셨나이다.",
-        ])
-    if tone == "t91":
-        return random.choice([
-            f"{member_mention} 선언하신 {declared_str} 기억하세요. 앞으로 {remaining_str} 더 하시면 돼요. 화이팅이에요.",
-            f"{member_mention} 여기 있어도 {declared_str} 만큼은 채우셔야 해요. {remaining_str} 남았어요.",
-        ])
-    if tone in ("t71_90", "t51_70", "t41_50", "t31_40"):
-        return random.choice([
-            f"{member_mention} 선언한 {declared_str} 기억해요. 앞으로 {remaining_str} 더 해요.",
-            f"{member_mention} 여기 있어도 {declared_str} 만큼은 해야 해요. {remaining_str} 남았어요.",
-        ])
-    if tone in ("t21_30", "t16_20", "t11_15", "t6_10"):
-        return random.choice([
-            f"{member_mention} 선언한 {declared_str} 기억해. 앞으로 {remaining_str} 더 해.",
-            f"{member_mention} 여기 있어도 {declared_str} 만큼은 해야 해. {remaining_str} 남았어.",
-        ])
-    return random.choice([
-        f"{member_mention} 동작그만. 밑장빼기냐? 여기서 공부해도 넌 너가 말한 시간을 공부해야 하는 건 변하지 않아. (선언: {declared_str}, 앞으로 {remaining_str} 더)",
-        f"{member_mention} 선언한 {declared_str} 잊지 마. 여기 있어도 그만큼은 해야 해. 앞으로 {remaining_str} 더.",
-    ])
+    return render_message("pledge_other_room", tone, member_mention, declared_str, remaining_str)
 
 
 def pledge_room_no_declaration_message(member_mention: str, tone: str = "snarky") -> str:
     """선언 없이 선언 공부방에 그냥 들어왔을 때"""
-    if tone == "loyal":
-        return random.choice([
-            f"{member_mention} 이 방은 시간을 선언하고 오시는 방이옵니다. 채팅 채널에서 N시간 공부하겠다고 쓰시고 오시옵소서.",
-            f"{member_mention} 여기는 선언 공부방이옵니다. 먼저 몇 시간 하시겠다고 쓰고 오시면 되옵니다.",
-        ])
-    if tone == "t91":
-        return random.choice([
-            f"{member_mention} 이 방은 시간을 선언하고 오시는 방이에요. 채팅에서 N시간 공부하겠다고 쓰고 오시면 돼요.",
-            f"{member_mention} 여기는 선언 공부방이에요. 먼저 몇 시간 하시겠다고 쓰고 오세요.",
-        ])
-    if tone in ("t71_90", "t51_70", "t41_50", "t31_40"):
-        return random.choice([
-            f"{member_mention} 여긴 선언하고 오는 방이에요. 채팅에 N시간 하겠다고 쓰고 와요.",
-            f"{member_mention} 이 방은 시간 선언한 사람만 쓸 수 있어요. 먼저 선언하고 와요.",
-        ])
-    if tone in ("t21_30", "t16_20", "t11_15", "t6_10"):
-        return random.choice([
-            f"{member_mention} 여긴 선언하고 오는 방이야. 채팅에 N시간 하겠다고 쓰고 와.",
-            f"{member_mention} 이 방은 시간 선언한 사람만 쓸 수 있어. 먼저 선언하고 와.",
-        ])
-    return random.choice([
-        f"이 공부방은 스스로 시간을 선언한 사람만 오는 곳인데.... {member_mention} 너 진짜 공부 다짐한 거야?흉추 걸수있어?",
-        f"{member_mention} 여긴 선언하고 오는 방이야. 자신있는거지?",
-        f"이 방은 공약을 지킬수있는 사람만 쓰는 곳이야. 근데{member_mention}야 난 이렇게 생각해. 너 진짜 스스로 시간은 지킬수있어?",
-    ])
+    return render_message("pledge_no_declaration", tone, member_mention)
 
 
 def pledge_commit_message(member_mention: str, duration_str: str, tone: str = "snarky") -> str:
     """스스로 N시간 공부 선언 시 로그"""
-    if tone == "loyal":
-        return random.choice([
-            f"{member_mention} {duration_str} 공부하시겠다고 하셨사옵니다. 화이팅이옵소서. 잘 하시옵소서.",
-            f"{member_mention} {duration_str} 선언하셨사옵니다. 끝까지 하시옵소서. 응원하옵나이다.",
-        ])
-    if tone == "t91":
-        return random.choice([
-            f"{member_mention} {duration_str} 공부하시겠다고 하셨네요. 끝까지 하세요. 화이팅이에요.",
-            f"{member_mention} {duration_str} 선언하셨으니 꼭 지키세요. 응원할게요.",
-        ])
-    if tone in ("t71_90", "t51_70", "t41_50", "t31_40"):
-        return random.choice([
-            f"{member_mention} {duration_str} 하겠다고 했으니 끝까지 해요. 화이팅.",
-            f"{member_mention} {duration_str} 공부한다고 했으니까 지켜요. 잘해요.",
-        ])
-    if tone in ("t21_30", "t16_20", "t11_15", "t6_10"):
-        return random.choice([
-            f"{member_mention} {duration_str} 하겠다고 했으니 끝까지 해. 화이팅.",
-            f"{member_mention} {duration_str} 공부한다고 했으니까 지켜. 잘해.",
-        ])
-    return random.choice([
-        f"{member_mention} 너가 스스로 {duration_str} 공부한다 했으니까, 이건 꼭 지켜라.",
-        f"{member_mention} {duration_str} 하겠다고 했으니 말만 하지 말고 해라.시간 충전해줬으니까 가서 공부 시작해.",
-        f"{member_mention} 시간 충전해뒀다.{duration_str} 공부한다고 했으면 끝까지 해.",
-    ])
+    return render_message("pledge_commit", tone, member_mention, duration_str)
 
 
-def get_user_state(user_id: int) -> dict:
-    if user_id not in study_state:
-        study_state[user_id] = {
-            "in_study": False,
-            "current_channel_id": None,
-            "last_join_at": None,
-            "total_study_sec": 0.0,
-            "session_study_sec": 0.0,
-            "session_start_total_sec": 0.0,
-        }
-    return study_state[user_id]
+def get_user_state(user_id: int) -> UserDay:
+    day = user_days.get(user_id)
+    if day is None:
+        day = user_days[user_id] = UserDay()
+    return day
 
 
-def update_user_study_time(user_id: int) -> None:
-    """현재 시간 기준으로 직전 입장 시각부터 누적 공부 시간 추가 (할당량 미달이면 total, 이미 채웠으면 session만)"""
+def update_user_study_time(user_id: int, now: float | None = None) -> None:
+    """현재 시간(now를 주면 그 시각) 기준으로 직전 입장 시각부터 누적 공부 시간 추가 (할당량 미달이면 total, 이미 채웠으면 session만)"""
     state = get_user_state(user_id)
-    if not state["in_study"] or state["last_join_at"] is None:
+    if not state.in_study or state.last_join_at is None:
         return
 
-    now = time.time()
-    diff = now - state["last_join_at"]
+    if now is None:
+        now = time.time()
+    diff = now - state.last_join_at
     if diff <= 0:
         return
 
-    state["last_join_at"] = now
-    if user_id in completed_quota_today:
-        state["session_study_sec"] = state.get("session_study_sec", 0) + diff
+    state.last_join_at = now
+    state_store.mark_dirty(user_id)
+    if state.quota_done:
+        state.session_study_sec += diff
     else:
-        state["total_study_sec"] += diff
+        state.total_study_sec += diff
 
 
 def get_remaining_minutes(user_id: int, room_channel_id: int) -> int:
     """해당 공부방 기준으로 남은 시간(분) 계산. 재방문(할당량 이미 채움)이면 세션 시간 기준."""
     state = get_user_state(user_id)
     limit = ROOM_LIMIT_MINUTES.get(room_channel_id, 9999)
-    if user_id in completed_quota_today:
-        session_minutes = int(state.get("session_study_sec", 0) // 60)
+    if state.quota_done:
+        session_minutes = int(state.session_study_sec // 60)
         return limit - session_minutes
-    total_minutes = int(state["total_study_sec"] // 60)
+    total_minutes = int(state.total_study_sec // 60)
     return limit - total_minutes
 
 
@@ -958,18 +1259,99 @@ AI_CHANNEL_SYSTEM_PROMPT = """너는 공부하는 사람한테 츤데레처럼 
 5. 답변 길이는 조언이 들어가면 5~10문장 정도. 한국어."""
 
 
+# 명시적인 조회만 ("내 공부시간", "순공", "몇 시간 했어", "얼마나 공부했어"). "내일"·"내신"·"공부시간 늘리는 법"은 아님
+_STUDY_QUERY_RE = re.compile(r"(순공|내\s*공부\s*시간|몇\s*시간\s*했|얼마나\s*(공부)?\s*했)")
+
+
 def is_study_query(text: str) -> bool:
     """'내 공부시간', '순공', '얼마나 했어' 등 조회 의도인지."""
+    return bool(_STUDY_QUERY_RE.search(text.strip().lower()))
+
+
+def today_study_minutes(user_id: int) -> int:
+    """오늘 누적 공부 분 (지금 공부방에 있으면 지금까지 반영). 일반 공부방 + 선언 공부방 포함."""
+    # 현재 공부방(일반/선언 모두)에 있으면 직전 입장~지금까지 시간을 먼저 total/session에 반영 (선언공부방·선택시간방 0분 버그 방지)
+    update_user_study_time(user_id)
+    state = get_user_state(user_id)
+    total_sec = state.total_study_sec
+    # 할당량 이미 채운 뒤 재방문 시에는 session_study_sec에 쌓이므로 합산해서 표시
+    if state.quota_done:
+        total_sec += state.session_study_sec
+    # 선언 공부방 시간은 위 update_user_study_time에서 이미 last_join_at 기준으로 total_sec에 반영됨 → 따로 더하면 중복
+    return int(total_sec // 60)
+
+
+def ai_credit_reply(member_mention: str, user_id: int) -> str:
+    """남은 AI 사용 기회 안내 (!AI횟수 / AI 채널 질문 공용)"""
+    update_user_study_time(user_id)
+    state = get_user_state(user_id)
+    study_hours = int(state.total_study_sec // 3600)
+    used = state.ai_used
+    remaining = max(0, 1 + study_hours - used)
+    return (
+        f"{member_mention} 남은 AI 사용 기회 **{remaining}번**이에요. "
+        f"(오늘 순공 {study_hours}시간 → +{study_hours}회, 사용 {used}회)"
+    )
+
+
+def quota_status_reply(member: discord.Member, user_id: int) -> str:
+    """오늘 할당량(지금 있는 공부방 기준)·선언 목표까지 남은 시간 안내"""
+    update_user_study_time(user_id)
+    state = get_user_state(user_id)
+    mention = member.mention
+    if state.pledge_target_min > 0:
+        done = int(state.pledge_done_min)
+        if state.pledge_entered_at is not None:
+            done += int((time.time() - state.pledge_entered_at) // 60)
+        remain = max(0, state.pledge_target_min - done)
+        return f"{mention} 선언한 {format_minutes(state.pledge_target_min)} 중 앞으로 {format_minutes(remain)} 더 하면 돼요."
+    if state.quota_done:
+        return f"{mention} 오늘 할당량은 이미 채웠어요. 해방 가도 돼요."
+    used = format_minutes(int(state.total_study_sec // 60))
+    channel_id = state.current_channel_id if state.in_study else None
+    if channel_id is None or ROOM_LIMIT_MINUTES.get(channel_id, 9999) >= 9999:
+        return f"{mention} 오늘 지금까지 {used} 했어요. 시간 정해진 공부방에 들어가면 그 방 기준으로 남은 시간 알려줄게요."
+    remain = get_remaining_minutes(user_id, channel_id)
+    return f"{mention} 오늘 {used} 했고, 지금 방 기준으로 앞으로 {format_minutes(remain)} 더 하면 해방이에요."
+
+
+# ---------- AI 채널 로컬 응답 (Gemini 안 부르고 바로 답하는 질문) ----------
+# 순공 시간·남은 할당량·AI 기회 질문은 메모리 상태로 바로 답함 (기회 차감 없음). 조언을 구하는 질문은 Gemini로.
+AI_LOCAL_MAX_CHARS = 30  # 이보다 긴 메시지는 조회 질문이 아니라고 봄
+_AI_ADVICE_HINTS = (
+    "어떻게", "방법", "법", "추천", "왜", "팁", "해야", "할까", "좋을", "좋아", "알려줘", "뭐가", "뭘", "뭐부터",
+    "짜줘", "분석", "관리",
+)
+_AI_CREDIT_RE = re.compile(r"(기회|횟수|ai.*(몇|남))")
+_AI_QUOTA_RE = re.compile(r"(할당|남은시간|몇분남|얼마나남|언제끝|해방까지)")
+
+ai_route_counts = {"local": 0, "model": 0}
+ai_local_latencies: deque = deque(maxlen=200)  # 로컬 응답 만드는 데 걸린 시간 (초)
+
+
+def classify_ai_intent(text: str) -> str | None:
+    """AI 채널 메시지 의도: "ai_credit" / "quota" / "study_time" / None(Gemini로)"""
     t = text.strip().lower().replace(" ", "")
-    if not t:
-        return False
-    if "순공" in t or "공부시간" in t or "공부시간" in text:
-        return True
-    if "얼마나" in t and ("했" in t or "해" in t):
-        return True
-    if "내" in t and ("공부" in t or "시간" in t):
-        return True
-    return False
+    if not t or len(t) > AI_LOCAL_MAX_CHARS:
+        return None
+    if any(hint in t for hint in _AI_ADVICE_HINTS):
+        return None
+    if _AI_CREDIT_RE.search(t):
+        return "ai_credit"
+    if _AI_QUOTA_RE.search(t):
+        return "quota"
+    if is_study_query(text):
+        return "study_time"
+    return None
+
+
+def local_ai_reply(member: discord.Member, intent: str) -> str:
+    if intent == "ai_credit":
+        return ai_credit_reply(member.mention, member.id)
+    if intent == "quota":
+        return quota_status_reply(member, member.id)
+    tone = get_tone_tier(member, member.guild) if isinstance(member, discord.Member) else "snarky"
+    return sunong_time_reply(member.mention, today_study_minutes(member.id), tone)
 
 
 # 429 시 봇이 보낼 안내 문구 (사용자에게 표시)
@@ -1001,17 +1383,200 @@ GEMINI_MODEL_FALLBACK = (
 )
 
 
+# ---------- Gemini 모델 상태 (서킷 브레이커) ----------
+# 404(없는 모델)는 오래, 429(한도 초과)는 Retry-After 동안(없으면 점점 길게), 그 외 오류는 잠깐 제외.
+# 제외 시간이 끝나면 요청 하나만 시험 삼아 보내 보고(half-open), 성공하면 다시 정상.
+GEMINI_404_COOLDOWN_SECONDS = 6 * 3600
+GEMINI_429_COOLDOWN_SECONDS = 30        # Retry-After 없을 때 첫 대기. 연속이면 두 배씩
+GEMINI_429_MAX_COOLDOWN_SECONDS = 15 * 60
+GEMINI_ERROR_COOLDOWN_SECONDS = 15      # 5xx·네트워크 오류·시간 초과
+
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+# 답변을 조각으로 받아 바로 보여주기 (streamGenerateContent). 끄면 다 만들어진 뒤 한 번에
+GEMINI_STREAMING = True
+GEMINI_STREAM_EDIT_INTERVAL_SECONDS = 1.2   # 스트리밍 중 메시지 수정 간격 (채널당 5초 5회 한도 아래로)
+GEMINI_STREAM_TOTAL_TIMEOUT_SECONDS = 60.0  # 스트리밍 전체 최대 시간 (긴 답변은 25초 넘게 걸림)
+
+# 헤지(hedge) 요청: 첫 모델이 평소 응답 시간(최근 성공의 GEMINI_HEDGE_PERCENTILE 분위)을 넘기면 다음 모델에도 같이 보내고 먼저 온 답을 씀
+GEMINI_HEDGE_ENABLED = True
+GEMINI_HEDGE_PERCENTILE = 0.9
+GEMINI_HEDGE_MIN_DELAY_SECONDS = 0.5
+GEMINI_HEDGE_MAX_DELAY_SECONDS = 8.0
+GEMINI_HEDGE_DEFAULT_DELAY_SECONDS = 4.0  # 응답 시간 기록이 적을 때
+GEMINI_HEDGE_MIN_SAMPLES = 10
+# 모델 하나에 주는 최대 시간 (넘으면 그 모델은 실패 처리, 다른 모델은 계속)
+GEMINI_MODEL_TIMEOUT_SECONDS = 12.0
+# 전체 답변 최대 시간
+GEMINI_TOTAL_TIMEOUT_SECONDS = 25.0
+# 응답 시간 통계에 쓰는 최근 개수
+GEMINI_LATENCY_SAMPLES = 200
+
+
+def latency_percentile(samples, q: float) -> float | None:
+    """samples(초)의 q 분위 값 (표본 없으면 None)"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class GeminiModelHealth:
+    """모델별 최근 결과 기록. order()로 지금 시도할 모델 순서를 정함 (마지막 성공 모델 먼저, 제외 중인 모델은 뺌)."""
+
+    def __init__(self) -> None:
+        # 모델 -> {"open_until", "reason", "failures", "rate_limit_streak", "successes", "last_ok", "probing"}
+        self._models: dict[str, dict] = {}
+        self.last_good: str | None = None
+
+    def _entry(self, model: str) -> dict:
+        entry = self._models.get(model)
+        if entry is None:
+            entry = {
+                "open_until": 0.0, "reason": None, "failures": 0, "rate_limit_streak": 0, "successes": 0,
+                "last_ok": None, "probing": False,
+                "latencies": deque(maxlen=GEMINI_LATENCY_SAMPLES),
+            }
+            self._models[model] = entry
+        return entry
+
+    def order(self, models: list[str]) -> list[str]:
+        """시도할 모델 순서. 제외 시간이 끝난 모델은 다른 요청이 시험 중이 아닐 때만 포함."""
+        now = time.time()
+        ready = []
+        for model in models:
+            entry = self._models.get(model)
+            if entry is None or entry["reason"] is None:
+                ready.append(model)
+            elif entry["open_until"] <= now and not entry["probing"]:
+                ready.append(model)
+        if self.last_good in ready:
+            ready.remove(self.last_good)
+            ready.insert(0, self.last_good)
+        return ready
+
+    def begin(self, model: str) -> None:
+        entry = self._entry(model)
+        if entry["reason"] is not None:
+            entry["probing"] = True
+
+    def success(self, model: str, latency: float | None = None) -> None:
+        entry = self._entry(model)
+        entry.update(
+            open_until=0.0, reason=None, failures=0, rate_limit_streak=0, probing=False, last_ok=time.time(),
+        )
+        entry["successes"] += 1
+        if latency is not None:
+            entry["latencies"].append(latency)
+        self.last_good = model
+
+    def hedge_delay(self, model: str) -> float:
+        """이 모델 응답을 이만큼(초) 기다려도 안 오면 다음 모델에 헤지 요청"""
+        entry = self._models.get(model)
+        samples = entry["latencies"] if entry else ()
+        if len(samples) < GEMINI_HEDGE_MIN_SAMPLES:
+            # 막 1순위가 된 모델은 기록이 적음 → 같은 API의 다른 모델 기록을 합쳐서 씀 (그것도 적으면 기본값)
+            samples = [latency for entry in self._models.values() for latency in entry["latencies"]]
+            if len(samples) < GEMINI_HEDGE_MIN_SAMPLES:
+                return GEMINI_HEDGE_DEFAULT_DELAY_SECONDS
+        delay = latency_percentile(samples, GEMINI_HEDGE_PERCENTILE)
+        return min(max(delay, GEMINI_HEDGE_MIN_DELAY_SECONDS), GEMINI_HEDGE_MAX_DELAY_SECONDS)
+
+    def failure(self, model: str, status: int | None, retry_after: float | None = None) -> None:
+        entry = self._entry(model)
+        entry["failures"] += 1
+        entry["probing"] = False
+        if status == 404:
+            cooldown = GEMINI_404_COOLDOWN_SECONDS
+        elif status == 429:
+            # 성공 없이 연달아 받은 429 횟수 (다른 오류는 안 셈) → Retry-After 없을 때 제외 시간 두 배씩
+            entry["rate_limit_streak"] += 1
+            if retry_after is not None:
+                cooldown = retry_after
+            else:
+                streak = min(entry["rate_limit_streak"] - 1, 10)
+                cooldown = min(GEMINI_429_COOLDOWN_SECONDS * 2 ** streak, GEMINI_429_MAX_COOLDOWN_SECONDS)
+        else:
+            cooldown = GEMINI_ERROR_COOLDOWN_SECONDS
+        entry["reason"] = str(status) if status else "error"
+        entry["open_until"] = time.time() + cooldown
+        if self.last_good == model:
+            self.last_good = None
+
+    def release(self, model: str) -> None:
+        """시험 요청이 결과 없이 끝났을 때 (예: 빈 답변) 다음 요청이 다시 시험할 수 있게"""
+        entry = self._models.get(model)
+        if entry is not None:
+            entry["probing"] = False
+
+    def snapshot(self) -> list[tuple[str, dict]]:
+        return sorted(self._models.items())
+
+
+gemini_health = GeminiModelHealth()
+# get_gemini_reply 전체 소요 시간 (초, 실패 포함). !모델상태 에서 p50/p99 표시
+gemini_reply_latencies: deque = deque(maxlen=GEMINI_LATENCY_SAMPLES)
+
+
+def _gemini_retry_after(resp: aiohttp.ClientResponse, data: dict | None) -> float | None:
+    """429 응답에서 다시 시도할 때까지 초. Retry-After 헤더 → 본문 RetryInfo.retryDelay("13s") 순."""
+    header = resp.headers.get("Retry-After")
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            pass
+    for detail in ((data or {}).get("error") or {}).get("details") or []:
+        delay = detail.get("retryDelay") if isinstance(detail, dict) else None
+        if isinstance(delay, str) and delay.endswith("s"):
+            try:
+                return max(0.0, float(delay[:-1]))
+            except ValueError:
+                pass
+    return None
+
+
+# ---------- 공용 HTTP 세션 (Gemini·첨부 이미지·self-ping) ----------
+# 요청마다 세션을 새로 만들면 DNS·TCP·TLS 연결을 매번 다시 맺음 → 하나를 계속 써서 연결 재사용
+HTTP_POOL_LIMIT = 32           # 전체 동시 연결 수
+HTTP_POOL_LIMIT_PER_HOST = 8   # 호스트당 동시 연결 수 (Gemini API 포함)
+HTTP_KEEPALIVE_SECONDS = 60    # 쉬는 연결 유지 시간
+HTTP_DNS_CACHE_SECONDS = 300
+HTTP_TIMEOUT = aiohttp.ClientTimeout(total=30, sock_connect=10)
+
+_http_session: aiohttp.ClientSession | None = None
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """봇 전체가 같이 쓰는 HTTP 세션 (setup_hook에서 만들고 종료 시 닫음). 아직 없으면 여기서 만듦."""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+            ttl_dns_cache=HTTP_DNS_CACHE_SECONDS,
+        )
+        _http_session = aiohttp.ClientSession(connector=connector, timeout=HTTP_TIMEOUT)
+    return _http_session
+
+
+async def close_http_session() -> None:
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+
 async def _fetch_available_gemini_models() -> list:
     """v1beta/models 로 사용 가능한 모델 목록 조회. generateContent 지원하는 것만, 이름 순."""
     if not (GEMINI_API_KEY and GEMINI_API_KEY.strip()):
         return []
-    url = f"https://generativelanguage.googleapis.com/v1beta/models?key={GEMINI_API_KEY}"
+    url = f"{GEMINI_API_BASE}/models?key={GEMINI_API_KEY}"
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status != 200:
-                    return []
-                data = await resp.json()
+        async with get_http_session().get(url) as resp:
+            if resp.status != 200:
+                return []
+            data = await resp.json()
     except Exception as e:
         print(f"[WARN] Gemini 모델 목록 조회 실패: {e}")
         return []
@@ -1026,20 +1591,139 @@ async def _fetch_available_gemini_models() -> list:
     return sorted(out)
 
 
+# 공부 레벨 / 서버 주인에 따른 AI 말투 단계 → 프롬프트에 붙이는 말투 지시
+GEMINI_TONE_INSTRUCTIONS = {
+    "owner": "\n\n[말투 조절 — 반드시 적용]\n이 사용자는 이 서버의 **서버 주인**이다. 서버 주인을 신처럼 모시는 말투로. '~하옵니다', '~하옵소서', '감사하옵나이다', '모시어 드리겠나이다' 같은 격식·존경을 다한 표현을 쓰고, 충성을 다하는 느낌으로 조언을 전달하라.",
+    "lv91": "\n\n[말투 조절]\n이 사용자의 공부 레벨이 91 이상이다. 완전히 친절하고 따뜻하게. 격려와 응원을 잔뜩 담아서, 꼽주지 말고 진심으로 다정하게 말하라.",
+    "lv71": "\n\n[말투 조절]\n이 사용자의 공부 레벨이 71~90이다. 아주 친절하고 격려하듯이 말하라. 데레 쪽을 크게 보여라.",
+    "lv51": "\n\n[말투 조절]\n이 사용자의 공부 레벨이 51~70이다. 친절하고 부드럽게. 격려를 담아 말하라.",
+    "lv31": "\n\n[말투 조절]\n이 사용자의 공부 레벨이 31~50이다. 말투를 부드럽고 친절하게. 꼽주지 말고 잘해 주는 느낌으로.",
+    "lv16": "\n\n[말투 조절]\n이 사용자의 공부 레벨이 16~30이다. 기본 츤데레보다 부드럽게. 데레를 조금 더 보여라.",
+    "lv6": "\n\n[말투 조절]\n이 사용자의 공부 레벨이 6~15이다. 기존 츤데레보다 조금 부드럽게. 띠꺼움을 줄이고 꼽주되 너무 심하지 않게.",
+    "lv1": "\n\n[말투 조절]\n이 사용자의 공부 레벨이 1~5이다. 기존처럼 아주 띠꺼운/층데레 말투 유지해도 됨.",
+}
+
+
+def gemini_tone_tier(study_level: int, is_owner: bool) -> str:
+    """AI 말투 단계 (GEMINI_TONE_INSTRUCTIONS 키)"""
+    if is_owner:
+        return "owner"
+    for floor in (91, 71, 51, 31, 16, 6):
+        if study_level >= floor:
+            return f"lv{floor}"
+    return "lv1"
+
+
+def gemini_system_text(tone_tier: str) -> str:
+    """말투 단계별 고정 시스템 프롬프트 (systemInstruction / 캐시 내용)"""
+    return AI_CHANNEL_SYSTEM_PROMPT + GEMINI_TONE_INSTRUCTIONS[tone_tier]
+
+
+# ---------- Gemini 프롬프트 캐시 (cachedContents) ----------
+# 말투 단계별 시스템 프롬프트를 (모델, 말투 단계)마다 한 번 cachedContents로 만들어 두고 요청엔 캐시 이름만 보냄.
+# 모델이 캐시를 지원 안 하거나 프롬프트가 최소 토큰 수보다 짧아 만들기 실패하면 한동안 systemInstruction으로 보냄.
+GEMINI_PROMPT_CACHE = os.getenv("GEMINI_PROMPT_CACHE", "1") != "0"
+GEMINI_PROMPT_CACHE_TTL_SECONDS = 3600
+GEMINI_PROMPT_CACHE_RETRY_SECONDS = 6 * 3600  # 만들기 실패 후 다시 시도하기까지
+
+
+class GeminiPromptCache:
+    """(모델, 말투 단계) -> cachedContents 이름. 없으면 백그라운드에서 만들고 이번 요청은 systemInstruction으로."""
+
+    def __init__(self) -> None:
+        self._names: dict[tuple[str, str], tuple[float, str]] = {}  # -> (만료 시각, 캐시 이름)
+        self._unsupported: dict[tuple[str, str], float] = {}        # -> 다시 시도할 시각
+        self._creating: set[tuple[str, str]] = set()
+        self._tasks: set[asyncio.Task] = set()  # 만드는 중인 작업 참조 (GC로 중간에 사라지지 않게)
+        self.created = 0
+        self.used = 0
+        self.failures = 0
+
+    def get(self, model_name: str, tone_tier: str) -> str | None:
+        if not GEMINI_PROMPT_CACHE:
+            return None
+        key = (model_name, tone_tier)
+        now = time.time()
+        entry = self._names.get(key)
+        if entry is not None and entry[0] > now:
+            self.used += 1
+            return entry[1]
+        if key not in self._creating and self._unsupported.get(key, 0.0) <= now:
+            self._creating.add(key)
+            task = asyncio.create_task(self._create(key))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return None
+
+    def rejected(self, model_name: str, tone_tier: str, status: int, error_text: str = "") -> bool:
+        """캐시를 붙인 요청이 실패함. 캐시 문제(만료·삭제·권한)로 보이면 버리고 True → 호출한 쪽이 systemInstruction으로 재시도.
+        400·404는 요청 자체(이미지·대화 기록)나 모델 문제(없는 모델)일 때가 많아서 오류 본문이 캐시("cachedContents/…",
+        "Cached content …")를 가리킬 때만 캐시 탓으로 봄 (잘못된 요청 하나로 같은 말투 단계 전체의 캐시가 꺼지지 않게)."""
+        names_cache = "cachedcontent" in error_text.lower().replace(" ", "")
+        if status != 403 and not (status in (400, 404) and names_cache):
+            return False
+        key = (model_name, tone_tier)
+        self._names.pop(key, None)
+        self._unsupported[key] = time.time() + GEMINI_PROMPT_CACHE_RETRY_SECONDS
+        return True
+
+    async def _create(self, key: tuple[str, str]) -> None:
+        model_name, tone_tier = key
+        body = {
+            "model": f"models/{model_name}",
+            "systemInstruction": {"parts": [{"text": gemini_system_text(tone_tier)}]},
+            "ttl": f"{GEMINI_PROMPT_CACHE_TTL_SECONDS}s",
+        }
+        headers = {"Content-Type": "application/json", "x-goog-api-key": GEMINI_API_KEY}
+        name = None
+        try:
+            async with get_http_session().post(f"{GEMINI_API_BASE}/cachedContents", headers=headers, json=body) as resp:
+                if resp.status == 200:
+                    name = (await resp.json(content_type=None)).get("name")
+                else:
+                    text = await resp.text()
+                    print(f"[WARN] Gemini 프롬프트 캐시 생성 실패 {model_name}/{tone_tier} {resp.status}: {text[:200]}")
+        except Exception as e:
+            print(f"[WARN] Gemini 프롬프트 캐시 생성 오류: {e}")
+        finally:
+            self._creating.discard(key)
+        if not name:
+            self.failures += 1
+            self._unsupported[key] = time.time() + GEMINI_PROMPT_CACHE_RETRY_SECONDS
+            return
+        self.created += 1
+        # 만료 직전 요청이 캐시 없음으로 실패하지 않도록 조금 일찍 버림
+        self._names[key] = (time.time() + GEMINI_PROMPT_CACHE_TTL_SECONDS - 60, name)
+
+    def stats(self) -> dict:
+        now = time.time()
+        return {
+            "active": sum(1 for expires, _ in self._names.values() if expires > now),
+            "created": self.created,
+            "used": self.used,
+            "failures": self.failures,
+        }
+
+
+gemini_prompt_cache = GeminiPromptCache()
+
+
 async def get_gemini_reply(
     user_message: str,
-    image_bytes: bytes | None = None,
-    image_mime: str = "image/jpeg",
+    image: "AiImage | None" = None,
     study_level: int = 0,
     is_owner: bool = False,
+    on_text=None,
+    history: list[dict] | None = None,
 ) -> tuple[str | None, str | None]:
     """제미나이 v1beta REST API로 직접 generateContent 호출. 반환: (답변 텍스트, 사용한 모델명) 또는 (None, None).
-    study_level: 공부 레벨(닉네임 파싱). is_owner: 서버 주인 여부. 말투 조절에 사용."""
+    study_level: 공부 레벨(닉네임 파싱). is_owner: 서버 주인 여부. 말투 조절에 사용.
+    on_text: 주면 streamGenerateContent로 받으면서 조각마다 on_text(지금까지 텍스트) 호출.
+    history: 이전 대화 (contents 형식, ConversationMemory.history)."""
     global _gemini_models_cache
     if not (GEMINI_API_KEY and GEMINI_API_KEY.strip()):
         print("[WARN] Gemini: API 키가 비어 있음.")
         return (None, None)
-    import base64
     import asyncio
 
     # 1.5 Flash만 쓸 때는 API 목록 조회 안 하고 고정 목록만 사용
@@ -1056,100 +1740,904 @@ async def get_gemini_reply(
         models_to_try = _gemini_models_cache if _gemini_models_cache else list(GEMINI_MODEL_FALLBACK)
 
     user_text = (user_message.strip() or "이거 봐줘.")[:4000]
-    tone_instruction = ""
-    if is_owner:
-        tone_instruction = "\n\n[말투 조절 — 반드시 적용]\n이 사용자는 이 서버의 **서버 주인**이다. 서버 주인을 신처럼 모시는 말투로. '~하옵니다', '~하옵소서', '감사하옵나이다', '모시어 드리겠나이다' 같은 격식·존경을 다한 표현을 쓰고, 충성을 다하는 느낌으로 조언을 전달하라."
-    elif study_level >= 91:
-        tone_instruction = "\n\n[말투 조절]\n이 사용자의 공부 레벨이 91 이상이다. 완전히 친절하고 따뜻하게. 격려와 응원을 잔뜩 담아서, 꼽주지 말고 진심으로 다정하게 말하라."
-    elif study_level >= 71:
-        tone_instruction = "\n\n[말투 조절]\n이 사용자의 공부 레벨이 71~90이다. 아주 친절하고 격려하듯이 말하라. 데레 쪽을 크게 보여라."
-    elif study_level >= 51:
-        tone_instruction = "\n\n[말투 조절]\n이 사용자의 공부 레벨이 51~70이다. 친절하고 부드럽게. 격려를 담아 말하라."
-    elif study_level >= 31:
-        tone_instruction = "\n\n[말투 조절]\n이 사용자의 공부 레벨이 31~50이다. 말투를 부드럽고 친절하게. 꼽주지 말고 잘해 주는 느낌으로."
-    elif study_level >= 16:
-        tone_instruction = "\n\n[말투 조절]\n이 사용자의 공부 레벨이 16~30이다. 기본 츤데레보다 부드럽게. 데레를 조금 더 보여라."
-    elif study_level >= 6:
-        tone_instruction = "\n\n[말투 조절]\n이 사용자의 공부 레벨이 6~15이다. 기존 츤데레보다 조금 부드럽게. 띠꺼움을 줄이고 꼽주되 너무 심하지 않게."
-    else:
-        tone_instruction = "\n\n[말투 조절]\n이 사용자의 공부 레벨이 1~5이다. 기존처럼 아주 띠꺼운/층데레 말투 유지해도 됨."
-    full_prompt = f"[역할 지시]\n{AI_CHANNEL_SYSTEM_PROMPT}{tone_instruction}\n\n[사용자 말]\n{user_text}"
+    tone_tier = gemini_tone_tier(study_level, is_owner)
+    system_instruction = {"parts": [{"text": gemini_system_text(tone_tier)}]}
 
     parts = []
-    if image_bytes and len(image_bytes) < 20 * 1024 * 1024:
-        parts.append({
-            "inlineData": {
-                "mimeType": image_mime,
-                "data": base64.b64encode(image_bytes).decode("utf-8"),
-            }
-        })
-    parts.append({"text": full_prompt})
+    if image is not None:
+        # 작은 이미지는 prepare_image에서 만든 base64 그대로, 큰 이미지는 Files API URI
+        parts.append(await image_part(image))
+    parts.append({"text": user_text})
 
-    body = {
-        "contents": [{"parts": parts}],
+    base_body = {
+        "contents": [*(history or ()), {"role": "user", "parts": parts}],
         "generationConfig": {"maxOutputTokens": 1500},
     }
+
+    def _body_for(model_name: str) -> tuple[dict, str | None]:
+        """고정 프롬프트는 모델별 캐시가 있으면 캐시 이름만, 없으면 systemInstruction으로 (사용자 말과 분리)"""
+        cache_name = gemini_prompt_cache.get(model_name, tone_tier)
+        if cache_name:
+            return {**base_body, "cachedContent": cache_name}, cache_name
+        return {**base_body, "systemInstruction": system_instruction}, None
+
     headers = {"Content-Type": "application/json", "x-goog-api-key": GEMINI_API_KEY}
 
-    async def _fetch():
-        async with aiohttp.ClientSession() as session:
-            for model_name in models_to_try:
-                url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent"
+    session = get_http_session()
+    streaming = GEMINI_STREAMING and on_text is not None
+    # 스트리밍: 헤지 중 여러 모델 중 처음 조각을 보낸 모델만 화면에 씀 (그 모델이 실패하면 다음 모델이 이어받음)
+    stream_owner: list[str | None] = [None]
+    stream_claimed = asyncio.Event()
+
+    async def _handle_error(model_name: str, resp: aiohttp.ClientResponse) -> None:
+        if resp.status == 429:
+            try:
+                data = await resp.json(content_type=None)
+            except Exception:
+                data = None
+            gemini_health.failure(model_name, 429, _gemini_retry_after(resp, data))
+            print(f"[WARN] Gemini {model_name} 한도 초과(429), 다음 모델 시도")
+        elif resp.status == 404:
+            gemini_health.failure(model_name, 404)
+            print(f"[WARN] Gemini {model_name} 없음(404), 다음 모델 시도")
+        else:
+            text = await resp.text()
+            gemini_health.failure(model_name, resp.status)
+            print(f"[WARN] Gemini REST {model_name} {resp.status}: {text[:300]}")
+
+    async def _request(model_name: str, started: float):
+        url = f"{GEMINI_API_BASE}/models/{model_name}:generateContent"
+        while True:
+            body, cache_name = _body_for(model_name)
+            async with session.post(url, headers=headers, json=body) as resp:
+                if resp.status != 200:
+                    if cache_name and gemini_prompt_cache.rejected(
+                        model_name, tone_tier, resp.status, await resp.text(),
+                    ):
+                        continue  # 캐시 만료·삭제 → systemInstruction으로 한 번 더
+                    await _handle_error(model_name, resp)
+                    return None
+                data = await resp.json()
+                gemini_health.success(model_name, time.monotonic() - started)
+                text = _gemini_candidate_text(data).strip()
+                if text:
+                    print(f"[Gemini] 답변 생성됨 — 사용 모델: {model_name}")
+                    return (text, model_name)
+            return None
+
+    async def _request_stream(model_name: str, started: float):
+        """streamGenerateContent(SSE)로 받으면서 조각마다 on_text(지금까지 전체 텍스트) 호출"""
+        url = f"{GEMINI_API_BASE}/models/{model_name}:streamGenerateContent?alt=sse"
+        timeout = aiohttp.ClientTimeout(total=GEMINI_STREAM_TOTAL_TIMEOUT_SECONDS, sock_read=GEMINI_MODEL_TIMEOUT_SECONDS)
+        text = ""
+        display_ok = True
+        body, cache_name = _body_for(model_name)
+        resp = await session.post(url, headers=headers, json=body, timeout=timeout)
+        if resp.status != 200 and cache_name and gemini_prompt_cache.rejected(
+            model_name, tone_tier, resp.status, await resp.text(),
+        ):
+            resp.release()  # 캐시 만료·삭제 → systemInstruction으로 한 번 더
+            body, _ = _body_for(model_name)
+            resp = await session.post(url, headers=headers, json=body, timeout=timeout)
+        async with resp:
+            if resp.status != 200:
+                await _handle_error(model_name, resp)
+                return None
+            async for raw in resp.content:
+                line = raw.decode("utf-8", "replace").strip()
+                if not line.startswith("data:"):
+                    continue
                 try:
-                    async with session.post(url, headers=headers, json=body) as resp:
-                        if resp.status == 200:
-                            data = await resp.json()
-                            cands = data.get("candidates") or []
-                            if not cands:
-                                continue
-                            content = cands[0].get("content") or {}
-                            part_list = content.get("parts") or []
-                            if not part_list:
-                                continue
-                            text = (part_list[0].get("text") or "").strip()[:2000]
-                            if text:
-                                print(f"[Gemini] 답변 생성됨 — 사용 모델: {model_name}")
-                                return (text, model_name)
-                        elif resp.status == 429:
-                            print(f"[WARN] Gemini {model_name} 한도 초과(429), 다음 모델 시도")
-                            continue
-                        elif resp.status == 404:
-                            print(f"[WARN] Gemini {model_name} 없음(404), 다음 모델 시도")
-                            continue
-                        else:
-                            text = await resp.text()
-                            print(f"[WARN] Gemini REST {model_name} {resp.status}: {text[:300]}")
-                            continue
-                except Exception as e:
-                    print(f"[WARN] Gemini {model_name} 요청 오류: {e}")
+                    piece = _gemini_candidate_text(json.loads(line[5:]))
+                except ValueError:
+                    continue
+                if not piece:
+                    continue
+                if not text:
+                    gemini_health.success(model_name, time.monotonic() - started)  # 첫 조각까지 시간 = 헤지 기준
+                    if stream_owner[0] is None:
+                        stream_owner[0] = model_name
+                        stream_claimed.set()
+                if stream_owner[0] != model_name:
+                    return None  # 다른 모델이 먼저 화면을 차지함
+                text += piece
+                if display_ok:
+                    try:
+                        await on_text(text)
+                    except Exception as e:
+                        # 디스코드 쪽 오류(권한·한도)는 모델 실패가 아님 → 화면 갱신만 멈추고 답변은 끝까지 받음
+                        display_ok = False
+                        print(f"[WARN] 스트리밍 답변 표시 실패, 끝까지 받은 뒤 한 번에 보냄: {e}")
+        text = text.strip()
+        if text:
+            print(f"[Gemini] 답변 생성됨(스트리밍) — 사용 모델: {model_name}")
+            return (text, model_name)
+        return None
+
+    async def _try_model(model_name: str):
+        """모델 하나에 요청 (모델별 시간 제한, 스트리밍은 조각 사이 간격 제한). 헤지에서 져서 취소되면 실패로 치지 않음."""
+        gemini_health.begin(model_name)
+        started = time.monotonic()
+        try:
+            if streaming:
+                return await _request_stream(model_name, started)
+            return await asyncio.wait_for(_request(model_name, started), timeout=GEMINI_MODEL_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            gemini_health.failure(model_name, None)
+            print(f"[WARN] Gemini {model_name} 응답 시간 초과({GEMINI_MODEL_TIMEOUT_SECONDS:.0f}초), 다음 모델 시도")
+        except Exception as e:
+            gemini_health.failure(model_name, None)
+            print(f"[WARN] Gemini {model_name} 요청 오류: {e}")
+        finally:
+            gemini_health.release(model_name)
+            if stream_owner[0] == model_name:
+                # 화면을 차지했던 모델이 끝남 → 실패였으면 다음 모델이 다시 차지할 수 있게
+                stream_owner[0] = None
+                stream_claimed.clear()
+        return None
+
+    async def _fetch():
+        candidates = gemini_health.order(models_to_try)
+        if not candidates:
+            print("[WARN] Gemini: 모든 모델이 잠시 제외 중 (!모델상태 로 확인)")
+        pending: dict[asyncio.Task, str] = {}
+        next_index = 0
+        claim_waiter: asyncio.Task | None = None
+
+        def launch() -> None:
+            nonlocal next_index
+            model_name = candidates[next_index]
+            next_index += 1
+            pending[asyncio.create_task(_try_model(model_name))] = model_name
+
+        try:
+            while pending or next_index < len(candidates):
+                if not pending:
+                    launch()
+                # 가장 먼저 보낸 모델 기준으로 헤지 대기 시간 (더 보낼 모델이 없거나 스트리밍이 시작됐으면 그냥 기다림)
+                hedge_delay = None
+                if GEMINI_HEDGE_ENABLED and next_index < len(candidates) and not stream_claimed.is_set():
+                    hedge_delay = gemini_health.hedge_delay(next(iter(pending.values())))
+                waiting = set(pending)
+                if streaming and not stream_claimed.is_set():
+                    if claim_waiter is None or claim_waiter.done():
+                        claim_waiter = asyncio.create_task(stream_claimed.wait())
+                    waiting.add(claim_waiter)
+                done, _ = await asyncio.wait(waiting, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    print(f"[Gemini] {hedge_delay:.1f}초 지나도 답이 없어 {candidates[next_index]} 에도 요청")
+                    launch()
                     continue
+                if claim_waiter in done:
+                    # 스트리밍 시작 → 화면 차지한 모델만 남기고 나머지 헤지 요청 취소
+                    owner = stream_owner[0]
+                    for task, model_name in list(pending.items()):
+                        if model_name != owner and task not in done:
+                            task.cancel()
+                            pending.pop(task)
+                failed = False
+                for task in done:
+                    if task is claim_waiter or task not in pending:
+                        continue
+                    pending.pop(task)
+                    result = task.result()
+                    if result:
+                        return result
+                    failed = True
+                if failed and pending and next_index < len(candidates) and not stream_claimed.is_set():
+                    # 보낸 요청 하나가 실패(404 등 바로 끝남)하면 헤지 시간을 또 기다리지 않고 다음 모델 바로 시작
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+            if claim_waiter is not None:
+                claim_waiter.cancel()
         return (None, None)
 
+    started = time.monotonic()
+    total_timeout = GEMINI_STREAM_TOTAL_TIMEOUT_SECONDS if streaming else GEMINI_TOTAL_TIMEOUT_SECONDS
     try:
-        return await asyncio.wait_for(_fetch(), timeout=25.0)
+        result = await asyncio.wait_for(_fetch(), timeout=total_timeout)
     except asyncio.TimeoutError:
-        print("[WARN] Gemini 응답 시간 초과(25초)")
-        return (None, None)
+        print(f"[WARN] Gemini 응답 시간 초과({total_timeout:.0f}초)")
+        result = (None, None)
     except Exception as e:
         print(f"[WARN] Gemini REST 오류: {e}")
-        return (None, None)
+        result = (None, None)
+    gemini_reply_latencies.append(time.monotonic() - started)
+    return result
+
+
+def _gemini_candidate_text(data: dict) -> str:
+    """generateContent 응답(또는 스트리밍 조각)에서 첫 후보의 텍스트"""
+    cands = data.get("candidates") or []
+    if not cands:
+        return ""
+    part_list = (cands[0].get("content") or {}).get("parts") or []
+    return "".join(part.get("text") or "" for part in part_list)
+
+
+class StreamingReply:
+    """스트리밍 답변을 디스코드 메시지로 보여주기. 첫 조각은 바로 보내고, 이후는 GEMINI_STREAM_EDIT_INTERVAL_SECONDS 간격으로
+    메시지 수정(디스코드 수정 한도 고려). 2000자를 넘으면 잘라내지 않고 다음 메시지로 이어서 보냄."""
+
+    def __init__(self, channel: discord.abc.Messageable) -> None:
+        self.channel = channel
+        self.messages: list[discord.Message] = []
+        self._shown: list[str] = []
+        self._latest = ""
+        self._last_sync = 0.0
+        self._flush_task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+        self.created_at = time.monotonic()
+        self.first_visible_at: float | None = None
+
+    async def update(self, text: str) -> None:
+        self._latest = text
+        if not self.messages:
+            await self._sync()
+            return
+        if self._flush_task is None or self._flush_task.done():
+            delay = max(0.0, self._last_sync + GEMINI_STREAM_EDIT_INTERVAL_SECONDS - time.monotonic())
+            self._flush_task = asyncio.create_task(self._flush_later(delay))
 
+    async def _flush_later(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        try:
+            await self._sync()
+        except Exception as e:
+            print(f"[WARN] 스트리밍 답변 수정 실패: {e}")
+
+    async def _sync(self) -> None:
+        async with self._lock:
+            chunks = split_notice_lines(self._latest.split("\n")) if self._latest.strip() else []
+            for i, chunk in enumerate(chunks):
+                if i < len(self.messages):
+                    if self._shown[i] != chunk:
+                        await self.messages[i].edit(content=chunk)
+                        self._shown[i] = chunk
+                else:
+                    self.messages.append(await self.channel.send(chunk))
+                    self._shown.append(chunk)
+                    if self.first_visible_at is None:
+                        self.first_visible_at = time.monotonic()
+            # 텍스트가 짧아짐 (다른 모델이 이어받음 등) → 남는 뒤쪽 메시지 지움
+            while len(self.messages) > len(chunks):
+                extra = self.messages.pop()
+                self._shown.pop()
+                try:
+                    await extra.delete()
+                except discord.HTTPException:
+                    pass
+            self._last_sync = time.monotonic()
+
+    async def finish(self, text: str) -> None:
+        """마지막 전체 텍스트로 맞춤 (남은 수정 바로 반영)"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        self._latest = text
+        await self._sync()
+
+    async def abort(self, text: str = "") -> None:
+        """답변이 끝내 안 옴: 중간까지 보여 준 메시지를 text 하나로 바꾸고 나머지는 지움 (text가 비면 전부 지움)"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        self._latest = text
+        await self._sync()
+
+
+# ---------- AI 채널 이미지 처리 ----------
+# 다운로드는 조금씩 받으면서 크기 제한 넘으면 바로 중단, 줄이기·JPEG 재인코딩·base64·해시는 스레드 풀에서 (이벤트 루프 안 막음)
+IMAGE_MAX_DOWNLOAD_BYTES = 8 * 1024 * 1024
+IMAGE_MAX_SIDE = 1536          # 긴 변 최대 픽셀 (Gemini 입력에 충분)
+IMAGE_JPEG_QUALITY = 85
+IMAGE_DOWNLOAD_CHUNK_BYTES = 64 * 1024
+# 이보다 큰 이미지는 base64로 본문에 넣지 않고 Files API로 한 번 올린 뒤 URI로 참조 (base64는 크기 1/3 증가 + 사본 여러 개)
+GEMINI_INLINE_IMAGE_MAX_BYTES = 512 * 1024
+_image_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image")
+
+
+class AiImage:
+    """Gemini에 보낼 준비가 끝난 이미지 (digest = 원본 내용 sha256, 캐시 키용).
+    b64는 본문에 바로 넣을 작은 이미지만 (큰 이미지는 Files API로 올리고 URI로 참조 → None)."""
+
+    __slots__ = ("data", "mime", "b64", "digest")
+
+    def __init__(self, data: bytes, mime: str, b64: str | None, digest: str) -> None:
+        self.data = data
+        self.mime = mime
+        self.b64 = b64
+        self.digest = digest
+
+
+def image_download_url(attachment: discord.Attachment) -> str:
+    """크기를 알고 IMAGE_MAX_SIDE보다 크면 디스코드 미디어 프록시가 줄여 주는 URL, 아니면 원본 URL"""
+    width, height = attachment.width or 0, attachment.height or 0
+    if attachment.proxy_url and max(width, height) > IMAGE_MAX_SIDE:
+        scale = IMAGE_MAX_SIDE / max(width, height)
+        sep = "&" if "?" in attachment.proxy_url else "?"
+        return f"{attachment.proxy_url}{sep}width={max(1, int(width * scale))}&height={max(1, int(height * scale))}"
+    return attachment.url
+
+
+async def download_image(url: str) -> bytes | None:
+    """조금씩 받으면서 IMAGE_MAX_DOWNLOAD_BYTES 넘으면 중단 (None). Content-Length가 이미 넘으면 받지도 않음."""
+    max_bytes = IMAGE_MAX_DOWNLOAD_BYTES
+    async with get_http_session().get(url) as resp:
+        if resp.status != 200:
+            return None
+        if resp.content_length is not None and resp.content_length > max_bytes:
+            return None
+        buf = bytearray()
+        async for chunk in resp.content.iter_chunked(IMAGE_DOWNLOAD_CHUNK_BYTES):
+            buf += chunk
+            if len(buf) > max_bytes:
+                return None
+    return bytes(buf)
+
+
+def _encode_image(data: bytes, mime: str) -> AiImage:
+    """(스레드 풀에서 실행) 필요하면 줄이고 JPEG로 다시 저장, base64·sha256 계산"""
+    digest = hashlib.sha256(data).hexdigest()
+    if PIL_AVAILABLE:
+        try:
+            with Image.open(io.BytesIO(data)) as img:
+                if max(img.size) > IMAGE_MAX_SIDE or mime not in ("image/jpeg", "image/png", "image/webp"):
+                    img = ImageOps.exif_transpose(img)
+                    img.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+                    out = io.BytesIO()
+                    img.convert("RGB").save(out, format="JPEG", quality=IMAGE_JPEG_QUALITY)
+                    data, mime = out.getvalue(), "image/jpeg"
+        except Exception as e:
+            print(f"[WARN] 이미지 줄이기 실패 (원본 그대로 보냄): {e}")
+    b64 = base64.b64encode(data).decode("ascii") if len(data) <= GEMINI_INLINE_IMAGE_MAX_BYTES else None
+    return AiImage(data, mime, b64, digest)
+
+
+async def prepare_image(attachment: discord.Attachment) -> AiImage | None:
+    """첨부 이미지 → Gemini에 보낼 AiImage. 너무 크거나 실패하면 None (텍스트만으로 답변)"""
+    url = image_download_url(attachment)
+    if url == attachment.url and attachment.size > IMAGE_MAX_DOWNLOAD_BYTES:
+        print(f"[WARN] 이미지가 너무 큼 ({attachment.size // 1024}KB), 텍스트만 보냄")
+        return None
+    try:
+        data = await download_image(url)
+    except Exception as e:
+        print(f"[WARN] 이미지 다운로드 실패: {e}")
+        return None
+    if data is None:
+        print(f"[WARN] 이미지 다운로드 실패 또는 {IMAGE_MAX_DOWNLOAD_BYTES // (1024 * 1024)}MB 초과")
+        return None
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_image_executor, _encode_image, data, attachment.content_type or "image/jpeg")
+
+
+# ---------- Gemini Files API (큰 이미지 업로드) ----------
+# 재개 가능(resumable) 업로드로 올리고 받은 URI를 내용 해시별로 기억 → 같은 이미지는 다시 안 올림.
+# 올린 파일은 구글 쪽에서 48시간 뒤 삭제되므로 그보다 조금 일찍 만료 처리.
+GEMINI_UPLOAD_BASE = "https://generativelanguage.googleapis.com/upload/v1beta"
+GEMINI_FILE_TTL_SECONDS = 47 * 3600
+GEMINI_FILE_CACHE_MAX_ENTRIES = 1000
+
+
+class GeminiFileCache:
+    """이미지 sha256 -> 업로드된 파일 URI. 같은 이미지를 동시에 올리려 하면 한 번만 올리고 결과를 같이 씀."""
+
+    def __init__(self) -> None:
+        self._files: OrderedDict[str, tuple[float, str]] = OrderedDict()  # digest -> (만료 시각, URI)
+        self._uploading: dict[str, asyncio.Future] = {}
+        self.uploads = 0
+        self.reused = 0
+        self.failures = 0
+
+    async def uri_for(self, image: AiImage) -> str | None:
+        entry = self._files.get(image.digest)
+        if entry is not None and entry[0] > time.time():
+            self._files.move_to_end(image.digest)
+            self.reused += 1
+            return entry[1]
+        future = self._uploading.get(image.digest)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self._uploading[image.digest] = future
+        uri = None
+        try:
+            uri = await self._upload(image)
+        except Exception as e:
+            print(f"[WARN] Gemini 파일 업로드 오류: {e}")
+        finally:
+            del self._uploading[image.digest]
+            future.set_result(uri)
+        if uri is None:
+            self.failures += 1
+            return None
+        self.uploads += 1
+        self._files[image.digest] = (time.time() + GEMINI_FILE_TTL_SECONDS, uri)
+        while len(self._files) > GEMINI_FILE_CACHE_MAX_ENTRIES:
+            self._files.popitem(last=False)
+        return uri
+
+    async def _upload(self, image: AiImage) -> str | None:
+        """resumable 업로드: start 요청으로 업로드 URL 받고 → 본문 한 번에 올리고 finalize"""
+        session = get_http_session()
+        start_headers = {
+            "x-goog-api-key": GEMINI_API_KEY,
+            "X-Goog-Upload-Protocol": "resumable",
+            "X-Goog-Upload-Command": "start",
+            "X-Goog-Upload-Header-Content-Length": str(len(image.data)),
+            "X-Goog-Upload-Header-Content-Type": image.mime,
+        }
+        meta = {"file": {"display_name": f"discord-{image.digest[:16]}"}}
+        async with session.post(f"{GEMINI_UPLOAD_BASE}/files", headers=start_headers, json=meta) as resp:
+            upload_url = resp.headers.get("X-Goog-Upload-URL")
+            if resp.status != 200 or not upload_url:
+                print(f"[WARN] Gemini 파일 업로드 시작 실패: {resp.status}")
+                return None
+        upload_headers = {
+            "X-Goog-Upload-Offset": "0",
+            "X-Goog-Upload-Command": "upload, finalize",
+            "Content-Type": image.mime,
+        }
+        async with session.post(upload_url, headers=upload_headers, data=image.data) as resp:
+            if resp.status != 200:
+                print(f"[WARN] Gemini 파일 업로드 실패: {resp.status}")
+                return None
+            info = (await resp.json(content_type=None)).get("file") or {}
+        return info.get("uri")
+
+
+gemini_files = GeminiFileCache()
+
+
+async def image_part(image: AiImage) -> dict:
+    """요청 본문에 넣을 이미지 part. 작은 이미지는 inlineData, 큰 이미지는 업로드 후 fileData (업로드 실패 시 inline)."""
+    if image.b64 is None:
+        uri = await gemini_files.uri_for(image)
+        if uri:
+            return {"fileData": {"mimeType": image.mime, "fileUri": uri}}
+        loop = asyncio.get_running_loop()
+        image.b64 = await loop.run_in_executor(_image_executor, lambda: base64.b64encode(image.data).decode("ascii"))
+    return {"inlineData": {"mimeType": image.mime, "data": image.b64}}
+
+
+# ---------- 이벤트 루프 지연 측정 ----------
+# 주기적으로 잠들었다 깨어나는 시각이 예정보다 얼마나 늦었는지 = 루프를 막은 작업 시간
+LOOP_LAG_INTERVAL_SECONDS = 0.25
+loop_lag_samples: deque = deque(maxlen=240)  # 최근 약 1분
+_loop_lag_task: asyncio.Task | None = None
+
+
+async def monitor_loop_lag() -> None:
+    while True:
+        expected = time.perf_counter() + LOOP_LAG_INTERVAL_SECONDS
+        await asyncio.sleep(LOOP_LAG_INTERVAL_SECONDS)
+        loop_lag_samples.append(max(0.0, time.perf_counter() - expected))
+
+
+# ---------- AI 답변 캐시 ----------
+# 거의 같은 질문("집중 안 될 때 어떻게 해?")마다 Gemini를 부르지 않도록 (정규화한 질문, 말투 단계, 이미지 해시) 기준으로 답변 재사용.
+# 메모리 LRU + TTL, 선택적으로 상태 DB(SQLite)의 reply_cache 테이블에도 저장해 재시작 후에도 유지.
+REPLY_CACHE_MAX_ENTRIES = 500
+REPLY_CACHE_TTL_SECONDS = 6 * 3600
+REPLY_CACHE_DISK = os.getenv("REPLY_CACHE_DISK", "1") != "0"
+REPLY_CACHE_DISK_MAX_ENTRIES = 5000
+_REPLY_CACHE_STRIP = " \t\n?!.~…ㅠㅜ"
+
+
+def normalize_ai_question(text: str) -> str:
+    """캐시 키용 질문 정규화: 유니코드 정규화, 소문자, 공백 하나로, 앞뒤 물음표·마침표·ㅠㅠ 등 제거"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return " ".join(text.split()).strip(_REPLY_CACHE_STRIP)
+
+
+def reply_cache_key(text: str, tone_tier: str, image_digest: str | None) -> str:
+    raw = f"{tone_tier}\x00{normalize_ai_question(text)}\x00{image_digest or ''}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ReplyCache:
+    """AI 답변 캐시. 메모리(OrderedDict LRU, 항목별 만료 시각) → 없으면 디스크(SQLite) 순으로 찾음.
+    디스크 읽기/쓰기는 전용 스레드 하나에서만 (이벤트 루프는 기다리지 않음)."""
+
+    def __init__(self, path: str | None) -> None:
+        self.path = path
+        self._entries: OrderedDict[str, tuple[float, str, str]] = OrderedDict()  # key -> (만료 시각, 답변, 모델)
+        self._conn: sqlite3.Connection | None = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reply-cache") if path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS reply_cache ("
+                "key TEXT PRIMARY KEY, expires REAL NOT NULL, reply TEXT NOT NULL, model TEXT NOT NULL)"
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _disk_get(self, key: str) -> tuple | None:
+        return self._connect().execute(
+            "SELECT expires, reply, model FROM reply_cache WHERE key = ? AND expires > ?", (key, time.time()),
+        ).fetchone()
+
+    def _disk_put(self, key: str, expires: float, reply: str, model: str) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO reply_cache VALUES (?, ?, ?, ?)", (key, expires, reply, model))
+            conn.execute(
+                "DELETE FROM reply_cache WHERE expires <= ? OR key IN ("
+                "SELECT key FROM reply_cache ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+                (time.time(), REPLY_CACHE_DISK_MAX_ENTRIES),
+            )
+
+    def _disk_clear(self) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM reply_cache")
+
+    async def _run_disk(self, fn, *args):
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        except sqlite3.Error as e:
+            print(f"[WARN] 답변 캐시 DB 오류: {e}")
+            return None
+
+    def _remember(self, key: str, expires: float, reply: str, model: str) -> None:
+        self._entries[key] = (expires, reply, model)
+        self._entries.move_to_end(key)
+        while len(self._entries) > REPLY_CACHE_MAX_ENTRIES:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> tuple[str, str] | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1], entry[2]
+            del self._entries[key]
+        if self._executor is not None:
+            row = await self._run_disk(self._disk_get, key)
+            if row:
+                self._remember(key, *row)
+                self.hits += 1
+                self.disk_hits += 1
+                return row[1], row[2]
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, reply: str, model: str) -> None:
+        expires = time.time() + REPLY_CACHE_TTL_SECONDS
+        self._remember(key, expires, reply, model)
+        if self._executor is not None:
+            await self._run_disk(self._disk_put, key, expires, reply, model)
+
+    async def clear(self) -> int:
+        count = len(self._entries)
+        self._entries.clear()
+        if self._executor is not None:
+            await self._run_disk(self._disk_clear)
+        return count
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
 
-# ---------- 메시지 중복 처리 방지 (봇 여러 개 켜져 있을 때 / 이벤트 중복 시 한 번만 응답) ----------
-_DEDUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".bot_msg_locks")
-_processed_msg_in_memory: dict[int, float] = {}  # message_id -> 처리 시각 (같은 프로세스 내 중복 방지)
-_DEDUP_MEMORY_MAX_AGE = 5.0  # 초
-_DEDUP_FILE_MAX_AGE = 120    # 초 (파일 락 삭제까지)
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.submit(self._close_conn).result()
+            self._executor.shutdown(wait=True)
+
+    def _close_conn(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+reply_cache = ReplyCache(STATE_DB_PATH if REPLY_CACHE_DISK else None)
+
+
+# ---------- AI 채널 대화 기억 (유저별) ----------
+# 유저마다 최근 대화 몇 턴을 기억해 Gemini에 같이 보냄. 바이트·토큰 둘 다 상한을 두고, 넘치면 오래된 턴부터
+# 한 줄 요약으로 접음 (요약도 길이 상한). 오래 말 없는 유저는 잊고, 전체 인원은 LRU로 제한. 00시에 전부 초기화.
+AI_MEMORY_MAX_BYTES = 4096          # 기억하는 턴들의 UTF-8 바이트 합 상한
+AI_MEMORY_MAX_TOKENS = 1200         # 같은 턴들의 대략 토큰 수 상한
+AI_MEMORY_TURN_MAX_CHARS = 600      # 질문 하나 저장할 때 최대 글자
+AI_MEMORY_REPLY_MAX_CHARS = 400     # 답변 하나 저장할 때 최대 글자
+AI_MEMORY_SUMMARY_MAX_CHARS = 300   # 접힌 옛 대화 요약 최대 글자
+AI_MEMORY_IDLE_SECONDS = 30 * 60    # 이만큼 말 없으면 대화 잊음
+AI_MEMORY_MAX_USERS = 5000
+
+
+def estimate_tokens(text: str) -> int:
+    """대략 토큰 수: 한글 등 비ASCII 1글자 ≈ 1토큰, ASCII 4글자 ≈ 1토큰 (한글은 UTF-8 3바이트라 바이트 수로 셈)"""
+    non_ascii = (len(text.encode("utf-8")) - len(text)) // 2
+    ascii_chars = len(text) - non_ascii
+    return non_ascii + (ascii_chars + 3) // 4
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[: limit - 1] + "…"
+
+
+class UserConversation:
+    __slots__ = ("turns", "summary", "bytes", "tokens", "last_at")
+
+    def __init__(self) -> None:
+        self.turns: deque = deque()  # (질문, 답변, 바이트, 토큰)
+        self.summary = ""
+        self.bytes = 0
+        self.tokens = 0
+        self.last_at = 0.0
+
+
+class ConversationMemory:
+    """user_id -> UserConversation (OrderedDict LRU). 저장은 질문·답변 한 쌍 단위."""
+
+    def __init__(self) -> None:
+        self._users: OrderedDict[int, UserConversation] = OrderedDict()
+        self.compacted = 0
+        self.evicted = 0
+
+    def _get(self, user_id: int) -> UserConversation | None:
+        conv = self._users.get(user_id)
+        if conv is None:
+            return None
+        if time.time() - conv.last_at > AI_MEMORY_IDLE_SECONDS:
+            del self._users[user_id]
+            return None
+        return conv
+
+    def history(self, user_id: int) -> list[dict]:
+        """Gemini contents 형식의 이전 대화 (요약은 첫 질문 앞에 붙임). 없으면 []"""
+        conv = self._get(user_id)
+        if conv is None or not conv.turns:
+            return []
+        self._users.move_to_end(user_id)
+        contents = []
+        for i, (question, answer, _, _) in enumerate(conv.turns):
+            if i == 0 and conv.summary:
+                question = f"[앞선 대화 요약] {conv.summary}\n\n{question}"
+            contents.append({"role": "user", "parts": [{"text": question}]})
+            contents.append({"role": "model", "parts": [{"text": answer}]})
+        return contents
+
+    def record(self, user_id: int, question: str, answer: str) -> None:
+        conv = self._get(user_id)
+        if conv is None:
+            conv = self._users[user_id] = UserConversation()
+        self._users.move_to_end(user_id)
+        conv.last_at = time.time()
+        question = _clip(question, AI_MEMORY_TURN_MAX_CHARS)
+        answer = _clip(answer, AI_MEMORY_REPLY_MAX_CHARS)
+        size = len(question.encode("utf-8")) + len(answer.encode("utf-8"))
+        tokens = estimate_tokens(question) + estimate_tokens(answer)
+        conv.turns.append((question, answer, size, tokens))
+        conv.bytes += size
+        conv.tokens += tokens
+        # 상한 넘으면 오래된 턴부터 요약으로 접음 (방금 턴은 글자 상한 덕에 혼자서는 항상 들어감)
+        while len(conv.turns) > 1 and (conv.bytes > AI_MEMORY_MAX_BYTES or conv.tokens > AI_MEMORY_MAX_TOKENS):
+            old_question, _, old_size, old_tokens = conv.turns.popleft()
+            conv.bytes -= old_size
+            conv.tokens -= old_tokens
+            conv.summary = self._fold(conv.summary, old_question)
+            self.compacted += 1
+        while len(self._users) > AI_MEMORY_MAX_USERS:
+            self._users.popitem(last=False)
+            self.evicted += 1
+
+    @staticmethod
+    def _fold(summary: str, question: str) -> str:
+        """접힌 질문을 요약 끝에 한 조각으로 추가. 길면 가장 오래된 조각부터 버림."""
+        pieces = [p for p in summary.split(" / ") if p] + [_clip(question, 60)]
+        while len(pieces) > 1 and len(" / ".join(pieces)) > AI_MEMORY_SUMMARY_MAX_CHARS:
+            pieces.pop(0)
+        return _clip(" / ".join(pieces), AI_MEMORY_SUMMARY_MAX_CHARS)
+
+    def forget(self, user_id: int) -> None:
+        self._users.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._users.clear()
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._users),
+            "turns": sum(len(conv.turns) for conv in self._users.values()),
+            "bytes": sum(conv.bytes + len(conv.summary.encode("utf-8")) for conv in self._users.values()),
+            "compacted": self.compacted,
+            "evicted": self.evicted,
+        }
 
 
-def _message_already_handled(message_id: int) -> bool:
-    """이 메시지는 이미 처리됐으면 True (메모리 + 파일 락 확인)."""
-    now = time.time()
-    # 메모리: 같은 프로세스에서 최근에 처리한 메시지
-    for mid, t in list(_processed_msg_in_memory.items()):
-        if now - t > _DEDUP_MEMORY_MAX_AGE:
-            del _processed_msg_in_memory[mid]
-    if message_id in _processed_msg_in_memory:
+ai_conversations = ConversationMemory()
+
+
+# ---------- Gemini 요청 스케줄러 ----------
+# 몰릴 때 동시에 무한정 부르면 API 키 전체가 429에 걸림 → 전체 동시 요청 수 + 토큰 버킷(분당 한도)으로 제한.
+# 유저당 한 번에 하나만 (앞 요청 끝나기 전 또 보내면 거절 → 기회 중복 사용 방지), 대기는 먼저 온 유저 순.
+GEMINI_MAX_CONCURRENT = 4
+GEMINI_RATE_PER_MINUTE = 15   # API 키 분당 요청 한도에 맞출 것
+GEMINI_BURST = 5              # 쉬다가 한꺼번에 보낼 수 있는 수
+GEMINI_QUEUE_MAX = 20         # 이보다 많이 밀려 있으면 바로 거절
+GEMINI_QUEUE_MAX_WAIT_SECONDS = 60.0  # 이만큼 기다려도 차례가 안 오면 거절
+
+
+class AiRequestRejected(Exception):
+    """스케줄러가 요청을 받지 않음. reason: "duplicate"(이미 처리 중) / "full"(대기열 가득) / "timeout"(대기 시간 초과)"""
+
+    def __init__(self, reason: str) -> None:
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AiRequestScheduler:
+    """Gemini 호출 순서 정하기. run()에 넣으면 차례(동시 요청 수·토큰 남음)가 올 때까지 기다렸다가 실행."""
+
+    def __init__(self) -> None:
+        self._waiting: deque[tuple[int, asyncio.Future]] = deque()  # (유저, 차례 오면 완료되는 future)
+        self._users: set[int] = set()  # 대기 중이거나 실행 중인 유저
+        self._running = 0
+        self._tokens = float(GEMINI_BURST)
+        self._refilled_at = time.monotonic()
+        self._timer: asyncio.TimerHandle | None = None
+        self.started = 0
+        self.rejected = {"duplicate": 0, "full": 0, "timeout": 0}
+        self.waits: deque = deque(maxlen=GEMINI_LATENCY_SAMPLES)
+
+    def position(self, user_id: int) -> int:
+        """대기열에서 몇 번째인지 (1부터, 없으면 0)"""
+        for i, (uid, _) in enumerate(self._waiting, 1):
+            if uid == user_id:
+                return i
+        return 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(GEMINI_BURST, self._tokens + (now - self._refilled_at) * GEMINI_RATE_PER_MINUTE / 60)
+        self._refilled_at = now
+
+    def _pump(self) -> None:
+        self._refill()
+        while self._waiting and self._running < GEMINI_MAX_CONCURRENT and self._tokens >= 1:
+            _, future = self._waiting.popleft()
+            if future.done():
+                continue  # 기다리다 포기한 요청
+            self._tokens -= 1
+            self._running += 1
+            future.set_result(None)
+        if self._waiting and self._running < GEMINI_MAX_CONCURRENT and self._timer is None:
+            # 토큰이 모자라서 멈춘 경우 → 다음 토큰 생길 때 다시
+            delay = (1 - self._tokens) * 60 / GEMINI_RATE_PER_MINUTE
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self) -> None:
+        self._timer = None
+        self._pump()
+
+    async def run(self, user_id: int, factory, on_queued=None):
+        """factory() 코루틴을 차례가 오면 실행하고 결과 반환. 바로 못 하면 on_queued(대기 순번) 호출.
+        받을 수 없으면 AiRequestRejected."""
+        if user_id in self._users:
+            self.rejected["duplicate"] += 1
+            raise AiRequestRejected("duplicate")
+        if len(self._waiting) >= GEMINI_QUEUE_MAX:
+            self.rejected["full"] += 1
+            raise AiRequestRejected("full")
+        self._users.add(user_id)
+        future = asyncio.get_running_loop().create_future()
+        queued_at = time.monotonic()
+        self._waiting.append((user_id, future))
+        self._pump()
+        try:
+            if not future.done():
+                if on_queued is not None:
+                    await on_queued(self.position(user_id))
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), timeout=GEMINI_QUEUE_MAX_WAIT_SECONDS)
+                except asyncio.TimeoutError:
+                    if not future.done():
+                        self.rejected["timeout"] += 1
+                        raise AiRequestRejected("timeout") from None
+            self.started += 1
+            self.waits.append(time.monotonic() - queued_at)
+            return await factory()
+        finally:
+            if future.done() and not future.cancelled():
+                self._running -= 1
+            else:
+                future.cancel()
+                try:
+                    self._waiting.remove((user_id, future))
+                except ValueError:
+                    pass
+            self._users.discard(user_id)
+            self._pump()
+
+    def stats(self) -> dict:
+        self._refill()
+        waits = self.waits
+        return {
+            "running": self._running,
+            "waiting": len(self._waiting),
+            "tokens": self._tokens,
+            "started": self.started,
+            "rejected": dict(self.rejected),
+            "wait_avg_ms": (sum(waits) / len(waits) * 1000) if waits else 0.0,
+            "wait_max_ms": max(waits, default=0.0) * 1000,
+        }
+
+
+ai_scheduler = AiRequestScheduler()
+
+
+async def get_ai_reply(
+    user_message: str,
+    image: "AiImage | None" = None,
+    study_level: int = 0,
+    is_owner: bool = False,
+    user_id: int = 0,
+    on_queued=None,
+    on_text=None,
+) -> tuple[str | None, str | None, bool]:
+    """캐시 먼저 보고 없으면 스케줄러 차례를 기다려 get_gemini_reply. 반환: (답변, 모델, 캐시에서 왔는지).
+    이어지는 대화면(기억된 턴이 있으면) 앞 대화를 같이 보내고, 답이 맥락에 따라 달라지므로 캐시는 안 씀.
+    스케줄러가 거절하면 AiRequestRejected."""
+    question = user_message.strip() or "이거 봐줘."
+    remembered = question + (" (사진 첨부)" if image is not None else "")
+    history = ai_conversations.history(user_id) if user_id else []
+    key = None
+    if not history:
+        key = reply_cache_key(question, gemini_tone_tier(study_level, is_owner), image.digest if image else None)
+        cached = await reply_cache.get(key)
+        if cached is not None:
+            if user_id:
+                ai_conversations.record(user_id, remembered, cached[0])
+            return cached[0], cached[1], True
+    reply, model_used = await ai_scheduler.run(
+        user_id,
+        lambda: get_gemini_reply(
+            user_message, image, study_level=study_level, is_owner=is_owner, on_text=on_text, history=history,
+        ),
+        on_queued,
+    )
+    if reply and reply.strip():
+        if key is not None:
+            await reply_cache.put(key, reply, model_used or "")
+        if user_id:
+            ai_conversations.record(user_id, remembered, reply)
+    return reply, model_used, False
+
+
+# ---------- 메시지 중복 처리 방지 (봇 여러 개 켜져 있을 때 / 이벤트 중복 시 한 번만 응답) ----------
+_DEDUP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".bot_msg_locks")
+_processed_msg_in_memory: dict[int, float] = {}  # message_id -> 처리 시각 (같은 프로세스 내 중복 방지)
+_DEDUP_MEMORY_MAX_AGE = 5.0  # 초
+_DEDUP_FILE_MAX_AGE = 120    # 초 (파일 락 삭제까지)
+
+
+def _message_already_handled(message_id: int) -> bool:
+    """이 메시지는 이미 처리됐으면 True (메모리 + 파일 락 확인)."""
+    now = time.time()
+    # 메모리: 같은 프로세스에서 최근에 처리한 메시지
+    for mid, t in list(_processed_msg_in_memory.items()):
+        if now - t > _DEDUP_MEMORY_MAX_AGE:
+            del _processed_msg_in_memory[mid]
+    if message_id in _processed_msg_in_memory:
         return True
     # 파일: 다른 프로세스가 이미 처리 중/완료
     try:
@@ -1183,17 +2671,307 @@ def _release_message_lock(message_id: int) -> None:
         pass
 
 
-async def send_notice(guild: discord.Guild, content: str) -> None:
-    """안내용 텍스트 채널로 메시지 보내기 (권한 없으면 그냥 무시)"""
+# ======================= 디스코드 요청 큐 ==========================
+# 이동·음소거·역할·안내 메시지는 핸들러에서 바로 await 하지 않고 큐에 넣고 끝냄.
+# 우선순위: 강제 이동 > 음소거 > 역할 > 안내. 같은 대상에 대한 요청이 아직 안 나갔으면 마지막 것만 보냄(음소거 후 해제 → 해제만).
+ACTION_MOVE = 0
+ACTION_MUTE = 1
+ACTION_ROLE = 2
+ACTION_NOTICE = 3
+ACTION_NAMES = {ACTION_MOVE: "이동", ACTION_MUTE: "음소거", ACTION_ROLE: "역할", ACTION_NOTICE: "안내"}
+# 경로(route)별 동시 요청 수. 안내 채널은 순서 유지를 위해 1
+ACTION_ROUTE_LIMITS = {"members": 2, "roles": 2, "channel": 1}
+# 전체 동시 요청 수
+ACTION_MAX_IN_FLIGHT = 6
+# 대기 시간 통계에 쓰는 최근 요청 수 (우선순위별)
+ACTION_WAIT_SAMPLES = 200
+
+
+class ActionQueue:
+    """디스코드로 나가는 요청 큐. 우선순위 순으로, 경로별 동시 요청 수를 지키며 보냄.
+    429를 받으면 그 경로는 retry_after 동안 멈추고 요청은 다시 큐에 넣음."""
+
+    def __init__(self) -> None:
+        self._heap: list[tuple[int, int, object]] = []  # (우선순위, 순번, key)
+        # key -> (우선순위, 순번, 경로, 콜백, 인자, 설명, 넣은 시각)
+        self._pending: dict[object, tuple] = {}
+        self._seq = 0
+        self._in_flight: dict[tuple, int] = {}  # 경로 -> 지금 보내는 중인 수
+        self._in_flight_keys: set = set()
+        self._blocked_until: dict[tuple, float] = {}  # 경로 -> 429로 멈춘 시각까지
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._running: set[asyncio.Task] = set()
+        self.counts = {name: {"queued": 0, "sent": 0, "coalesced": 0, "failed": 0, "rate_limited": 0} for name in ACTION_NAMES}
+        self.waits = {name: deque(maxlen=ACTION_WAIT_SAMPLES) for name in ACTION_NAMES}
+
+    def put(self, priority: int, route: tuple, key, label: str, callback, *args) -> None:
+        """요청 넣기. key가 같은 요청이 아직 안 나갔으면 그걸 대체함(key=None이면 대체 안 함)."""
+        self._seq += 1
+        if key is None:
+            key = ("once", self._seq)
+        enqueued_at = time.monotonic()
+        previous = self._pending.get(key)
+        if previous is not None:
+            self.counts[previous[0]]["coalesced"] += 1
+            enqueued_at = previous[6]
+        self.counts[priority]["queued"] += 1
+        self._pending[key] = (priority, self._seq, route, callback, args, label, enqueued_at)
+        heapq.heappush(self._heap, (priority, self._seq, key))
+        self._wakeup.set()
+
+    def is_pending(self, key) -> bool:
+        """key 요청이 아직 큐에 있거나 보내는 중인지"""
+        return key in self._pending or key in self._in_flight_keys
+
+    def depth(self) -> dict[int, int]:
+        depth = {name: 0 for name in ACTION_NAMES}
+        for entry in self._pending.values():
+            depth[entry[0]] += 1
+        return depth
+
+    def stats(self) -> dict[int, dict]:
+        depth = self.depth()
+        result = {}
+        for name in ACTION_NAMES:
+            waits = self.waits[name]
+            result[name] = dict(
+                self.counts[name],
+                depth=depth[name],
+                wait_avg_ms=(sum(waits) / len(waits) * 1000) if waits else 0.0,
+                wait_max_ms=max(waits, default=0.0) * 1000,
+            )
+        return result
+
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if not self.is_running():
+            self._task = asyncio.create_task(self._run())
+
+    def _route_free(self, route: tuple, now: float) -> bool:
+        if self._blocked_until.get(route, 0.0) > now:
+            return False
+        return self._in_flight.get(route, 0) < ACTION_ROUTE_LIMITS.get(route[0], 1)
+
+    def _dispatch(self) -> float | None:
+        """보낼 수 있는 요청 시작. 429로 막힌 경로만 남았으면 풀리는 시각(monotonic) 반환."""
+        now = time.monotonic()
+        held = []
+        wake_at = None
+        while self._heap and len(self._running) < ACTION_MAX_IN_FLIGHT:
+            item = heapq.heappop(self._heap)
+            _, seq, key = item
+            entry = self._pending.get(key)
+            if entry is None or entry[1] != seq:
+                continue  # 대체됐거나 이미 보낸 요청
+            route = entry[2]
+            if key in self._in_flight_keys or not self._route_free(route, now):
+                held.append(item)
+                blocked = self._blocked_until.get(route, 0.0)
+                if blocked > now and (wake_at is None or blocked < wake_at):
+                    wake_at = blocked
+                continue
+            del self._pending[key]
+            self._start(key, entry, now)
+        for item in held:
+            heapq.heappush(self._heap, item)
+        return wake_at
+
+    def _start(self, key, entry: tuple, now: float) -> None:
+        priority, _, route, _, _, _, enqueued_at = entry
+        self.waits[priority].append(now - enqueued_at)
+        self._in_flight[route] = self._in_flight.get(route, 0) + 1
+        self._in_flight_keys.add(key)
+        task = asyncio.create_task(self._send(key, entry))
+        self._running.add(task)
+        task.add_done_callback(self._on_done)
+
+    def _on_done(self, task: asyncio.Task) -> None:
+        # _send의 finally 시점엔 아직 _running에 남아 있어 한도에 걸림 → 빠진 다음에 다시 깨워야 다음 요청이 나감
+        self._running.discard(task)
+        self._wakeup.set()
+
+    async def _send(self, key, entry: tuple) -> None:
+        priority, _, route, callback, args, label, _ = entry
+        try:
+            await callback(*args)
+            self.counts[priority]["sent"] += 1
+        except (discord.HTTPException, discord.RateLimited) as e:
+            if isinstance(e, discord.RateLimited) or e.status == 429:
+                retry_after = getattr(e, "retry_after", None)
+                if retry_after is None and getattr(e, "response", None) is not None:
+                    retry_after = float(e.response.headers.get("Retry-After", 1.0))
+                self.counts[priority]["rate_limited"] += 1
+                self._blocked_until[route] = time.monotonic() + max(0.0, retry_after or 1.0)
+                if key not in self._pending:
+                    # 기다리는 동안 새 요청으로 대체되지 않았으면 다시 넣음 (넣은 시각 유지)
+                    self._pending[key] = entry
+                    heapq.heappush(self._heap, (priority, entry[1], key))
+            else:
+                self.counts[priority]["failed"] += 1
+                print(f"[WARN] {label} 실패: {e}")
+        except Exception as e:
+            self.counts[priority]["failed"] += 1
+            print(f"[WARN] {label} 실패: {e}")
+        finally:
+            self._in_flight[route] -= 1
+            self._in_flight_keys.discard(key)
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            wake_at = self._dispatch()
+            timeout = None if wake_at is None else max(0.0, wake_at - time.monotonic())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+discord_actions = ActionQueue()
+
+
+def queue_move(member: discord.Member, channel: discord.VoiceChannel, label: str) -> None:
+    discord_actions.put(
+        ACTION_MOVE, ("members", member.guild.id), ("move", member.guild.id, member.id),
+        f"{label} ({member})", member.move_to, channel,
+    )
+
+
+def queue_mute(member: discord.Member, mute: bool) -> None:
+    label = f"{member} 서버 음소거" + ("" if mute else " 해제")
+    discord_actions.put(
+        ACTION_MUTE, ("members", member.guild.id), ("mute", member.guild.id, member.id),
+        label, _edit_mute, member, mute,
+    )
+
+
+async def _edit_mute(member: discord.Member, mute: bool) -> None:
+    await member.edit(mute=mute)
+
+
+def queue_role(member: discord.Member, role: discord.Role, add: bool) -> None:
+    callback = member.add_roles if add else member.remove_roles
+    discord_actions.put(
+        ACTION_ROLE, ("roles", member.guild.id), ("role", member.guild.id, member.id, role.id),
+        f"{member} 역할 {role.name} {'부여' if add else '해제'}", callback, role,
+    )
+
+
+# 안내 채널에 방금 보냈으면 이 시간(초) 동안 들어온 안내를 모아 한 메시지로 보냄. 채널이 한가하면 바로 보냄
+NOTICE_BATCH_WINDOW_SECONDS = 0.5
+# 디스코드 메시지 최대 길이
+DISCORD_MESSAGE_LIMIT = 2000
+# 초당 메시지 수 계산에 쓰는 최근 구간 (초)
+NOTICE_RATE_WINDOW_SECONDS = 60.0
+
+
+def split_notice_lines(lines: list[str], limit: int = DISCORD_MESSAGE_LIMIT) -> list[str]:
+    """안내 여러 줄을 limit 글자 넘지 않게 최소 개수 메시지로 합침 (한 줄이 limit보다 길면 잘라서)"""
+    chunks: list[str] = []
+    current = ""
+    for line in lines:
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if not current:
+            current = line
+        elif len(current) + 1 + len(line) <= limit:
+            current += "\n" + line
+        else:
+            chunks.append(current)
+            current = line
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class NoticeBatcher:
+    """채널별 안내 모아 보내기. 채널마다 대기 중인 전송은 요청 큐에 하나만 두고, 보낼 때 그동안 쌓인 줄을 합쳐서 보냄."""
+
+    def __init__(self, queue: ActionQueue) -> None:
+        self._queue = queue
+        self._lines: dict[int, list[str]] = {}
+        self._first_at: dict[int, float] = {}  # 채널 -> 아직 안 보낸 첫 줄이 들어온 시각
+        self._last_flush: dict[int, float] = {}
+        self.lines_in = 0
+        self.messages_out = 0
+        self._sent_at: deque = deque()  # 최근 메시지 보낸 시각 (초당 메시지 수 계산용)
+        self.delays: deque = deque(maxlen=ACTION_WAIT_SAMPLES)  # 첫 줄 들어옴 → 전송까지 (초)
+
+    def add(self, channel: discord.abc.Messageable, content: str) -> None:
+        lines = self._lines.setdefault(channel.id, [])
+        lines.append(content)
+        self.lines_in += 1
+        if len(lines) > 1:
+            return  # 이미 전송 예약됨 → 그때 같이 나감
+        now = time.monotonic()
+        self._first_at[channel.id] = now
+        wait = self._last_flush.get(channel.id, float("-inf")) + NOTICE_BATCH_WINDOW_SECONDS - now
+        if wait <= 0:
+            self._enqueue(channel)
+        else:
+            asyncio.get_running_loop().call_later(wait, self._enqueue, channel)
+
+    def _enqueue(self, channel: discord.abc.Messageable) -> None:
+        self._queue.put(
+            ACTION_NOTICE, ("channel", channel.id), ("notice", channel.id),
+            f"채널 {channel.id} 안내", self._flush, channel,
+        )
+
+    async def _flush(self, channel: discord.abc.Messageable) -> None:
+        lines = self._lines.pop(channel.id, None)
+        first_at = self._first_at.pop(channel.id, None)
+        if not lines:
+            return
+        now = time.monotonic()
+        self._last_flush[channel.id] = now
+        if first_at is not None:
+            self.delays.append(now - first_at)
+        chunks = split_notice_lines(lines)
+        for i, chunk in enumerate(chunks):
+            try:
+                await channel.send(chunk)
+            except discord.HTTPException as e:
+                if e.status == 429:
+                    # 못 보낸 부분은 다시 앞에 넣어 두고 큐가 재시도하게 함
+                    pending = self._lines.setdefault(channel.id, [])
+                    pending[:0] = chunks[i:]
+                    self._first_at.setdefault(channel.id, first_at or now)
+                raise
+            self.messages_out += 1
+            self._sent_at.append(time.monotonic())
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        while self._sent_at and now - self._sent_at[0] > NOTICE_RATE_WINDOW_SECONDS:
+            self._sent_at.popleft()
+        delays = self.delays
+        return {
+            "lines": self.lines_in,
+            "messages": self.messages_out,
+            "msgs_per_sec": len(self._sent_at) / NOTICE_RATE_WINDOW_SECONDS,
+            "delay_avg_ms": (sum(delays) / len(delays) * 1000) if delays else 0.0,
+            "delay_max_ms": max(delays, default=0.0) * 1000,
+        }
+
+
+notice_batcher = NoticeBatcher(discord_actions)
+
+
+def send_notice(guild: discord.Guild, content: str) -> None:
+    """안내용 텍스트 채널로 메시지 보내기 (모아 보내기 큐에 넣고 바로 반환, 권한 없으면 경고만)"""
     if NOTICE_TEXT_CHANNEL_ID is None:
         return
     channel = guild.get_channel(NOTICE_TEXT_CHANNEL_ID)
     if channel and isinstance(channel, (discord.TextChannel, discord.Thread)):
-        try:
-            await channel.send(content)
-        except discord.Forbidden:
-            # 채널 권한 부족하면 봇이 죽지 않게 그냥 패스
-            print(f"[WARN] 채널 {channel.id} 에 메시지 보낼 권한이 없습니다.")
+        notice_batcher.add(channel, content)
 
 
 # ======================= Koyeb Health Check API ==========================
@@ -1221,17 +2999,167 @@ async def ping_self():
     await bot.wait_until_ready()
     while not bot.is_closed():
         try:
-            async with aiohttp.ClientSession() as session:
-                url = koyeb_url.rstrip("/") + "/health"
-                await session.get(url, timeout=aiohttp.ClientTimeout(total=10))
+            url = koyeb_url.rstrip("/") + "/health"
+            async with get_http_session().get(url, timeout=aiohttp.ClientTimeout(total=10)) as resp:
+                await resp.read()
         except Exception:
             pass
         await asyncio.sleep(180)
 
 
+# ======================= 재시작 후 세션 이어가기 ==========================
+_voice_sessions_reconciled = False
+
+
+def live_voice_members() -> dict[int, tuple[discord.Guild, discord.Member, int]]:
+    """지금 음성 채널에 있는 사람만: user_id -> (서버, 멤버, 채널 id). 전체 멤버 대신 guild.voice_channels만 훑음."""
+    live: dict[int, tuple[discord.Guild, discord.Member, int]] = {}
+    for guild in bot.guilds:
+        for channel in guild.voice_channels:
+            for member in channel.members:
+                if not member.bot:
+                    live[member.id] = (guild, member, channel.id)
+    return live
+
+
+def _resume_persisted_session(user_id: int, state: UserDay, found, now: float, saved_at: float) -> bool:
+    """DB에서 불러온 진행 중 세션(공부/선언방/쉼터) 하나를 실제 음성 상태와 맞춤. 공부 세션을 이어 세면 True.
+    마지막 저장 시각까지만 정산하고(꺼져 있던 시간은 안 셈), 아직 같은 방에 있으면 지금부터 이어서 센다."""
+    guild, _, channel_id = found if found else (None, None, None)
+    downtime = max(0.0, now - saved_at)
+    if state.in_study:
+        known_channel_id = state.current_channel_id
+    elif state.rest_entered_at is not None:
+        known_channel_id = CHANNELS["REST"]
+    else:
+        known_channel_id = STUDY_PLEDGE_VOICE_CHANNEL_ID
+    if known_channel_id != channel_id:
+        # 꺼져 있는 동안 나간 것: 마지막 저장 시각에 나간 걸로 로그에 남김
+        state_store.record_event("leave", user_id, ts=saved_at, **{"from": known_channel_id})
+        # 세션을 새로 시작하는 방이면 입장은 _start_untracked_session이 기록 (같은 입장이 두 번 남지 않게)
+        if channel_id is not None and not _starts_session_in(state, channel_id):
+            state_store.record_event("join", user_id, to=channel_id)
+    if state.in_study and state.last_join_at is not None:
+        diff = max(0.0, saved_at - state.last_join_at)
+        if state.quota_done:
+            state.session_study_sec += diff
+        else:
+            state.total_study_sec += diff
+        if channel_id is not None and channel_id == state.current_channel_id:
+            state.last_join_at = now
+        else:
+            state.end_study()
+    if state.pledge_entered_at is not None:
+        if is_pledge_voice_channel(channel_id):
+            state.pledge_entered_at += downtime
+        else:
+            state.pledge_done_min += max(0.0, saved_at - state.pledge_entered_at) / 60
+            state.pledge_entered_at = None
+    if state.rest_entered_at is not None:
+        if is_rest_channel(channel_id):
+            state.rest_entered_at += downtime
+            arm_rest_timers(guild.id, user_id)
+        else:
+            state.rest_total_sec += int(max(0.0, saved_at - state.rest_entered_at))
+            state.rest_entered_at = None
+    state_store.mark_dirty(user_id)
+    if state.in_study:
+        mark_study_active(guild.id, user_id)
+        return True
+    return False
+
+
+def _starts_session_in(state: UserDay, channel_id: int) -> bool:
+    """이 방에 있으면 세션을 세는지 (공부방·쉼터, 선언한 시간이 있을 때의 선언방)"""
+    return (
+        is_study_channel(channel_id)
+        or is_rest_channel(channel_id)
+        or (is_pledge_voice_channel(channel_id) and state.pledge_target_min > 0)
+    )
+
+
+def _start_untracked_session(guild: discord.Guild, user_id: int, channel_id: int, now: float) -> str | None:
+    """저장된 기록 없이 이미 공부방/선언방/쉼터에 있던 사람: 지금 들어온 것처럼 세션 시작 (음소거·안내는 안 보냄,
+    이미 그 방에 있던 사람이라). 시작한 종류 "study"/"pledge"/"rest" 또는 None."""
+    state = get_user_state(user_id)
+    if is_study_channel(channel_id):
+        state.session_start_total_sec = state.total_study_sec
+        if state.quota_done:
+            state.session_study_sec = 0.0
+        kind = "study"
+    elif is_pledge_voice_channel(channel_id) and state.pledge_target_min > 0:
+        state.pledge_entered_at = now
+        kind = "pledge"
+    elif is_rest_channel(channel_id):
+        state.rest_entered_at = now
+        state.rest_visits += 1
+        state_store.record_event("join", user_id, to=channel_id)
+        state_store.mark_dirty(user_id)
+        arm_rest_timers(guild.id, user_id)
+        return "rest"
+    else:
+        return None
+    state.in_study = True
+    state.current_channel_id = channel_id
+    state.last_join_at = now
+    state_store.record_event("join", user_id, to=channel_id)
+    state_store.mark_dirty(user_id)
+    mark_study_active(guild.id, user_id)
+    return kind
+
+
+def reconcile_voice_sessions() -> None:
+    """재시작 후 한 번: 저장된 진행 중 세션을 실제 음성 상태와 맞추고, 기록 없이 이미 방에 있던 사람은 지금부터 세기 시작.
+    음성 채널에 있는 사람만 한 번 훑어서 dict로 (유저마다 서버 전체를 뒤지지 않음)."""
+    started = time.perf_counter()
+    now = time.time()
+    saved_at = state_store.saved_at or now
+    live = live_voice_members()
+    scanned_ms = (time.perf_counter() - started) * 1000
+
+    persisted = [
+        uid for uid, day in user_days.items()
+        if day.in_study or day.pledge_entered_at is not None or day.rest_entered_at is not None
+    ]
+    resumed = 0
+    for user_id in persisted:
+        if _resume_persisted_session(user_id, user_days[user_id], live.get(user_id), now, saved_at):
+            resumed += 1
+
+    started_counts = {"study": 0, "pledge": 0, "rest": 0}
+    for user_id, (guild, _, channel_id) in live.items():
+        state = user_days.get(user_id)
+        if state is not None and (
+            state.in_study or state.pledge_entered_at is not None or state.rest_entered_at is not None
+        ):
+            continue  # 위에서 이어 세는 중
+        kind = _start_untracked_session(guild, user_id, channel_id, now)
+        if kind is not None:
+            started_counts[kind] += 1
+    total_ms = (time.perf_counter() - started) * 1000
+    print(
+        f"[상태 복원] 음성 채널 {len(live)}명 확인 ({scanned_ms:.1f}ms) · 저장된 세션 {len(persisted)}개 중 "
+        f"공부 {resumed}개 이어서 셈 · 새로 시작 공부 {started_counts['study']} / 선언 {started_counts['pledge']} / "
+        f"쉼터 {started_counts['rest']} · 전체 {total_ms:.1f}ms"
+    )
+
+
 # ======================= 이벤트 핸들러 ==========================
+@bot.event
+async def setup_hook():
+    """로그인 전 한 번: 저장된 오늘 상태 불러오기 + 주기 저장 시작 + 공용 HTTP 세션 준비 + 루프 지연 측정 시작"""
+    started = time.perf_counter()
+    count = await state_store.load()
+    print(f"[상태 복원] 유저 {count}명 불러옴 ({(time.perf_counter() - started) * 1000:.1f}ms, {STATE_DB_PATH})")
+    state_store.start()
+    get_http_session()
+    global _loop_lag_task
+    _loop_lag_task = asyncio.create_task(monitor_loop_lag())
+
+
 @bot.event
 async def on_ready():
+    global _voice_sessions_reconciled
     print(f"로그인 완료: {bot.user} (ID: {bot.user.id})")
     if GEMINI_AVAILABLE and GEMINI_API_KEY:
         print("Gemini AI: 사용 가능 (API 키 설정됨)")
@@ -1241,12 +3169,16 @@ async def on_ready():
     bot.loop.create_task(start_web_server())
     # 수면 모드 방지 (KOYEB_URL 설정 시에만)
     bot.loop.create_task(ping_self())
-    if not check_study_time.is_running():
-        check_study_time.start()
-        print("공부 시간 체크 루프 시작")
-    if not check_rest_time.is_running():
-        check_rest_time.start()
-        print("쉼터 체크 루프 시작")
+    if not deadline_scheduler.is_running():
+        deadline_scheduler.start()
+        print("공부·쉼터 마감 스케줄러 시작")
+    if not discord_actions.is_running():
+        discord_actions.start()
+    # 저장된 날짜가 어제면 이어가기 전에 먼저 초기화 (어제 세션을 오늘로 이어 세지 않도록)
+    await start_day_rollover()
+    if not _voice_sessions_reconciled:
+        _voice_sessions_reconciled = True
+        reconcile_voice_sessions()
 
 
 @bot.command()
@@ -1270,17 +3202,7 @@ async def gemini_test(ctx: commands.Context):
 @bot.command(name="순공시간")
 async def sunong_time(ctx: commands.Context):
     """오늘 누적 공부 시간 알려주기 (꼽주기 멘트). 일반 공부방 + 선언 공부방 시간 포함."""
-    await maybe_reset_midnight()
-    user_id = ctx.author.id
-    # 현재 공부방(일반/선언 모두)에 있으면 직전 입장~지금까지 시간을 먼저 total/session에 반영 (선언공부방·선택시간방 0분 버그 방지)
-    update_user_study_time(user_id)
-    state = get_user_state(user_id)
-    total_sec = state["total_study_sec"]
-    # 할당량 이미 채운 뒤 재방문 시에는 session_study_sec에 쌓이므로 합산해서 표시
-    if user_id in completed_quota_today:
-        total_sec += state.get("session_study_sec", 0)
-    # 선언 공부방 시간은 위 update_user_study_time에서 이미 last_join_at 기준으로 total_sec에 반영됨 → 따로 더하면 중복
-    total_minutes = int(total_sec // 60)
+    total_minutes = today_study_minutes(ctx.author.id)
     tone = get_tone_tier(ctx.author, ctx.guild) if ctx.guild else "snarky"
     msg = sunong_time_reply(ctx.author.mention, total_minutes, tone)
     await ctx.send(msg)
@@ -1289,16 +3211,7 @@ async def sunong_time(ctx: commands.Context):
 @bot.command(name="AI횟수")
 async def ai_count(ctx: commands.Context):
     """남은 AI 사용 기회 보여주기"""
-    await maybe_reset_midnight()
-    update_user_study_time(ctx.author.id)
-    state = get_user_state(ctx.author.id)
-    study_hours = int(state["total_study_sec"] // 3600)
-    used = ai_usage_count_today.get(ctx.author.id, 0)
-    remaining = max(0, 1 + study_hours - used)
-    await ctx.send(
-        f"{ctx.author.mention} 남은 AI 사용 기회 **{remaining}번**이에요. "
-        f"(오늘 순공 {study_hours}시간 → +{study_hours}회, 사용 {used}회)"
-    )
+    await ctx.send(ai_credit_reply(ctx.author.mention, ctx.author.id))
 
 
 @bot.command(name="AI횟수추가")
@@ -1313,16 +3226,186 @@ async def ai_count_add(ctx: commands.Context, member: discord.Member, count: int
     if count <= 0:
         await ctx.send("횟수는 1 이상으로 넣어 주세요.")
         return
-    await maybe_reset_midnight()
-    used_before = ai_usage_count_today.get(member.id, 0)
-    ai_usage_count_today[member.id] = max(0, used_before - count)
-    added = used_before - ai_usage_count_today[member.id]
+    state = get_user_state(member.id)
+    used_before = state.ai_used
+    state.ai_used = max(0, used_before - count)
+    added = used_before - state.ai_used
+    state_store.mark_dirty(member.id)
     await ctx.send(
         f"{member.mention}에게 AI 사용 기회 **{added}번** 추가했어요. "
-        f"(사용 기록: {used_before} → {ai_usage_count_today[member.id]})"
+        f"(사용 기록: {used_before} → {state.ai_used})"
+    )
+
+
+@bot.command(name="모델상태")
+async def gemini_model_status(ctx: commands.Context):
+    """Gemini 모델별 상태 (관리자만): 정상/제외 중(남은 시간·이유)/시험 중, 성공·실패 횟수, 마지막 성공 모델"""
+    if ctx.author.id != ADMIN_USER_ID:
+        await ctx.send("이 명령은 지정된 사용자만 사용할 수 있어요.")
+        return
+    now = time.time()
+    lines = [f"마지막 성공 모델: {gemini_health.last_good or '없음'}"]
+    if gemini_reply_latencies:
+        p50 = latency_percentile(gemini_reply_latencies, 0.5)
+        p99 = latency_percentile(gemini_reply_latencies, 0.99)
+        lines.append(f"답변 시간 최근 {len(gemini_reply_latencies)}건: p50 {p50:.2f}초 · p99 {p99:.2f}초")
+    for model, entry in gemini_health.snapshot():
+        if entry["reason"] is None:
+            status = "정상"
+        elif entry["probing"]:
+            status = f"시험 중 ({entry['reason']})"
+        elif entry["open_until"] > now:
+            status = f"제외 {format_minutes(int((entry['open_until'] - now) // 60) + 1)} 남음 ({entry['reason']})"
+        else:
+            status = f"시험 대기 ({entry['reason']})"
+        line = f"`{model}` {status} · 성공 {entry['successes']} · 실패 {entry['failures']}"
+        p90 = latency_percentile(entry["latencies"], GEMINI_HEDGE_PERCENTILE)
+        if p90 is not None:
+            line += f" · 응답 p{int(GEMINI_HEDGE_PERCENTILE * 100)} {p90:.2f}초"
+        lines.append(line)
+    if not gemini_health.snapshot():
+        lines.append("아직 호출 기록이 없어요.")
+    routed = ai_route_counts["local"] + ai_route_counts["model"]
+    if routed:
+        local_ms = latency_percentile(ai_local_latencies, 0.5) or 0.0
+        model_p50 = latency_percentile(gemini_reply_latencies, 0.5)
+        lines.append(
+            f"로컬 응답: {ai_route_counts['local']}/{routed} ({ai_route_counts['local'] / routed * 100:.0f}%) · "
+            f"처리 p50 {local_ms * 1000:.2f}ms"
+            + (f" (Gemini p50 {model_p50:.2f}초)" if model_p50 is not None else "")
+        )
+    memory = ai_conversations.stats()
+    lines.append(
+        f"대화 기억: {memory['users']}명 · {memory['turns']}턴 · {memory['bytes'] / 1024:.1f}KB · "
+        f"요약으로 접음 {memory['compacted']}회 · LRU 제외 {memory['evicted']}명"
+    )
+    prompt_cache = gemini_prompt_cache.stats()
+    lines.append(
+        f"프롬프트 캐시: {'켜짐' if GEMINI_PROMPT_CACHE else '꺼짐'} · 활성 {prompt_cache['active']}개 · "
+        f"생성 {prompt_cache['created']}회 · 사용 {prompt_cache['used']}회 · 생성 실패 {prompt_cache['failures']}회"
+    )
+    lines.append(
+        f"이미지 업로드: {gemini_files.uploads}회 · 재사용 {gemini_files.reused}회 · 실패 {gemini_files.failures}회"
+    )
+    sched = ai_scheduler.stats()
+    rejected = sched["rejected"]
+    lines.append(
+        f"요청 스케줄러: 실행 {sched['running']}/{GEMINI_MAX_CONCURRENT} · 대기 {sched['waiting']} · "
+        f"토큰 {sched['tokens']:.1f}/{GEMINI_BURST} · 평균 대기 {sched['wait_avg_ms']:.0f}ms "
+        f"(최대 {sched['wait_max_ms']:.0f}ms) · 거절 중복 {rejected['duplicate']} / 가득 {rejected['full']} / 시간 초과 {rejected['timeout']}"
+    )
+    await ctx.send("\n".join(lines))
+
+
+@bot.command(name="답변캐시")
+async def reply_cache_command(ctx: commands.Context, action: str | None = None):
+    """AI 답변 캐시 상태 (관리자만). `!답변캐시 비우기` 로 메모리·디스크 캐시 전부 삭제"""
+    if ctx.author.id != ADMIN_USER_ID:
+        await ctx.send("이 명령은 지정된 사용자만 사용할 수 있어요.")
+        return
+    if action == "비우기":
+        count = await reply_cache.clear()
+        await ctx.send(f"답변 캐시 비움 (메모리 {count}개 + 디스크).")
+        return
+    st = reply_cache.stats()
+    await ctx.send(
+        f"답변 캐시: 메모리 {st['entries']}개 · 적중 {st['hits']} (디스크 {st['disk_hits']}) · "
+        f"미적중 {st['misses']} · 적중률 {st['hit_rate'] * 100:.1f}%"
+    )
+
+
+@bot.command(name="멘트리로드")
+async def reload_messages_command(ctx: commands.Context):
+    """messages.json 멘트 다시 읽기 (관리자만). 봇 재시작 없이 적용, 파일이 잘못됐으면 기존 멘트 유지"""
+    if ctx.author.id != ADMIN_USER_ID:
+        await ctx.send("이 명령은 지정된 사용자만 사용할 수 있어요.")
+        return
+    started = time.perf_counter()
+    try:
+        kinds, templates = reload_message_catalog()
+    except (OSError, ValueError) as e:
+        await ctx.send(f"멘트 다시 읽기 실패 — 기존 멘트 그대로 써요.\n`{e}`")
+        return
+    await ctx.send(
+        f"멘트 다시 읽음: {kinds}종류 · 문장 {templates}개 ({(time.perf_counter() - started) * 1000:.1f}ms)"
+    )
+
+
+@bot.command(name="요청큐")
+async def action_queue_status(ctx: commands.Context):
+    """디스코드 요청 큐 상태 (관리자만): 종류별 대기 수, 대기 시간, 보냄/대체/실패/429 횟수"""
+    if ctx.author.id != ADMIN_USER_ID:
+        await ctx.send("이 명령은 지정된 사용자만 사용할 수 있어요.")
+        return
+    lines = []
+    for priority, row in discord_actions.stats().items():
+        lines.append(
+            f"{ACTION_NAMES[priority]}: 대기 {row['depth']} · 평균 대기 {row['wait_avg_ms']:.0f}ms "
+            f"(최대 {row['wait_max_ms']:.0f}ms) · 보냄 {row['sent']} · 대체 {row['coalesced']} "
+            f"· 실패 {row['failed']} · 429 {row['rate_limited']}"
+        )
+    if loop_lag_samples:
+        lags = sorted(loop_lag_samples)
+        lines.append(
+            f"이벤트 루프 지연 (최근 {len(lags)}회): p50 {lags[len(lags) // 2] * 1000:.1f}ms · "
+            f"p99 {lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000:.1f}ms · 최대 {lags[-1] * 1000:.1f}ms"
+        )
+    voice = voice_debouncer.stats()
+    lines.append(
+        f"음성 이동 묶기: 이벤트 {voice['events']} · 바로 {voice['immediate']} · 묶어서 {voice['deferred']} · "
+        f"생략한 음소거 {voice['suppressed_mutes']} · 생략한 안내 {voice['suppressed_notices']}줄"
+    )
+    locks = user_locks.stats()
+    lines.append(
+        f"유저별 잠금: 지금 {locks['held']}명 · 획득 {locks['acquired']}회 · 기다림 {locks['contended']}회 "
+        f"(최대 {locks['wait_max_ms']:.1f}ms)"
+    )
+    hits, misses = tone_tier_cache_stats["hits"], tone_tier_cache_stats["misses"]
+    if hits + misses:
+        lines.append(
+            f"말투 단계 캐시: {len(_tone_tier_cache)}명 · 적중 {hits / (hits + misses) * 100:.1f}% "
+            f"({hits}/{hits + misses}) · 닉네임 변경으로 지움 {tone_tier_cache_stats['invalidated']}회"
+        )
+    notice = notice_batcher.stats()
+    lines.append(
+        f"안내 모아 보내기: {notice['lines']}줄 → 메시지 {notice['messages']}개 · "
+        f"최근 {notice['msgs_per_sec'] * 60:.0f}개/분 ({notice['msgs_per_sec']:.2f}/s) · "
+        f"전달 지연 평균 {notice['delay_avg_ms']:.0f}ms (최대 {notice['delay_max_ms']:.0f}ms)"
+    )
+    await ctx.send("\n".join(lines))
+
+
+@bot.command(name="일일재계산")
+async def recompute_day(ctx: commands.Context, day: str | None = None):
+    """이벤트 로그만으로 그날 유저별 공부·쉼터 시간 다시 계산 (관리자만). 사용법: !일일재계산 [YYYY-MM-DD]"""
+    if ctx.author.id != ADMIN_USER_ID:
+        await ctx.send("이 명령은 지정된 사용자만 사용할 수 있어요.")
+        return
+    day = day or kst_today()
+    try:
+        datetime.datetime.strptime(day, "%Y-%m-%d")
+    except ValueError:
+        await ctx.send("날짜는 `YYYY-MM-DD` 형식으로 넣어 주세요. (예: !일일재계산 2026-02-01)")
+        return
+    events = await state_store.read_events()
+    totals = recompute_day_totals(events, day)
+    lines = ["user_id,study_min,rest_min,rest_visits"]
+    for user_id, t in sorted(totals.items(), key=lambda kv: -kv[1]["study_sec"]):
+        lines.append(f"{user_id},{int(t['study_sec'] // 60)},{int(t['rest_sec'] // 60)},{t['rest_visits']}")
+    total_study_min = int(sum(t["study_sec"] for t in totals.values()) // 60)
+    await ctx.send(
+        f"{day} 재계산: 유저 {len(totals)}명, 전체 순공 {format_minutes(total_study_min)} (로그 이벤트 {len(events)}개)",
+        file=discord.File(io.BytesIO("\n".join(lines).encode("utf-8")), filename=f"totals-{day}.csv"),
     )
 
 
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    """닉네임(공부레벨 표시)이 바뀌면 말투 단계 캐시에서 이전 닉네임 항목 지우기"""
+    if before.display_name != after.display_name:
+        invalidate_tone_tier(before)
+
+
 @bot.event
 async def on_command_error(ctx: commands.Context, error: Exception):
     """!AI횟수추가 인자 누락 시 사용법 안내"""
@@ -1349,6 +3432,7 @@ async def on_message(message: discord.Message):
     try:
         await _on_message_impl(message)
     finally:
+        state_store.mark_dirty(message.author.id)
         asyncio.create_task(_delete_lock_later(message.id))
     return  # process_commands는 _on_message_impl 안에서 호출
 
@@ -1361,7 +3445,6 @@ async def _delete_lock_later(message_id: int) -> None:
 
 async def _on_message_impl(message: discord.Message):
     """on_message 실제 처리 (중복 체크 후 여기서만 실행)."""
-    await maybe_reset_midnight()
     user_id = message.author.id
     guild = message.guild
 
@@ -1370,37 +3453,34 @@ async def _on_message_impl(message: discord.Message):
         content = (message.content or "").strip()
         minutes = parse_study_minutes_from_message(content)
         if minutes and minutes >= 1:
-            pledge_target_minutes[user_id] = minutes
-            pledge_completed_minutes[user_id] = 0  # 새 선언 시 누적 완료 분 초기화
             duration_str = format_minutes(minutes)
-            if message.author.voice and message.author.voice.channel:
-                in_pledge_already = message.author.voice.channel.id == STUDY_PLEDGE_VOICE_CHANNEL_ID
-                try:
+            in_voice = bool(message.author.voice and message.author.voice.channel)
+            async with user_locks.hold(user_id):
+                pledge_state = get_user_state(user_id)
+                pledge_state.pledge_target_min = minutes
+                pledge_state.pledge_done_min = 0.0  # 새 선언 시 누적 완료 분 초기화
+                state_store.record_event("pledge", user_id, minutes=minutes)
+                if in_voice:
+                    in_pledge_already = message.author.voice.channel.id == STUDY_PLEDGE_VOICE_CHANNEL_ID
                     target_voice = guild.get_channel(STUDY_PLEDGE_VOICE_CHANNEL_ID)
                     if isinstance(target_voice, discord.VoiceChannel) and not in_pledge_already:
-                        await message.author.move_to(target_voice)
+                        # 이동은 큐에 넣고 바로 진행 (실패하면 큐에서 경고만)
+                        queue_move(message.author, target_voice, "선언 공부방 이동")
                     if in_pledge_already:
-                        pledge_room_entered_at[user_id] = time.time()
-                        st = get_user_state(user_id)
-                        st["in_study"] = True
-                        st["current_channel_id"] = STUDY_PLEDGE_VOICE_CHANNEL_ID
-                        st["last_join_at"] = time.time()
-                    pledge_ch = guild.get_channel(STUDY_PLEDGE_TEXT_CHANNEL_ID)
-                    pledge_tone = get_tone_tier(message.author, guild) if guild else "snarky"
-                    if pledge_ch and isinstance(pledge_ch, (discord.TextChannel, discord.Thread)):
-                        await pledge_ch.send(pledge_commit_message(message.author.mention, duration_str, pledge_tone))
-                except Exception as e:
-                    print(f"[WARN] 선언 공부방 이동 실패: {e}")
-                    pledge_ch = guild.get_channel(STUDY_PLEDGE_TEXT_CHANNEL_ID)
-                    pledge_tone = get_tone_tier(message.author, guild) if guild else "snarky"
-                    if pledge_ch and isinstance(pledge_ch, (discord.TextChannel, discord.Thread)):
+                        pledge_state.pledge_entered_at = time.time()
+                        pledge_state.in_study = True
+                        pledge_state.current_channel_id = STUDY_PLEDGE_VOICE_CHANNEL_ID
+                        pledge_state.last_join_at = time.time()
+                        mark_study_active(guild.id, user_id)
+            # 안내 메시지 전송은 잠금 밖에서
+            if in_voice:
+                pledge_ch = guild.get_channel(STUDY_PLEDGE_TEXT_CHANNEL_ID)
+                pledge_tone = get_tone_tier(message.author, guild) if guild else "snarky"
+                if pledge_ch and isinstance(pledge_ch, (discord.TextChannel, discord.Thread)):
+                    try:
                         await pledge_ch.send(pledge_commit_message(message.author.mention, duration_str, pledge_tone))
-                    if in_pledge_already:
-                        pledge_room_entered_at[user_id] = time.time()
-                        st = get_user_state(user_id)
-                        st["in_study"] = True
-                        st["current_channel_id"] = STUDY_PLEDGE_VOICE_CHANNEL_ID
-                        st["last_join_at"] = time.time()
+                    except discord.Forbidden:
+                        pass
             else:
                 try:
                     ch = guild.get_channel(NOTICE_TEXT_CHANNEL_ID)
@@ -1411,27 +3491,29 @@ async def _on_message_impl(message: discord.Message):
         await bot.process_commands(message)
         return
 
-    if user_id not in completed_quota_today:
-        message_count_today[user_id] = message_count_today.get(user_id, 0) + 1
-        if message_count_today[user_id] > CHAT_LIMIT_FOR_NON_QUOTA:
-            try:
-                await message.delete()
-            except (discord.Forbidden, discord.NotFound):
-                pass
-            try:
-                chat_tone = get_tone_tier(message.author, guild) if guild else "snarky"
-                await message.channel.send(chat_limit_pinchan(message.author.mention, chat_tone))
-            except discord.Forbidden:
-                pass
+    over_chat_limit = False
+    async with user_locks.hold(user_id):
+        state = get_user_state(user_id)
+        if not state.quota_done:
+            state.message_count += 1
+            over_chat_limit = state.message_count > CHAT_LIMIT_FOR_NON_QUOTA
             # 6회 넘기면 채팅 제한 역할 부여 → 진짜 채팅 불가
-            if CHAT_RESTRICTED_ROLE_ID is not None:
-                role = message.guild.get_role(CHAT_RESTRICTED_ROLE_ID)
+            if over_chat_limit and CHAT_RESTRICTED_ROLE_ID is not None and guild is not None:
+                role = guild.get_role(CHAT_RESTRICTED_ROLE_ID)
                 if role and role not in message.author.roles:
-                    try:
-                        await message.author.add_roles(role)
-                        restricted_chat_user_ids.add(user_id)
-                    except discord.Forbidden:
-                        pass
+                    queue_role(message.author, role, add=True)
+                    restricted_chat_user_ids.add(user_id)
+                    state_store.mark_meta_dirty()
+    if over_chat_limit:
+        try:
+            await message.delete()
+        except (discord.Forbidden, discord.NotFound):
+            pass
+        try:
+            chat_tone = get_tone_tier(message.author, guild) if guild else "snarky"
+            await message.channel.send(chat_limit_pinchan(message.author.mention, chat_tone))
+        except discord.Forbidden:
+            pass
 
     # AI 채널: 기회 제한 (1 + 순공 1시간당 1회, 사용 시 1회 차감)
     if message.channel.id == AI_CHAT_CHANNEL_ID and not message.content.strip().startswith("!"):
@@ -1444,12 +3526,26 @@ async def _on_message_impl(message: discord.Message):
             await bot.process_commands(message)
             return
 
-        await maybe_reset_midnight()
-        update_user_study_time(user_id)
-        state = get_user_state(user_id)
-        study_hours = int(state["total_study_sec"] // 3600)
-        used = ai_usage_count_today.get(user_id, 0)
-        remaining = max(0, 1 + study_hours - used)
+        # 순공·할당량·AI 기회 조회는 Gemini 없이 바로 (기회 차감 없음)
+        intent = classify_ai_intent(content) if not has_image else None
+        if intent is not None:
+            started = time.perf_counter()
+            reply = local_ai_reply(message.author, intent)
+            ai_local_latencies.append(time.perf_counter() - started)
+            ai_route_counts["local"] += 1
+            try:
+                await message.channel.send(reply)
+            except discord.Forbidden:
+                pass
+            await bot.process_commands(message)
+            return
+        ai_route_counts["model"] += 1
+
+        async with user_locks.hold(user_id):
+            update_user_study_time(user_id)
+            state = get_user_state(user_id)
+            study_hours = int(state.total_study_sec // 3600)
+            remaining = max(0, 1 + study_hours - state.ai_used)
 
         if remaining <= 0:
             try:
@@ -1466,43 +3562,81 @@ async def _on_message_impl(message: discord.Message):
             return
 
         # 순공 조회는 !순공시간 명령어로만. 그 외 전부 AI로 처리
-        image_bytes = None
-        image_mime = "image/jpeg"
+        image = None
         for a in message.attachments:
             if a.content_type and a.content_type.startswith("image/"):
-                try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(a.url) as resp:
-                            if resp.status == 200:
-                                image_bytes = await resp.read()
-                                image_mime = a.content_type or "image/jpeg"
-                except Exception as e:
-                    print(f"[WARN] 이미지 다운로드 실패: {e}")
+                image = await prepare_image(a)
                 break
         # 시도 순서 도는 동안 디스코드에 "입력 중..." 표시 (레벨/서버주인에 따라 AI 말투 조절)
         study_level = parse_study_level(message.author) if isinstance(message.author, discord.Member) else 0
         is_owner = message.guild is not None and message.guild.owner_id == message.author.id
+        waiting_notice = None
+        stream = StreamingReply(message.channel) if GEMINI_STREAMING else None
+
+        async def on_queued(position: int) -> None:
+            nonlocal waiting_notice
+            try:
+                waiting_notice = await message.channel.send(
+                    f"{message.author.mention} 지금 AI 질문이 몰려서 대기 {position}번째예요. 차례 되면 바로 답할게요."
+                )
+            except discord.Forbidden:
+                pass
+
         try:
             async with message.channel.typing():
-                gemini_reply, model_used = await get_gemini_reply(
-                    content or "이거 봐줘.", image_bytes, image_mime,
+                gemini_reply, model_used, from_cache = await get_ai_reply(
+                    content or "이거 봐줘.", image,
                     study_level=study_level, is_owner=is_owner,
+                    user_id=user_id, on_queued=on_queued,
+                    on_text=stream.update if stream is not None else None,
                 )
+        except AiRequestRejected as e:
+            # 받지 않은 요청은 기회 차감 없이 안내만
+            if e.reason == "duplicate":
+                text = f"{message.author.mention} 앞에 보낸 질문 답 만드는 중이에요. 그거 끝나고 다시 물어봐 주세요."
+            else:
+                text = f"{message.author.mention} 지금 AI 질문이 너무 많아요. 잠시 뒤에 다시 물어봐 주세요. (기회는 차감 안 됐어요)"
+            try:
+                await message.channel.send(text)
+            except discord.Forbidden:
+                pass
+            await bot.process_commands(message)
+            return
         except Exception:
-            gemini_reply, model_used = None, None
+            gemini_reply, model_used, from_cache = None, None, False
+        finally:
+            if waiting_notice is not None:
+                try:
+                    await waiting_notice.delete()
+                except discord.HTTPException:
+                    pass
         if gemini_reply and gemini_reply.strip():
             try:
-                await message.channel.send(gemini_reply[:2000])
-            except discord.Forbidden:
+                if stream is not None and stream.messages:
+                    await stream.finish(gemini_reply)
+                else:
+                    # 2000자 넘으면 잘라내지 않고 여러 메시지로
+                    for chunk in split_notice_lines(gemini_reply.split("\n")):
+                        await message.channel.send(chunk)
+            except discord.HTTPException:
                 pass
         else:
             try:
-                await message.channel.send(GEMINI_QUOTA_MESSAGE)
-            except discord.Forbidden:
+                if stream is not None and stream.messages:
+                    # 중간에 끊긴 답변이 남아 있으면 그 자리를 안내로 바꿈
+                    await stream.abort(GEMINI_QUOTA_MESSAGE)
+                else:
+                    await message.channel.send(GEMINI_QUOTA_MESSAGE)
+            except discord.HTTPException:
                 pass
 
-        ai_usage_count_today[user_id] = ai_usage_count_today.get(user_id, 0) + 1
-        left = max(0, 1 + study_hours - ai_usage_count_today[user_id])
+        # Gemini 기다리는 동안은 잠금 안 잡음 (그 사이 음성 이벤트가 밀리지 않게) → 차감만 다시 잡고
+        async with user_locks.hold(user_id):
+            state = get_user_state(user_id)
+            # 캐시된 답변은 Gemini를 안 불렀으니 기회 차감 없음
+            if not from_cache:
+                state.ai_used += 1
+            left = max(0, 1 + study_hours - state.ai_used)
         try:
             await message.channel.send(f"{message.author.mention} 기회 **{left}번** 남았어요.")
         except discord.Forbidden:
@@ -1511,12 +3645,128 @@ async def _on_message_impl(message: discord.Message):
     await bot.process_commands(message)
 
 
+# ---------- 음성 채널 이동 묶기 (방 빠르게 옮겨 다닐 때) ----------
+# 시간 정산·상태 변경은 이벤트마다 바로 하고, 디스코드로 나가는 음소거·안내만 묶음.
+# 조용하던 유저의 첫 이벤트는 바로 적용, 그 뒤 VOICE_DEBOUNCE_SECONDS 안에 또 움직이면 마지막 이벤트 것만
+# 잠잠해진 뒤 적용(중간 것은 버리고 셈). 계속 옮겨 다녀도 VOICE_DEBOUNCE_MAX_SECONDS 넘게 미루지는 않음.
+VOICE_DEBOUNCE_SECONDS = 1.5
+VOICE_DEBOUNCE_MAX_SECONDS = 5.0
+
+
+class VoiceEffects:
+    """음성 이벤트 하나가 만든 디스코드 쪽 일: 서버 음소거 목표(None = 안 바꿈), 안내 줄들"""
+
+    __slots__ = ("mute", "notices")
+
+    def __init__(self) -> None:
+        self.mute: bool | None = None
+        self.notices: list[str] = []
+
+    def set_mute(self, mute: bool) -> None:
+        self.mute = mute
+
+    def notice(self, content: str) -> None:
+        self.notices.append(content)
+
+
+class VoiceDebouncer:
+    """유저별로 음성 이벤트 부수효과를 묶음. 마감은 deadline_scheduler의 ("voice", user_id) 예약으로."""
+
+    def __init__(self) -> None:
+        # user_id -> None(방금 바로 적용함, 창 열림) 또는 (member, 미룬 effects, 처음 미룬 시각)
+        self._pending: dict[int, tuple | None] = {}
+        self.events = 0
+        self.immediate = 0
+        self.deferred = 0
+        self.suppressed_mutes = 0
+        self.suppressed_notices = 0
+
+    def submit(self, member: discord.Member, effects: VoiceEffects) -> None:
+        user_id = member.id
+        self.events += 1
+        now = time.time()
+        if user_id not in self._pending:
+            self.immediate += 1
+            self._apply(member, effects)
+            self._pending[user_id] = None
+            deadline_scheduler.schedule(("voice", user_id), now + VOICE_DEBOUNCE_SECONDS, self._flush, user_id)
+            return
+        previous = self._pending[user_id]
+        first_at = now
+        if previous is not None:
+            # 아직 안 나간 이전 이동의 음소거·안내는 버림 (최종 방 기준으로만 적용)
+            self._suppress(previous[1])
+            first_at = previous[2]
+        self._pending[user_id] = (member, effects, first_at)
+        flush_at = min(now + VOICE_DEBOUNCE_SECONDS, first_at + VOICE_DEBOUNCE_MAX_SECONDS)
+        deadline_scheduler.schedule(("voice", user_id), flush_at, self._flush, user_id)
+
+    def _suppress(self, effects: VoiceEffects) -> None:
+        if effects.mute is not None:
+            self.suppressed_mutes += 1
+        self.suppressed_notices += len(effects.notices)
+
+    async def _flush(self, user_id: int) -> None:
+        entry = self._pending.pop(user_id, None)
+        if entry is None:
+            return
+        member, effects, _ = entry
+        self.deferred += 1
+        # 그 사이 멤버 정보(음성 상태)가 바뀌었을 수 있으니 캐시에서 다시
+        member = member.guild.get_member(user_id) or member
+        self._apply(member, effects)
+        # 적용한 뒤에도 잠깐은 창을 열어 둠 → 바로 또 움직이면 다시 묶임
+        self._pending[user_id] = None
+        deadline_scheduler.schedule(("voice", user_id), time.time() + VOICE_DEBOUNCE_SECONDS, self._flush, user_id)
+
+    def _apply(self, member: discord.Member, effects: VoiceEffects) -> None:
+        if effects.mute is not None:
+            voice = member.voice
+            key = ("mute", member.guild.id, member.id)
+            if voice is None:
+                self.suppressed_mutes += 1  # 이미 음성 채널을 나감 → 음소거 못 바꿈
+            elif voice.mute == effects.mute and not discord_actions.is_pending(key):
+                self.suppressed_mutes += 1  # 이미 원하는 상태
+            else:
+                queue_mute(member, effects.mute)
+        for content in effects.notices:
+            send_notice(member.guild, content)
+
+    def stats(self) -> dict:
+        return {
+            "events": self.events,
+            "immediate": self.immediate,
+            "deferred": self.deferred,
+            "suppressed_mutes": self.suppressed_mutes,
+            "suppressed_notices": self.suppressed_notices,
+            "open": len(self._pending),
+        }
+
+
+voice_debouncer = VoiceDebouncer()
+
+
 @bot.event
 async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
     """음성 채널 입장/이동/퇴장 감지해서 공부 시간 로직 처리"""
     if member.bot:
         return
+    try:
+        # 같은 유저의 이벤트·마감 타이머와 섞이지 않게 (다른 유저 이벤트는 동시에)
+        async with user_locks.hold(member.id):
+            effects = VoiceEffects()
+            await _on_voice_state_update_impl(member, before, after, effects)
+            if before.channel != after.channel:  # 자기 음소거·헤드폰 변경만 한 이벤트는 묶기 대상 아님
+                voice_debouncer.submit(member, effects)
+    finally:
+        # 처리 중 바뀐 상태를 다음 저장 때 기록
+        state_store.mark_dirty(member.id)
+
 
+async def _on_voice_state_update_impl(
+    member: discord.Member, before: discord.VoiceState, after: discord.VoiceState, effects: "VoiceEffects",
+):
+    """on_voice_state_update 실제 처리. 상태·시간 정산은 바로, 음소거·안내는 effects에 모아서 voice_debouncer가 적용."""
     user_id = member.id
     guild = member.guild
     state = get_user_state(user_id)
@@ -1528,65 +3778,67 @@ async def on_voice_state_update(member: discord.Member, before: discord.VoiceSta
     if old_channel_id == new_channel_id:
         return
 
-    # 우선, 직전까지의 공부 시간 정산
+    if old_channel_id is None:
+        state_store.record_event("join", user_id, to=new_channel_id)
+    elif new_channel_id is None:
+        state_store.record_event("leave", user_id, **{"from": old_channel_id})
+    else:
+        state_store.record_event("move", user_id, to=new_channel_id, **{"from": old_channel_id})
+
+    # 우선, 직전까지의 공부 시간 정산 (채널이 바뀌면 기존 세션은 끝 → 활성 인덱스에서 제거, 공부방 입장 시 다시 등록)
     update_user_study_time(user_id)
+    unmark_study_active(guild.id, user_id)
 
     # 쉼터에서 나갔으면 누적 시간 반영 + 로그 후 기록 삭제
     if old_channel_id is not None and is_rest_channel(old_channel_id):
-        entered = rest_entered_at.get(user_id)
+        entered = state.rest_entered_at
+        state.rest_entered_at = None
+        cancel_rest_timers(user_id)
         if entered is not None:
             elapsed = int(time.time() - entered)
-            rest_total_seconds_today[user_id] = rest_total_seconds_today.get(user_id, 0) + elapsed
-            visit_count = rest_visit_count_today.get(user_id, 0)
+            state.rest_total_sec += elapsed
             m = elapsed // 60
-            total_m = rest_total_seconds_today[user_id] // 60
-            await send_notice(guild, f"{member.mention} 쉼터 나감. 이번에 {m}분 쉼. 오늘 총 {visit_count}번 방문, 누적 {total_m}분.")
-        rest_entered_at.pop(user_id, None)
-        rest_pinch_sent.pop(user_id, None)
+            total_m = state.rest_total_sec // 60
+            effects.notice(f"{member.mention} 쉼터 나감. 이번에 {m}분 쉼. 오늘 총 {state.rest_visits}번 방문, 누적 {total_m}분.")
 
     # 공부방/선언방에서 나갔으면 로그 (방금 N분 + 오늘 총 M분)
     if old_channel_id is not None and (is_study_channel(old_channel_id) or is_pledge_voice_channel(old_channel_id)):
         if is_pledge_voice_channel(old_channel_id):
-            entered = pledge_room_entered_at.get(user_id)
-            pledge_room_entered_at.pop(user_id, None)
+            entered = state.pledge_entered_at
+            state.pledge_entered_at = None
             this_m = (time.time() - entered) / 60 if entered else 0
-            pledge_completed_minutes[user_id] = pledge_completed_minutes.get(user_id, 0) + this_m
+            state.pledge_done_min += this_m
             # total_study_sec는 위 update_user_study_time()에서 이미 선언방 시간이 반영됨 → 여기서 다시 더하면 중복
-            target = pledge_target_minutes.get(user_id, 0)
-            remain = max(0, target - pledge_completed_minutes[user_id])
-            if pledge_completed_minutes[user_id] >= target and target > 0:
-                pledge_target_minutes.pop(user_id, None)
-                pledge_completed_minutes.pop(user_id, None)
-            today_total_sec = state["total_study_sec"] + state.get("session_study_sec", 0)
+            target = state.pledge_target_min
+            remain = max(0, target - state.pledge_done_min)
+            if state.pledge_done_min >= target and target > 0:
+                state.clear_pledge()
+            today_total_sec = state.total_study_sec + state.session_study_sec
             today_m = int(today_total_sec // 60)
-            await send_notice(guild, f"{member.mention} 선언 공부방 나감. 방금 {format_minutes(int(this_m))} 공부했고, 오늘 총 {format_minutes(today_m)} 공부했음. (선언 목표 중 앞으로 {format_minutes(int(remain))} 더)")
+            effects.notice(f"{member.mention} 선언 공부방 나감. 방금 {format_minutes(int(this_m))} 공부했고, 오늘 총 {format_minutes(today_m)} 공부했음. (선언 목표 중 앞으로 {format_minutes(int(remain))} 더)")
         else:
-            if user_id in completed_quota_today:
-                this_sec = state.get("session_study_sec", 0)
-                today_total_sec = state["total_study_sec"] + this_sec
-                await send_notice(guild, study_leave_log_message(
+            if state.quota_done:
+                this_sec = state.session_study_sec
+                today_total_sec = state.total_study_sec + this_sec
+                state.session_study_sec = 0.0
+                effects.notice(study_leave_log_message(
                     member.mention,
                     int(this_sec // 60),
                     int(today_total_sec // 60),
                 ))
-                state["session_study_sec"] = 0.0
             else:
-                start_sec = state.get("session_start_total_sec", 0)
-                this_sec = max(0, state["total_study_sec"] - start_sec)
+                this_sec = max(0, state.total_study_sec - state.session_start_total_sec)
                 this_mins = int(this_sec // 60)
-                await send_notice(guild, study_leave_log_message(
+                if state.pledge_target_min:
+                    state.pledge_done_min += this_mins
+                    if state.pledge_done_min >= state.pledge_target_min:
+                        state.clear_pledge()
+                effects.notice(study_leave_log_message(
                     member.mention,
                     this_mins,
-                    int(state["total_study_sec"] // 60),
+                    int(state.total_study_sec // 60),
                 ))
-                if pledge_target_minutes.get(user_id):
-                    pledge_completed_minutes[user_id] = pledge_completed_minutes.get(user_id, 0) + this_mins
-                    if pledge_completed_minutes[user_id] >= pledge_target_minutes[user_id]:
-                        pledge_target_minutes.pop(user_id, None)
-                        pledge_completed_minutes.pop(user_id, None)
-        state["in_study"] = False
-        state["current_channel_id"] = None
-        state["last_join_at"] = None
+        state.end_study()
 
     # ===== 1) 완전히 보이스를 나간 경우 =====
     if old_channel_id is not None and new_channel_id is None:
@@ -1601,103 +3853,84 @@ async def on_voice_state_update(member: discord.Member, before: discord.VoiceSta
 
         # --- 쉼터 입장 ---
         if joined_rest:
-            state["in_study"] = False
-            state["current_channel_id"] = None
-            state["last_join_at"] = None
-            rest_entered_at[user_id] = time.time()
-            rest_pinch_sent[user_id] = set()
-            rest_visit_count_today[user_id] = rest_visit_count_today.get(user_id, 0) + 1
-            total_rest_m = int(rest_total_seconds_today.get(user_id, 0) // 60)
-            visit_count = rest_visit_count_today[user_id]
-            try:
-                await member.edit(mute=False)
-            except discord.Forbidden:
-                print(f"[WARN] {member} 서버 음소거 해제 권한 없음")
-            await send_notice(guild, rest_entry_message(member.mention, tone))
-            await send_notice(guild, f"{member.mention} 쉼터 입장. 오늘 {visit_count}번째 방문, 지금까지 누적 {total_rest_m}분 쉼.")
+            state.end_study()
+            state.rest_entered_at = time.time()
+            arm_rest_timers(guild.id, user_id)
+            state.rest_visits += 1
+            total_rest_m = int(state.rest_total_sec // 60)
+            visit_count = state.rest_visits
+            effects.set_mute(False)
+            effects.notice(rest_entry_message(member.mention, tone))
+            effects.notice(f"{member.mention} 쉼터 입장. 오늘 {visit_count}번째 방문, 지금까지 누적 {total_rest_m}분 쉼.")
             return
 
         # --- 해방 입장 (할당량 안 채우고 들어오면 음소거 + 꼽주기) ---
         if joined_freedom:
-            state["in_study"] = False
-            state["current_channel_id"] = None
-            state["last_join_at"] = None
-            if user_id in completed_quota_today:
-                try:
-                    await member.edit(mute=False)
-                except discord.Forbidden:
-                    print(f"[WARN] {member} 서버 음소거 해제 권한 없음")
-                await send_notice(guild, freedom_quota_done_taunt(member.mention, tone))
+            state.end_study()
+            if state.quota_done:
+                effects.set_mute(False)
+                effects.notice(freedom_quota_done_taunt(member.mention, tone))
             else:
                 # 할당량 안 채운 사람: 서버 음소거 + 꼽주기
-                try:
-                    await member.edit(mute=True)
-                except discord.Forbidden:
-                    print(f"[WARN] {member} 서버 음소거 권한 없음")
-                await send_notice(guild, freedom_taunt_message(member.mention, tone))
+                effects.set_mute(True)
+                effects.notice(freedom_taunt_message(member.mention, tone))
             return
 
         # --- 스스로 N시간 공부 선언 음성방 입장 (선언했을 때만 타이머, 아니면 안내만) ---
         if is_pledge_voice_channel(new_channel_id):
-            try:
-                await member.edit(mute=True)
-            except discord.Forbidden:
-                print(f"[WARN] {member} 서버 음소거 권한 없음")
-            target = pledge_target_minutes.get(user_id)
-            if not target or target <= 0:
-                await send_notice(guild, pledge_room_no_declaration_message(member.mention, tone))
+            effects.set_mute(True)
+            target = state.pledge_target_min
+            if target <= 0:
+                effects.notice(pledge_room_no_declaration_message(member.mention, tone))
                 return
-            state["in_study"] = True
-            state["current_channel_id"] = new_channel_id
-            state["last_join_at"] = time.time()
-            pledge_room_entered_at[user_id] = time.time()
-            completed = pledge_completed_minutes.get(user_id, 0)
-            remain = max(0, target - int(completed))
-            await send_notice(guild, f"{member.mention} 선언한 공부방 입장. 선언한 {format_minutes(target)} 중 앞으로 {format_minutes(remain)} 더 하면 됨. 지켜라.")
+            state.in_study = True
+            state.current_channel_id = new_channel_id
+            state.last_join_at = time.time()
+            state.pledge_entered_at = time.time()
+            mark_study_active(guild.id, user_id)
+            remain = max(0, target - int(state.pledge_done_min))
+            effects.notice(f"{member.mention} 선언한 공부방 입장. 선언한 {format_minutes(target)} 중 앞으로 {format_minutes(remain)} 더 하면 됨. 지켜라.")
             return
 
         # --- 공부방 입장 ---
         if joined_study:
             # 이번 세션 시작 시점의 누적 시간 저장 (퇴장 시 "방금 N분" 계산용)
-            state["session_start_total_sec"] = state["total_study_sec"]
+            state.session_start_total_sec = state.total_study_sec
             # 재방문(할당량 이미 채움): 세션만 0으로 시작, 꼽주기 멘트
-            if user_id in completed_quota_today:
-                state["session_study_sec"] = 0.0
-            state["in_study"] = True
-            state["current_channel_id"] = new_channel_id
-            state["last_join_at"] = time.time()
+            if state.quota_done:
+                state.session_study_sec = 0.0
+            state.in_study = True
+            state.current_channel_id = new_channel_id
+            state.last_join_at = time.time()
+            mark_study_active(guild.id, user_id)
 
             # 선언한 시간이 있으면: 여기서 공부해도 선언한 만큼 해야 한다고 안내
-            target = pledge_target_minutes.get(user_id)
-            if target and target > 0:
-                completed = pledge_completed_minutes.get(user_id, 0)
-                remain = max(0, target - int(completed))
-                await send_notice(guild, pledge_priority_in_other_room_message(
+            target = state.pledge_target_min
+            if target > 0:
+                remain = max(0, target - int(state.pledge_done_min))
+                effects.notice(pledge_priority_in_other_room_message(
                     member.mention, format_minutes(target), format_minutes(remain), tone,
                 ))
             else:
                 # 재방문 시(이미 오늘 공부한 적 있음) 로그에 오늘 총 공부 시간 안내
-                today_total_sec = state["total_study_sec"] + state.get("session_study_sec", 0)
+                today_total_sec = state.total_study_sec + state.session_study_sec
                 if today_total_sec > 0:
-                    await send_notice(guild, f"{member.mention} 공부방 입장. 오늘 총 {format_minutes(int(today_total_sec // 60))} 공부했음.")
+                    effects.notice(f"{member.mention} 공부방 입장. 오늘 총 {format_minutes(int(today_total_sec // 60))} 공부했음.")
 
-            try:
-                await member.edit(mute=True)
-            except discord.Forbidden:
-                print(f"[WARN] {member} 서버 음소거 권한 없음 (Mute Members 권한 확인 필요)")
+            effects.set_mute(True)
 
             remaining = get_remaining_minutes(user_id, new_channel_id)
             limit_minutes = ROOM_LIMIT_MINUTES.get(new_channel_id, 9999)
 
-            if user_id in completed_quota_today:
-                await send_notice(guild, study_reentry_message(member.mention, tone))
+            if state.quota_done:
+                effects.notice(study_reentry_message(member.mention, tone))
                 return
 
             # 선언한 시간이 있으면 이 공부방 입장 멘트는 생략 (위에서 선언 우선 안내만 함)
-            if pledge_target_minutes.get(user_id):
+            if state.pledge_target_min:
                 return
 
-            total_minutes = int(state["total_study_sec"] // 60)
+            total_minutes = int(state.total_study_sec // 60)
             # 시간무제한 음소거 공부방 전용 멘트
             if new_channel_id == CHANNELS["STUDY_UNLIMITED_MUTE"]:
                 core = study_unlimited_mute_message(tone)
@@ -1713,172 +3946,220 @@ async def on_voice_state_update(member: discord.Member, before: discord.VoiceSta
             if remaining <= 0 and limit_minutes < 9999:
                 msg += study_room_entry_zero_extra(tone)
 
-            await send_notice(guild, msg)
+            effects.notice(msg)
             return
 
         # --- 공부/쉼터/해방이 아닌 다른 음성 채널 ---
-        state["in_study"] = False
-        state["current_channel_id"] = None
-        state["last_join_at"] = None
-        try:
-            await member.edit(mute=False)
-        except discord.Forbidden:
-            print(f"[WARN] {member} 서버 음소거 해제 권한 없음")
+        state.end_study()
+        effects.set_mute(False)
 
 
-# ======================= 주기적 체크 루프 ==========================
-@tasks.loop(seconds=CHECK_INTERVAL_SECONDS)
-async def check_study_time():
-    """주기적으로 공부 시간 체크해서 다 된 사람 해방으로 이동시키기"""
-    await maybe_reset_midnight()
+# ======================= 공부 세션 마감 처리 ==========================
+def next_study_deadline(user_id: int, channel_id: int) -> float | None:
+    """지금 세션에서 다음으로 처리할 일이 생기는 시각(time.time() 기준). 없으면 None.
+    방 제한 시간 / 선언 목표 / 3시간 이상·무제한방 5시간 / AI 1회 충전(1시간 경계) 중 가장 빠른 것."""
+    now = time.time()
+    state = get_user_state(user_id)
+    if is_pledge_voice_channel(channel_id):
+        if state.pledge_entered_at is None or state.pledge_target_min <= 0:
+            return None
+        return state.pledge_entered_at + (state.pledge_target_min - state.pledge_done_min) * 60
+
+    running = now - state.last_join_at if state.last_join_at is not None else 0.0
+    quota_done = state.quota_done
+    # 할당량 미달이면 total, 이미 채웠으면 session에 쌓임 (update_user_study_time과 같은 규칙)
+    total_sec = state.total_study_sec + (0.0 if quota_done else running)
+    session_sec = state.session_study_sec + (running if quota_done else 0.0)
+    study_hours = int(total_sec // 3600)
+    five_hours_sec = 5 * 3600
+    is_unlimited_mute_room = channel_id == CHANNELS["STUDY_UNLIMITED_MUTE"]
+    candidates = []
+
+    # AI 1회 충전 안내: 아직 안내 안 한 시간이 있으면 바로, 아니면 다음 1시간 경계
+    if study_hours > state.ai_hour_announced:
+        candidates.append(now)
+    elif not quota_done:
+        candidates.append(now + (study_hours + 1) * 3600 - total_sec)
+
+    # 5시간 (3시간 이상 방: 해방 이동, 무제한방: 이동 가능 알림 한 번)
+    if channel_id in (CHANNELS["STUDY_3H_PLUS"], CHANNELS["STUDY_UNLIMITED_MUTE"]):
+        if total_sec >= five_hours_sec:
+            if is_unlimited_mute_room:
+                if not state.unlimited_5h_notified:
+                    candidates.append(now)
+                # 무제한방은 5시간 이후엔 이동시키지 않음 → 방 제한 마감도 없음
+                return min(candidates) if candidates else None
+            candidates.append(now)
+        elif not quota_done:
+            candidates.append(now + five_hours_sec - total_sec)
+
+    # 방 제한 시간
+    limit_sec = ROOM_LIMIT_MINUTES.get(channel_id, 9999) * 60
+    used_sec = session_sec if quota_done else total_sec
+    candidates.append(now + limit_sec - used_sec)
+    return min(candidates)
+
+
+def schedule_study_deadline(guild_id: int, user_id: int) -> None:
+    """현재 공부 세션의 다음 마감을 스케줄러에 (재)예약"""
+    state = user_days.get(user_id)
+    channel_id = state.current_channel_id if state else None
+    if not state or not state.in_study or not is_study_or_pledge_channel(channel_id):
+        deadline_scheduler.cancel(("study", user_id))
+        return
+    when = next_study_deadline(user_id, channel_id)
+    if when is None:
+        deadline_scheduler.cancel(("study", user_id))
+        return
+    deadline_scheduler.schedule(("study", user_id), when, on_study_deadline, guild_id, user_id)
 
-    for guild in bot.guilds:
-        for member in guild.members:
-            if member.bot:
-                continue
 
-            user_id = member.id
-            state = study_state.get(user_id)
-            if not state or not state["in_study"]:
-                continue
+async def on_study_deadline(guild_id: int, user_id: int) -> None:
+    """마감 시각 도달: 공부 시간 정산 후 다 된 사람 해방으로 이동 / 알림. 세션이 이어지면 다음 마감 예약."""
+    async with user_locks.hold(user_id):
+        await _on_study_deadline_impl(guild_id, user_id)
 
-            voice = member.voice
-            if voice is None or voice.channel is None:
-                continue
 
-            channel_id = voice.channel.id
-            if not is_study_or_pledge_channel(channel_id):
-                continue
+async def _on_study_deadline_impl(guild_id: int, user_id: int) -> None:
+    """on_study_deadline 실제 처리"""
+    guild = bot.get_guild(guild_id)
+    member = guild.get_member(user_id) if guild else None
+    state = user_days.get(user_id)
+    if member is None or not state or not state.in_study:
+        unmark_study_active(guild_id, user_id)
+        return
 
-            # 스스로 선언한 공부방: (선언 - 이미 채운 분 - 이번 세션 경과) 로 남은 시간 계산 (나갔다 들어와도 유지)
-            if is_pledge_voice_channel(channel_id):
-                state = get_user_state(user_id)
-                entered = pledge_room_entered_at.get(user_id)
-                target_min = pledge_target_minutes.get(user_id, 0)
-                completed_before = pledge_completed_minutes.get(user_id, 0)
-                if entered is None or target_min <= 0:
-                    continue
-                now = time.time()
-                this_session_min = (now - entered) / 60
-                remaining = target_min - completed_before - this_session_min
-                remaining = int(remaining) if remaining > 0 else 0
-                study_hours = 0  # 아래 분기에서 사용 (pledge는 무제한방 아님)
-            else:
-                update_user_study_time(user_id)
-                state = get_user_state(user_id)
-                study_hours = int(state["total_study_sec"] // 3600)
-                last_announced = ai_charged_hour_announced.get(user_id, -1)
-                if study_hours > last_announced:
-                    ai_charged_hour_announced[user_id] = study_hours
-                    try:
-                        await send_notice(guild, f"{member.mention} AI 이용횟수 1회 충전되었어요.")
-                    except Exception:
-                        pass
-                remaining = get_remaining_minutes(user_id, channel_id)
-                state = get_user_state(user_id)
-                study_hours = int(state["total_study_sec"] // 3600)
-            is_unlimited_mute_room = channel_id == CHANNELS["STUDY_UNLIMITED_MUTE"]
-            is_3h_plus_room = channel_id == CHANNELS["STUDY_3H_PLUS"]
-
-            # 정신과 시간(무제한)방: 5시간 되어도 해방으로 이동 안 함, 공부 로그에 "이동 가능하다" 알림만 (한 번만)
-            if is_unlimited_mute_room and study_hours >= 5:
-                completed_quota_today.add(user_id)
-                if user_id in restricted_chat_user_ids and CHAT_RESTRICTED_ROLE_ID is not None:
-                    role = guild.get_role(CHAT_RESTRICTED_ROLE_ID)
-                    if role and role in member.roles:
-                        try:
-                            await member.remove_roles(role)
-                        except discord.Forbidden:
-                            pass
-                    restricted_chat_user_ids.discard(user_id)
-                if user_id not in unlimited_room_5h_notified_today:
-                    unlimited_room_5h_notified_today.add(user_id)
-                    check_tone = get_tone_tier(member, guild)
-                    await send_notice(guild, unlimited_room_can_move_message(member.mention, check_tone))
-                continue
+    voice = member.voice
+    if voice is None or voice.channel is None or not is_study_or_pledge_channel(voice.channel.id):
+        unmark_study_active(guild_id, user_id)
+        return
+    channel_id = voice.channel.id
 
-            # 3시간 이상 공부방 / 정신과 시간공부방: 5시간 되면 해방 이동. 그 외 유한 방·선언방은 remaining <= 0 시 이동
-            if remaining <= 0 or (is_3h_plus_room and study_hours >= 5):
-                completed_quota_today.add(user_id)
-                if user_id in restricted_chat_user_ids and CHAT_RESTRICTED_ROLE_ID is not None:
-                    role = guild.get_role(CHAT_RESTRICTED_ROLE_ID)
-                    if role and role in member.roles:
-                        try:
-                            await member.remove_roles(role)
-                        except discord.Forbidden:
-                            pass
-                    restricted_chat_user_ids.discard(user_id)
-                if is_pledge_voice_channel(channel_id):
-                    now = time.time()
-                    session_min = (now - pledge_room_entered_at.get(user_id, now)) / 60
-                    pledge_completed_minutes[user_id] = pledge_completed_minutes.get(user_id, 0) + session_min
-                    pledge_room_entered_at.pop(user_id, None)
-                    pledge_target_minutes.pop(user_id, None)
-                    pledge_completed_minutes.pop(user_id, None)
-                freedom_channel = guild.get_channel(CHANNELS["FREEDOM"])
-                if isinstance(freedom_channel, discord.VoiceChannel):
-                    try:
-                        await member.move_to(freedom_channel)
-                    except Exception as e:
-                        print(f"해방 이동 실패 ({member}): {e}")
-                state["in_study"] = False
-                state["current_channel_id"] = None
-                state["last_join_at"] = None
+    # 스스로 선언한 공부방: (선언 - 이미 채운 분 - 이번 세션 경과) 로 남은 시간 계산 (나갔다 들어와도 유지)
+    if is_pledge_voice_channel(channel_id):
+        entered = state.pledge_entered_at
+        target_min = state.pledge_target_min
+        if entered is None or target_min <= 0:
+            return
+        this_session_min = (time.time() - entered) / 60
+        remaining = target_min - state.pledge_done_min - this_session_min
+        study_hours = 0  # 아래 분기에서 사용 (pledge는 무제한방 아님)
+    else:
+        update_user_study_time(user_id)
+        study_hours = int(state.total_study_sec // 3600)
+        if study_hours > state.ai_hour_announced:
+            state.ai_hour_announced = study_hours
+            state_store.mark_dirty(user_id)
+            send_notice(guild, f"{member.mention} AI 이용횟수 1회 충전되었어요.")
+        remaining = get_remaining_minutes(user_id, channel_id)
+    is_unlimited_mute_room = channel_id == CHANNELS["STUDY_UNLIMITED_MUTE"]
+    is_3h_plus_room = channel_id == CHANNELS["STUDY_3H_PLUS"]
+
+    # 정신과 시간(무제한)방: 5시간 되어도 해방으로 이동 안 함, 공부 로그에 "이동 가능하다" 알림만 (한 번만)
+    if is_unlimited_mute_room and study_hours >= 5:
+        state.quota_done = True
+        state_store.record_event("quota", user_id, channel=channel_id)
+        if user_id in restricted_chat_user_ids and CHAT_RESTRICTED_ROLE_ID is not None:
+            role = guild.get_role(CHAT_RESTRICTED_ROLE_ID)
+            if role and role in member.roles:
+                queue_role(member, role, add=False)
+            restricted_chat_user_ids.discard(user_id)
+            state_store.mark_meta_dirty()
+        if not state.unlimited_5h_notified:
+            state.unlimited_5h_notified = True
+            state_store.mark_dirty(user_id)
+            check_tone = get_tone_tier(member, guild)
+            send_notice(guild, unlimited_room_can_move_message(member.mention, check_tone))
+        schedule_study_deadline(guild_id, user_id)
+        return
 
-                try:
-                    await member.edit(mute=False)
-                except discord.Forbidden:
-                    print(f"[WARN] {member} 서버 음소거 해제 권한 없음")
+    # 3시간 이상 공부방 / 정신과 시간공부방: 5시간 되면 해방 이동. 그 외 유한 방·선언방은 remaining <= 0 시 이동
+    if remaining <= 0 or (is_3h_plus_room and study_hours >= 5):
+        state.quota_done = True
+        state_store.record_event("quota", user_id, channel=channel_id)
+        if user_id in restricted_chat_user_ids and CHAT_RESTRICTED_ROLE_ID is not None:
+            role = guild.get_role(CHAT_RESTRICTED_ROLE_ID)
+            if role and role in member.roles:
+                queue_role(member, role, add=False)
+            restricted_chat_user_ids.discard(user_id)
+            state_store.mark_meta_dirty()
+        if is_pledge_voice_channel(channel_id):
+            # 선언 달성: 이번 세션까지 채웠으니 선언 기록 초기화
+            state.pledge_entered_at = None
+            state.clear_pledge()
+        state.end_study()
+        unmark_study_active(guild_id, user_id)
+        state_store.mark_dirty(user_id)
+        freedom_channel = guild.get_channel(CHANNELS["FREEDOM"])
+        if isinstance(freedom_channel, discord.VoiceChannel):
+            queue_move(member, freedom_channel, "해방 이동")
+
+        queue_mute(member, False)
+
+        done_tone = get_tone_tier(member, guild)
+        send_notice(guild, snarky_done_message(member.mention, done_tone))
+        return
 
-                done_tone = get_tone_tier(member, guild)
-                await send_notice(guild, snarky_done_message(member.mention, done_tone))
+    # 아직 안 끝났으면 (AI 충전 안내만 했거나 정산 오차) 다음 마감 다시 예약
+    schedule_study_deadline(guild_id, user_id)
 
 
-@tasks.loop(seconds=60)
-async def check_rest_time():
-    """쉼터에 오래 있으면 5/10분 핀잔, 15분 시 공부방으로 강제 이동"""
-    await maybe_reset_midnight()
+# ======================= 쉼터 타이머 ==========================
+# 쉼터 입장 후 (분, 할 일): 5·10분 핀잔, 15분 3시간 공부방 강제 이동
+REST_TIMER_MINUTES = (5, 10, 15)
 
-    now = time.time()
-    for guild in bot.guilds:
-        study_room = guild.get_channel(CHANNELS["STUDY_3H"])
-        if not isinstance(study_room, discord.VoiceChannel):
-            continue
 
-        for member in guild.members:
-            if member.bot:
-                continue
-            voice = member.voice
-            if voice is None or voice.channel is None:
-                continue
-            if voice.channel.id != CHANNELS["REST"]:
-                continue
+def arm_rest_timers(guild_id: int, user_id: int) -> None:
+    """쉼터 입장 시각(rest_entered_at) 기준으로 5/10/15분 타이머 예약"""
+    entered = get_user_state(user_id).rest_entered_at
+    if entered is None:
+        return
+    for minute in REST_TIMER_MINUTES:
+        deadline_scheduler.schedule(
+            ("rest", user_id, minute), entered + minute * 60,
+            on_rest_deadline, guild_id, user_id, minute, entered,
+        )
 
-            user_id = member.id
-            entered = rest_entered_at.get(user_id)
-            if entered is None:
-                continue
 
-            elapsed_min = int((now - entered) / 60)
-            sent = rest_pinch_sent.setdefault(user_id, set())
+def cancel_rest_timers(user_id: int) -> None:
+    """쉼터에서 나가면 남은 타이머 해제"""
+    for minute in REST_TIMER_MINUTES:
+        deadline_scheduler.cancel(("rest", user_id, minute))
 
-            if elapsed_min >= 15:
-                try:
-                    await member.move_to(study_room)
-                except Exception as e:
-                    print(f"쉼터→공부방 이동 실패 ({member}): {e}")
-                rest_entered_at.pop(user_id, None)
-                rest_pinch_sent.pop(user_id, None)
-                rest_tone = get_tone_tier(member, guild)
-                await send_notice(guild, rest_force_move_15min(member.mention, rest_tone))
-            elif elapsed_min >= 10 and 10 not in sent:
-                sent.add(10)
-                rest_tone = get_tone_tier(member, guild)
-                await send_notice(guild, rest_pinch_10min(member.mention, rest_tone))
-            elif elapsed_min >= 5 and 5 not in sent:
-                sent.add(5)
-                rest_tone = get_tone_tier(member, guild)
-                await send_notice(guild, rest_pinch_5min(member.mention, rest_tone))
+
+async def on_rest_deadline(guild_id: int, user_id: int, minute: int, entered: float) -> None:
+    """쉼터에 오래 있으면 5/10분 핀잔, 15분 시 공부방으로 강제 이동"""
+    async with user_locks.hold(user_id):
+        await _on_rest_deadline_impl(guild_id, user_id, minute, entered)
+
+
+async def _on_rest_deadline_impl(guild_id: int, user_id: int, minute: int, entered: float) -> None:
+    """on_rest_deadline 실제 처리"""
+    # 그 사이 나갔다 다시 들어왔거나 자정 초기화됐으면 이번 타이머는 무효
+    state = user_days.get(user_id)
+    if state is None or state.rest_entered_at != entered:
+        return
+    guild = bot.get_guild(guild_id)
+    member = guild.get_member(user_id) if guild else None
+    if member is None:
+        return
+    voice = member.voice
+    if voice is None or voice.channel is None or voice.channel.id != CHANNELS["REST"]:
+        return
+
+    rest_tone = get_tone_tier(member, guild)
+    if minute >= 15:
+        study_room = guild.get_channel(CHANNELS["STUDY_3H"])
+        if not isinstance(study_room, discord.VoiceChannel):
+            return
+        queue_move(member, study_room, "쉼터→공부방 이동")
+        state.rest_entered_at = None
+        state_store.mark_dirty(user_id)
+        send_notice(guild, rest_force_move_15min(member.mention, rest_tone))
+    elif minute >= 10:
+        send_notice(guild, rest_pinch_10min(member.mention, rest_tone))
+    else:
+        send_notice(guild, rest_pinch_5min(member.mention, rest_tone))
 
 
 # ======================= 실행 ==========================
@@ -1886,4 +4167,19 @@ if __name__ == "__main__":
     token = os.getenv("DISCORD_TOKEN")
     if not token:
         raise SystemExit("DISCORD_TOKEN이 .env에 없습니다. .env 파일을 만들고 DISCORD_TOKEN=봇토큰 을 넣어 주세요.")
-    bot.run(token)
+
+    async def main() -> None:
+        try:
+            async with bot:
+                await bot.start(token)
+        finally:
+            await close_http_session()
+
+    discord.utils.setup_logging()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        state_store.close()
+        reply_cache.close()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# bot.py는 패키지가 아니라 저장소 루트의 단일 모듈
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,54 @@
+import asyncio
+
+import bot
+
+
+def test_more_than_max_in_flight_all_sent():
+    """동시 한도(ACTION_MAX_IN_FLIGHT)보다 많은 요청을 여러 경로에 넣어도 새 put 없이 전부 나가야 함"""
+    sent = []
+
+    async def action(i):
+        sent.append(i)
+
+    async def main():
+        queue = bot.ActionQueue()
+        queue.start()
+        total = bot.ACTION_MAX_IN_FLIGHT * 3 + 2
+        for i in range(total):
+            queue.put(bot.ACTION_NOTICE, ("channel", i), None, f"안내 {i}", action, i)
+        for _ in range(100):
+            if len(sent) == total:
+                break
+            await asyncio.sleep(0.01)
+        queue._task.cancel()
+        return total, queue.depth()
+
+    total, depth = asyncio.run(main())
+    assert sorted(sent) == list(range(total))
+    assert sum(depth.values()) == 0
+
+
+def test_moves_across_guilds_all_sent():
+    moved = []
+
+    async def move(guild_id, user_id):
+        await asyncio.sleep(0)
+        moved.append((guild_id, user_id))
+
+    async def main():
+        queue = bot.ActionQueue()
+        queue.start()
+        for guild_id in range(4):
+            for user_id in range(3):
+                queue.put(
+                    bot.ACTION_MOVE, ("members", guild_id), ("move", guild_id, user_id),
+                    "이동", move, guild_id, user_id,
+                )
+        for _ in range(100):
+            if len(moved) == 12:
+                break
+            await asyncio.sleep(0.01)
+        queue._task.cancel()
+
+    asyncio.run(main())
+    assert len(moved) == 12
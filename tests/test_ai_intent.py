@@ -0,0 +1,34 @@
+import pytest
+
+import bot
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("내 공부시간", "study_time"),
+    ("내공부시간 알려", "study_time"),
+    ("오늘 순공 얼마야", "study_time"),
+    ("오늘 몇 시간 했어?", "study_time"),
+    ("나 얼마나 공부했어", "study_time"),
+    ("얼마나 했지", "study_time"),
+    ("AI 기회 몇 번 남았어", "ai_credit"),
+    ("ai 몇번 남음", "ai_credit"),
+    ("할당량 얼마나 남았어", "quota"),
+    ("해방까지 몇분남?", "quota"),
+])
+def test_local_lookups(text, intent):
+    assert bot.classify_ai_intent(text) == intent
+
+
+@pytest.mark.parametrize("text", [
+    "내일 공부 계획 짜줘",
+    "내 공부 스타일 분석해줘",
+    "내신 공부 뭐부터 해?",
+    "내 시간 관리가 엉망이야",
+    "공부시간 늘리는 법",
+    "순공 늘리는 방법 알려줘",
+    "내일 시험인데 어떡하지",
+    "집중이 안 돼요",
+    "",
+])
+def test_advice_goes_to_model(text):
+    assert bot.classify_ai_intent(text) is None
@@ -0,0 +1,78 @@
+import asyncio
+import time
+
+import bot
+
+
+class FakeResponse:
+    def __init__(self, status: int, payload: dict) -> None:
+        self.status = status
+        self._payload = payload
+        self.headers = {}
+
+    async def json(self, content_type=None):
+        return self._payload
+
+    async def text(self):
+        return str(self._payload)
+
+
+class FakePost:
+    def __init__(self, behaviour) -> None:
+        self._behaviour = behaviour
+
+    async def __aenter__(self):
+        return await self._behaviour()
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    """모델 이름 -> (걸리는 시간, 상태 코드). 요청 시작 시각을 기록"""
+
+    def __init__(self, plan: dict[str, tuple[float, int]]) -> None:
+        self.plan = plan
+        self.started: dict[str, float] = {}
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        model = url.split("/models/")[1].split(":")[0]
+        delay, status = self.plan[model]
+        self.started[model] = time.monotonic()
+
+        async def behaviour():
+            await asyncio.sleep(delay)
+            payload = {"candidates": [{"content": {"parts": [{"text": f"{model} 답"}]}}]}
+            return FakeResponse(status, payload if status == 200 else {"error": {"message": "not found"}})
+
+        return FakePost(behaviour)
+
+
+def test_failed_hedge_starts_next_model_immediately(monkeypatch):
+    """헤지로 보낸 모델이 바로 404로 끝나면 헤지 시간을 또 기다리지 않고 다음 모델을 바로 시작"""
+    session = FakeSession({"slow": (5.0, 200), "missing": (0.0, 404), "fast": (0.0, 200)})
+    monkeypatch.setattr(bot, "GEMINI_API_KEY", "test")
+    monkeypatch.setattr(bot, "GEMINI_USE_ONLY_15_FLASH", True)
+    monkeypatch.setattr(bot, "GEMINI_15_FLASH_MODELS", ("slow", "missing", "fast"))
+    monkeypatch.setattr(bot, "GEMINI_PROMPT_CACHE", False)
+    monkeypatch.setattr(bot, "GEMINI_HEDGE_DEFAULT_DELAY_SECONDS", 0.3)
+    monkeypatch.setattr(bot, "gemini_health", bot.GeminiModelHealth())
+    monkeypatch.setattr(bot, "get_http_session", lambda: session)
+
+    started = time.monotonic()
+    text, model = asyncio.run(bot.get_gemini_reply("안녕"))
+
+    assert (text, model) == ("fast 답", "fast")
+    assert session.started["missing"] - started >= 0.25
+    assert session.started["fast"] - session.started["missing"] < 0.1
+
+
+def test_hedge_delay_borrows_samples_for_new_primary():
+    """기록이 적은 모델이 1순위가 돼도 다른 모델 기록으로 헤지 시간을 잡음 (기본 4초를 기다리지 않음)"""
+    health = bot.GeminiModelHealth()
+    for _ in range(bot.GEMINI_HEDGE_MIN_SAMPLES):
+        health.success("a", 0.3)
+    health.success("b", 0.3)
+
+    assert health.hedge_delay("b") == bot.GEMINI_HEDGE_MIN_DELAY_SECONDS
+    assert bot.GeminiModelHealth().hedge_delay("b") == bot.GEMINI_HEDGE_DEFAULT_DELAY_SECONDS
@@ -0,0 +1,19 @@
+import pytest
+
+import bot
+
+
+@pytest.mark.parametrize("status, body, dropped", [
+    (404, '{"error": {"code": 404, "message": "models/gemini-x is not found for API version v1beta"}}', False),
+    (404, '{"error": {"code": 404, "message": "CachedContent not found (or permission denied)"}}', True),
+    (404, '{"error": {"message": "cachedContents/abc123 not found"}}', True),
+    (400, '{"error": {"message": "Invalid image data"}}', False),
+    (400, '{"error": {"message": "Cached content is expired"}}', True),
+    (403, '{"error": {"message": "Permission denied"}}', True),
+    (500, '{"error": {"message": "cachedContents/abc123 internal"}}', False),
+])
+def test_rejected_only_on_cache_errors(status, body, dropped):
+    cache = bot.GeminiPromptCache()
+    cache._names[("m", "snarky")] = (float("inf"), "cachedContents/abc123")
+    assert cache.rejected("m", "snarky", status, body) is dropped
+    assert (("m", "snarky") in cache._names) is not dropped
@@ -0,0 +1,61 @@
+import datetime
+
+import bot
+
+DAY = "2026-01-10"
+START = datetime.datetime.strptime(DAY, "%Y-%m-%d").replace(tzinfo=bot.KST).timestamp()
+END = START + 24 * 3600
+STUDY = bot.CHANNELS["STUDY_1H"]
+PLEDGE = bot.STUDY_PLEDGE_VOICE_CHANNEL_ID
+HOUR = 3600.0
+
+
+def _log(*events):
+    return [{"seq": i, "ts": ts, "type": kind, "uid": uid, **fields} for i, (ts, kind, uid, fields) in enumerate(events)]
+
+
+def _study(totals, uid):
+    return totals.get(uid, {}).get("study_sec", 0.0)
+
+
+def test_pledge_room_counts_only_with_declaration():
+    events = _log(
+        # 1: 선언 없이 선언방 30분 → 공부 아님
+        (START + 1 * HOUR, "join", 1, {"to": PLEDGE}),
+        (START + 1.5 * HOUR, "leave", 1, {"from": PLEDGE}),
+        # 2: 60분 선언 후 선언방 30분 → 30분
+        (START + 2 * HOUR, "pledge", 2, {"minutes": 60}),
+        (START + 2 * HOUR + 60, "join", 2, {"to": PLEDGE}),
+        (START + 2.5 * HOUR + 60, "leave", 2, {"from": PLEDGE}),
+        # 3: 선언방에 있다가 10분 뒤 선언, 20분 더 → 20분만
+        (START + 3 * HOUR, "join", 3, {"to": PLEDGE}),
+        (START + 3 * HOUR + 600, "pledge", 3, {"minutes": 120}),
+        (START + 3.5 * HOUR, "leave", 3, {"from": PLEDGE}),
+        # 4: 30분 선언을 공부방에서 채운 뒤 선언방 → 선언 끝났으니 안 셈
+        (START + 4 * HOUR, "pledge", 4, {"minutes": 30}),
+        (START + 4 * HOUR, "join", 4, {"to": STUDY}),
+        (START + 4.5 * HOUR, "move", 4, {"from": STUDY, "to": PLEDGE}),
+        (START + 5 * HOUR, "leave", 4, {"from": PLEDGE}),
+    )
+    totals = bot.recompute_day_totals(events, DAY)
+    assert _study(totals, 1) == 0
+    assert _study(totals, 2) == 0.5 * HOUR
+    assert _study(totals, 3) == 0.5 * HOUR - 600
+    assert _study(totals, 4) == 0.5 * HOUR
+
+
+def test_out_of_order_timestamps_are_skipped_not_fatal():
+    events = _log(
+        (START + 1 * HOUR, "join", 1, {"to": STUDY}),
+        (START + 1 * HOUR, "join", 2, {"to": STUDY}),
+        (START + 3 * HOUR, "leave", 2, {"from": STUDY}),
+        # 다음 날 이벤트가 먼저 기록되고 (재시작 직후 입장), 그 뒤에 어제 시각의 퇴장이 기록됨
+        (END + 600, "join", 3, {"to": STUDY}),
+        (START + 2 * HOUR, "leave", 1, {"from": STUDY}),
+        # 2의 앞 이벤트보다 이른 시각의 퇴장 → 건너뜀
+        (START + 2 * HOUR, "leave", 2, {"from": STUDY}),
+    )
+    totals = bot.recompute_day_totals(events, DAY)
+    assert _study(totals, 1) == 1 * HOUR
+    assert _study(totals, 2) == 2 * HOUR
+    assert 3 not in totals
@@ -0,0 +1,60 @@
+import asyncio
+import datetime
+import os
+
+import bot
+
+
+def _start_of_today() -> float:
+    return datetime.datetime.strptime(bot.kst_today(), "%Y-%m-%d").replace(tzinfo=bot.KST).timestamp()
+
+
+def test_rollover_settles_running_sessions_to_midnight(tmp_path, monkeypatch):
+    """자정 전환 전에 진행 중인 공부·쉼터 세션을 어제 00시 경계까지 정산해서 어제 기록에 넣어야 함"""
+    store = bot.StateStore(os.path.join(tmp_path, "s.sqlite3"), os.path.join(tmp_path, "log"))
+    monkeypatch.setattr(bot, "state_store", store)
+    monkeypatch.setattr(bot, "deadline_scheduler", bot.DeadlineScheduler())
+    monkeypatch.setattr(bot, "user_days", {})
+    monkeypatch.setattr(bot, "active_study_sessions", {})
+    midnight = _start_of_today()
+    yesterday = datetime.datetime.fromtimestamp(midnight - 3600, bot.KST).strftime("%Y-%m-%d")
+    monkeypatch.setattr(bot, "last_reset_date", yesterday)
+
+    studying = bot.get_user_state(1)
+    studying.in_study = True
+    studying.last_join_at = midnight - 3600
+    resting = bot.get_user_state(2)
+    resting.rest_entered_at = midnight - 600
+
+    asyncio.run(bot.roll_over_day())
+    store._executor.shutdown(wait=True)
+    store.log.close()
+
+    assert studying.total_study_sec == 3600
+    assert studying.last_join_at == midnight
+    assert resting.rest_total_sec == 600
+    assert bot.last_reset_date == bot.kst_today()
+    assert bot.user_days == {}
+
+
+def test_startup_rollover_settles_only_to_last_save(tmp_path, monkeypatch):
+    """시작 시 전환: 꺼져 있던 시간은 모르니 마지막 저장 시각까지만"""
+    store = bot.StateStore(os.path.join(tmp_path, "s.sqlite3"), os.path.join(tmp_path, "log"))
+    monkeypatch.setattr(bot, "state_store", store)
+    monkeypatch.setattr(bot, "deadline_scheduler", bot.DeadlineScheduler())
+    monkeypatch.setattr(bot, "user_days", {})
+    monkeypatch.setattr(bot, "active_study_sessions", {})
+    midnight = _start_of_today()
+    yesterday = datetime.datetime.fromtimestamp(midnight - 3600, bot.KST).strftime("%Y-%m-%d")
+    monkeypatch.setattr(bot, "last_reset_date", yesterday)
+    store.saved_at = midnight - 1800
+
+    studying = bot.get_user_state(1)
+    studying.in_study = True
+    studying.last_join_at = midnight - 3600
+
+    asyncio.run(bot.start_day_rollover())
+    store._executor.shutdown(wait=True)
+    store.log.close()
+
+    assert studying.total_study_sec == 1800
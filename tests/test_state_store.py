@@ -0,0 +1,28 @@
+import asyncio
+import os
+import time
+
+import bot
+
+
+def _close_writer(store):
+    store._executor.shutdown(wait=True)
+    store.log.close()
+
+
+def test_idle_flush_advances_saved_at(tmp_path):
+    """바뀐 게 없는 기록 주기에도 saved_at이 앞으로 가야 함 (조용히 공부 중인 세션 시간을 재시작 때 잃지 않게)"""
+    db, log_dir = os.path.join(tmp_path, "s.sqlite3"), os.path.join(tmp_path, "log")
+    store = bot.StateStore(db, log_dir)
+    store.mark_meta_dirty()
+    store.checkpoint()
+    first_flush = time.time()
+    time.sleep(0.05)
+    store.checkpoint()  # 아무것도 안 바뀜 → beat 레코드만
+    _close_writer(store)
+
+    reloaded = bot.StateStore(db, log_dir)
+    asyncio.run(reloaded.load())
+    _close_writer(reloaded)
+    assert reloaded.replayed == 2
+    assert reloaded.saved_at >= first_flush + 0.05